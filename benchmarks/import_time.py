@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Reports the slowest imports when starting tconnectsync for several
+commands, using python -X importtime. Commands which would contact
+t:connect are only imported, not run.
+
+Run from the repository root with:
+
+    python3 -m benchmarks.import_time [--top 10] [--repeat 3]
+"""
+import sys
+import argparse
+
+from tests.test_import_time import import_times
+
+COMMANDS = (
+    ("main.py --help", ('main.py', '--help')),
+    ("tconnectsync.api", ('-c', 'import tconnectsync.api')),
+    ("tconnectsync.check", ('-c', 'import tconnectsync.check')),
+    ("tconnectsync.process", ('-c', 'import tconnectsync.process')),
+    ("tconnectsync.api.controliq", ('-c', 'import tconnectsync.api.controliq')),
+)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark tconnectsync import times")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    # Modules imported by the interpreter itself are not counted
+    startup = set(import_times('-c', 'pass'))
+
+    for name, command in COMMANDS:
+        best = None
+        for _ in range(args.repeat):
+            times = {m: t for m, t in import_times(*command).items() if m not in startup}
+            if best is None or sum(times.values()) < sum(best.values()):
+                best = times
+
+        top_level = sum(t for m, t in best.items() if '.' not in m)
+        print("%-28s %8.1f ms, %d modules" % (name, top_level / 1000, len(best)))
+        for module, t in sorted(best.items(), key=lambda x: -x[1])[:args.top]:
+            print("    %-32s %8.1f ms" % (module, t / 1000))
+        print()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measures how parsing and processing t:connect data scales with the number
+of days synchronized, on synthetic therapy timeline JSON and CSV. For each
+stage, reports the rows processed per second and the peak memory
+allocated while processing, which does not include the input.
+
+Run from the repository root with:
+
+    python3 -m benchmarks.parse_scale [--days 1 --days 30 --days 365 --days 1000] [--repeat 3] [--no-memory]
+"""
+import sys
+import time
+import argparse
+import datetime
+import tracemalloc
+
+from tconnectsync.api.ws2 import WS2Api
+from tconnectsync.parser.tconnect import TConnectEntry
+from tconnectsync.parser.columnar import build_timeline_columns
+from tconnectsync.sync.basal import process_ciq_basal_events
+from tconnectsync.sync.bolus import process_bolus_events
+from tconnectsync.sync.iob import process_iob_events
+
+from tests.synthetic import SyntheticHistory
+
+DEFAULT_DAYS = (1, 30, 365, 1000)
+
+END = datetime.date(2021, 4, 1)
+
+def ciq_rows(data):
+    return sum(len(events) for events in data["basal"].values()) + len(data["suspensionDeliveryEvents"])
+
+def consume(iterable):
+    count = 0
+    for _ in iterable:
+        count += 1
+    return count
+
+"""
+Returns a list of (stage name, function, input, number of input rows)
+for the given synthetic history and range.
+"""
+def stages(history, start, end):
+    ws2 = WS2Api('benchmark')
+    ciq = history.ciq_therapy_timeline(start, end)
+    text = history.therapy_timeline_csv(start, end)
+    csv = ws2._parse_therapy_timeline_csv(text)
+    csv_rows = sum(len(rows) for rows in csv.values())
+
+    return [
+        ("csv parse", ws2._parse_therapy_timeline_csv, text, csv_rows),
+        ("csv stream", lambda lines: consume(ws2._iter_therapy_timeline_csv(lines)), text.splitlines(), csv_rows),
+        ("csv columnar", lambda lines: build_timeline_columns(ws2._iter_therapy_timeline_csv(lines)), text.splitlines(), csv_rows),
+        ("cgm entries", lambda rows: [TConnectEntry.parse_cgm_entry(r) for r in rows], csv["readingData"], len(csv["readingData"])),
+        ("ciq basal", process_ciq_basal_events, ciq, ciq_rows(ciq)),
+        ("bolus", process_bolus_events, csv["bolusData"], len(csv["bolusData"])),
+        ("iob", process_iob_events, csv["iobData"], len(csv["iobData"])),
+    ]
+
+def timed(fn, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+"""
+Returns the peak memory, in bytes, allocated by fn(arg). Tracing slows
+down allocation, so this is measured separately from timing.
+"""
+def peak_memory(fn, arg):
+    tracemalloc.start()
+    try:
+        result = fn(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark parsing and processing by number of days")
+    parser.add_argument('--days', type=int, action='append', help='Number of days (may be repeated)')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='Skip measuring peak memory')
+    args = parser.parse_args(argv)
+
+    history = SyntheticHistory(seed=args.seed)
+
+    print("%6s  %-14s %10s %10s %12s %12s" % ("days", "stage", "rows", "seconds", "rows/sec", "peak MiB"))
+    for days in args.days or DEFAULT_DAYS:
+        start = END - datetime.timedelta(days=days - 1)
+        for name, fn, arg, rows in stages(history, start, END):
+            elapsed = timed(fn, arg, args.repeat)
+            peak = "-" if args.no_memory else "%.1f" % (peak_memory(fn, arg) / 2**20)
+            print("%6d  %-14s %10d %10.3f %12.0f %12s" % (days, name, rows, elapsed, rows / elapsed, peak))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Measures an end-to-end sync against the local stand-in t:connect and
+Nightscout servers, with configurable latency, error rates and data
+volume, and reports throughput and the requests made to each route.
+
+Run from the repository root with:
+
+    python3 -m benchmarks.standin_sync [--days 7] [--latency 0.05] [--error-rate ws2_csv=0.3]
+"""
+import sys
+import time
+import argparse
+import datetime
+from unittest import mock
+
+from tconnectsync.api import TConnectApi
+from tconnectsync.api.ws2 import WS2Api
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.process import process_time_range
+
+from tests.standin import TConnectStandin, NightscoutStandin, _error_rates
+from tests.synthetic import SyntheticHistory
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark syncing against stand-in servers")
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds of latency added to each request')
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', action='append', help='ROUTE=RATE, e.g. ws2_csv=0.3')
+    parser.add_argument('--retry-backoff', type=float, default=0.1, help='Replaces the 60 second WS2 retry backoff')
+    parser.add_argument('--boluses-per-day', type=int, default=6)
+    args = parser.parse_args(argv)
+
+    knobs = dict(latency=args.latency, jitter=args.jitter, error_rates=_error_rates(args.error_rate))
+    history = SyntheticHistory(boluses_per_day=args.boluses_per_day)
+    time_end = datetime.datetime(2021, 4, 1)
+    time_start = time_end - datetime.timedelta(days=args.days - 1)
+
+    with TConnectStandin(history, **knobs) as tconnect_server, NightscoutStandin(**knobs) as nightscout_server, \
+            tconnect_server.patch_apis(), mock.patch.object(WS2Api, 'RETRY_BACKOFF_SECONDS', args.retry_backoff):
+        tconnect = TConnectApi(tconnect_server.email, tconnect_server.password)
+        nightscout = NightscoutApi(nightscout_server.url, nightscout_server.secret)
+
+        start = time.perf_counter()
+        added = process_time_range(tconnect, nightscout, time_start, time_end, pretend=False)
+        elapsed = time.perf_counter() - start
+
+        print("Synced %d days: added %d items in %.2f s (%.0f items/sec)" % (args.days, added, elapsed, added / elapsed))
+        for name, server in (("t:connect", tconnect_server), ("Nightscout", nightscout_server)):
+            print("%s requests:" % name)
+            for route, count in sorted(server.requests.items()):
+                print("    %-24s %6d  (%d injected errors)" % (route, count, server.errors[route]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
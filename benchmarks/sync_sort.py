@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Compares sorting and filtering processed t:connect events by their
+precomputed epoch against re-parsing each event's time with arrow, on a
+synthetic 90 day dataset.
+
+Run from the repository root with:
+
+    python3 -m benchmarks.sync_sort [--days 90] [--repeat 3]
+"""
+import sys
+import time
+import random
+import argparse
+import datetime
+
+import arrow
+
+from tconnectsync.parser.tconnect import TConnectEntry
+from tconnectsync.sync.basal import process_ciq_basal_events, add_csv_basal_events
+from tconnectsync.sync.bolus import process_bolus_events
+from tconnectsync.sync.iob import process_iob_events
+
+# ControlIQ epochs hold the user's wall time read in Pacific time.
+START = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+def generate_ciq_timeline(days):
+    rand = random.Random(days)
+    start = int(START.timestamp())
+    algorithm, profile, suspensions = [], [], []
+    for i in range(days * 288):
+        x = start + i * 300
+        algorithm.append({"x": x, "y": round(rand.uniform(0.2, 2.0), 3), "duration": 300})
+        if i % 288 == 0:
+            profile.append({"x": x + 1, "y": 0.8, "duration": 3600})
+        if i % 500 == 0:
+            suspensions.append({"x": x, "continuation": None, "suspendReason": "control-iq"})
+    rand.shuffle(algorithm)
+    return {
+        "basal": {
+            "tempDeliveryEvents": [],
+            "algorithmDeliveryEvents": algorithm,
+            "profileDeliveryEvents": profile,
+        },
+        "suspensionDeliveryEvents": suspensions,
+    }
+
+def _csv_time(i, step_minutes):
+    return (START + datetime.timedelta(minutes=i * step_minutes)).strftime('%Y-%m-%dT%H:%M:%S')
+
+def generate_csv_basal(days):
+    return [{"EventDateTime": _csv_time(i, 30), "BasalRate": "0.8"} for i in range(days * 48)]
+
+def generate_iob(days):
+    return [{"EventDateTime": _csv_time(i, 5), "IOB": "1.50", "EventID": str(i)} for i in range(days * 288)]
+
+def generate_bolus(days):
+    rows = []
+    for i in range(days * 6):
+        t = _csv_time(i, 240)
+        rows.append({
+            "Description": "Standard",
+            "CompletionStatusDesc": "Completed",
+            "BolexCompletionStatusDesc": "",
+            "BolusIsComplete": "1",
+            "ExtendedBolusIsComplete": "",
+            "RequestDateTime": t,
+            "CompletionDateTime": t,
+            "BolexCompletionDateTime": "",
+            "BolexStartDateTime": "",
+            "InsulinDelivered": "2.00",
+            "CarbSize": "30",
+            "UserOverride": "0",
+        })
+    return rows
+
+"""
+The previous implementation: every comparison re-parses the event time.
+"""
+def arrow_sort_and_filter(events, last_upload_time):
+    events = sorted(events, key=lambda x: arrow.get(x.time))
+    return [e for e in events if arrow.get(e.time) >= last_upload_time]
+
+def arrow_csv_durations(events):
+    last = None
+    for e in events:
+        if last:
+            e.duration_mins = (arrow.get(e.time) - arrow.get(last.time)).seconds // 60
+        last = e
+
+def epoch_sort_and_filter(events, last_upload_time):
+    last_upload_epoch = last_upload_time.int_timestamp
+    events = sorted(events, key=lambda x: x.epoch)
+    return [e for e in events if e.epoch >= last_upload_epoch]
+
+def epoch_csv_durations(events):
+    last = None
+    for e in events:
+        if last:
+            e.duration_mins = ((e.epoch - last.epoch) % 86400) // 60
+        last = e
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark sorting and filtering of processed sync events")
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    ciq = generate_ciq_timeline(args.days)
+    csv_basal = generate_csv_basal(args.days)
+    iob = generate_iob(args.days)
+    bolus = generate_bolus(args.days)
+
+    basal_events = process_ciq_basal_events(ciq)
+    csv_basal_events = [TConnectEntry.parse_csv_basal_entry(r) for r in csv_basal]
+    iob_events = process_iob_events(iob)
+    bolus_events = process_bolus_events(bolus)
+    all_events = basal_events + iob_events + bolus_events
+    last_upload_time = arrow.get(all_events[len(all_events) // 2].time)
+
+    print("Dataset: %d days, %d basal, %d csv basal, %d iob, %d bolus events" % (
+        args.days, len(basal_events), len(csv_basal_events), len(iob_events), len(bolus_events)))
+
+    results = [
+        ("sort + filter",
+            timed(lambda: arrow_sort_and_filter(all_events, last_upload_time), args.repeat),
+            timed(lambda: epoch_sort_and_filter(all_events, last_upload_time), args.repeat)),
+        ("csv basal durations",
+            timed(lambda: arrow_csv_durations(csv_basal_events), args.repeat),
+            timed(lambda: epoch_csv_durations(csv_basal_events), args.repeat)),
+    ]
+
+    print("%-22s %12s %12s %9s" % ("", "arrow (s)", "epoch (s)", "speedup"))
+    for name, arrow_time, epoch_time in results:
+        print("%-22s %12.4f %12.4f %8.1fx" % (name, arrow_time, epoch_time, arrow_time / epoch_time))
+
+    print()
+    print("End-to-end processing with epoch keys:")
+    for name, fn in (
+        ("process_ciq_basal_events", lambda: process_ciq_basal_events(ciq)),
+        ("add_csv_basal_events", lambda: add_csv_basal_events([], csv_basal)),
+        ("process_iob_events", lambda: process_iob_events(iob)),
+        ("process_bolus_events", lambda: process_bolus_events(bolus)),
+    ):
+        print("  %-26s %8.4f s" % (name, timed(fn, args.repeat)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,27 +1,19 @@
 #!/usr/bin/env python3
 
 import sys
-import datetime
-import arrow
 import argparse
 import logging
 
-from tconnectsync.api import TConnectApi
-from tconnectsync.process import process_time_range
-from tconnectsync.autoupdate import process_auto_update
-from tconnectsync.check import check_login
-from tconnectsync.nightscout import NightscoutApi
+# Other modules are imported only once arguments are parsed, and only when
+# they are needed, so that --help and --check-login start quickly.
 
-try:
-    from tconnectsync.secret import (
-        TCONNECT_EMAIL,
-        TCONNECT_PASSWORD,
-        NS_URL,
-        NS_SECRET
-    )
-except Exception:
-    print('Unable to read secret.py')
-    sys.exit(1)
+def load_secret():
+    try:
+        from tconnectsync import secret
+    except Exception:
+        print('Unable to read secret.py')
+        sys.exit(1)
+    return secret
 
 
 def parse_args():
@@ -32,6 +24,17 @@ def parse_args():
     parser.add_argument('--end-date', dest='end_date', type=str, default=None, help='The newest date to process data until (inclusive). Must be specified with --start-date.')
     parser.add_argument('--days', dest='days', type=int, default=1, help='The number of days of t:connect data to read in. Cannot be used with --from-date and --until-date.')
     parser.add_argument('--auto-update', dest='auto_update', action='store_const', const=True, default=False, help='If set, continuously checks for updates from t:connect and syncs with Nightscout.')
+    parser.add_argument('--daemon', dest='daemon', action='store_const', const=True, default=False, help='With --auto-update: polls for new t:connect data while syncing with Nightscout, and shuts down gracefully on SIGINT or SIGTERM; a second signal exits immediately.')
+    parser.add_argument('--backfill', dest='backfill', action='store_const', const=True, default=False, help='Backfill mode: splits the range between --start-date and --end-date into chunks which are downloaded concurrently.')
+    parser.add_argument('--chunk-days', dest='chunk_days', type=int, default=None, help='The number of days of data to download per request in backfill mode. (default: BACKFILL_CHUNK_DAYS)')
+    parser.add_argument('--journal', dest='journal', type=str, default=None, help='Backfill mode: path to a checkpoint journal file. If a backfill is restarted with the same journal, previously completed work is skipped. (default: BACKFILL_JOURNAL_PATH)')
+    parser.add_argument('--accounts', dest='accounts', type=str, default=None, help='Multi-account mode: continuously checks for updates for each account in the given JSON file, and syncs them with their Nightscout sites.')
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=None, help='With --auto-update or --accounts: serves Prometheus metrics at http://METRICS_HOST:PORT/metrics. (default: METRICS_PORT)')
+    parser.add_argument('--trace', dest='trace', type=str, default=None, help='Writes timing spans for each stage of syncing, including each API request, to the given file. (default: TRACE_PATH)')
+    parser.add_argument('--trace-format', dest='trace_format', choices=('jsonl', 'chrome'), default=None, help='The format of the --trace file: JSON lines, or Chrome trace events for chrome://tracing or Perfetto. (default: TRACE_FORMAT)')
+    parser.add_argument('--profile', dest='profile', type=str, default=None, metavar='FILE', help='Profiles the sync, or each --auto-update cycle, and writes the results to the given pstats file, with a summary of the slowest functions in FILE.txt.')
+    parser.add_argument('--profile-top', dest='profile_top', type=int, default=25, help='The number of functions to include in the --profile summary. (default: 25)')
+    parser.add_argument('--profile-cpu-only', dest='profile_cpu_only', action='store_const', const=True, default=False, help='With --profile: downloads the t:connect data first, and only profiles parsing and processing it, without uploading to Nightscout.')
     parser.add_argument('--check-login', dest='check_login', action='store_const', const=True, default=False, help='If set, checks that the provided t:connect credentials can be used to log in.')
 
     return parser.parse_args()
@@ -51,33 +54,155 @@ def main():
             format='%(asctime)s %(levelname)-8s %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S')
 
+    secret = load_secret()
+
     if args.auto_update and (args.start_date or args.end_date):
         raise Exception('Auto-update cannot be used with start/end date')
 
+    if args.accounts and (args.start_date or args.end_date or args.backfill or args.check_login):
+        raise Exception('Multi-account mode cannot be used with start/end date, backfill or check login')
+
+    if args.daemon and not args.auto_update:
+        raise Exception('Daemon mode requires auto-update')
+
+    if args.backfill and not (args.start_date and args.end_date):
+        raise Exception('Backfill requires a start and end date')
+
+    if args.profile and (args.accounts or args.backfill or args.check_login):
+        raise Exception('Profiling cannot be used with multi-account mode, backfill or check login')
+
+    if args.profile_cpu_only and (not args.profile or args.auto_update):
+        raise Exception('CPU-only profiling requires --profile, and cannot be used with auto-update')
+
     if args.start_date and args.end_date:
+        import arrow
         time_start = arrow.get(args.start_date)
         time_end = arrow.get(args.end_date)
     else:
+        import datetime
         time_end = datetime.datetime.now()
         time_start = time_end - datetime.timedelta(days=args.days)
 
     if time_end < time_start:
         raise Exception('time_start must be before time_end')
 
-    tconnect = TConnectApi(TCONNECT_EMAIL, TCONNECT_PASSWORD)
-
-    nightscout = NightscoutApi(NS_URL, NS_SECRET)
+    cache = None
+    if secret.CACHE_DIR:
+        from tconnectsync.cache import ResponseCache
+        cache = ResponseCache(secret.CACHE_DIR, immutable_days=secret.CACHE_IMMUTABLE_DAYS, ttl_seconds=secret.CACHE_TTL_SECONDS)
+
+    trace_path = args.trace or secret.TRACE_PATH
+    if trace_path:
+        import atexit
+        from tconnectsync import tracing
+        exporter = tracing.file_exporter(trace_path, args.trace_format or secret.TRACE_FORMAT)
+        tracing.configure(exporter)
+        atexit.register(exporter.close)
+
+    profiler = None
+    if args.profile:
+        from tconnectsync import profiling
+        profiler = profiling.Profiler(args.profile, top=args.profile_top)
+        profiling.configure(profiler)
+
+    metrics_port = args.metrics_port if args.metrics_port is not None else secret.METRICS_PORT
+    if metrics_port and (args.auto_update or args.accounts):
+        from tconnectsync.metrics import start_metrics_server
+        start_metrics_server(metrics_port, host=secret.METRICS_HOST)
+
+    if args.accounts:
+        return run_service(args, secret, time_start, time_end, cache)
+
+    token_store = None
+    if secret.TOKEN_STORE_PATH:
+        from tconnectsync.tokenstore import TokenStore
+        if TokenStore.available():
+            # Unless a separate secret is given, tokens are encrypted with the t:connect password
+            token_store = TokenStore(secret.TOKEN_STORE_PATH, secret.TOKEN_STORE_SECRET or secret.TCONNECT_PASSWORD)
+        else:
+            logging.warning("TOKEN_STORE_PATH is set, but the cryptography package is not installed: logins will not be stored")
+
+    from tconnectsync.api import TConnectApi
+    tconnect = TConnectApi(secret.TCONNECT_EMAIL, secret.TCONNECT_PASSWORD, cache=cache, token_store=token_store)
 
     if args.check_login:
+        from tconnectsync.check import check_login
         return check_login(tconnect, time_start, time_end)
 
-    if args.auto_update:
+    if args.profile_cpu_only:
+        from tconnectsync.profiling import profile_cpu_stages
+        print("Profiling parsing and processing of data between", time_start, "and", time_end)
+        added = profile_cpu_stages(tconnect, time_start, time_end)
+        print("Would have added", added, "items")
+        print(profiler.summary())
+        return
+
+    from tconnectsync.nightscout import NightscoutApi
+    nightscout = NightscoutApi(secret.NS_URL, secret.NS_SECRET, pool_size=secret.NS_POOL_SIZE, batch_size=secret.NS_UPLOAD_BATCH_SIZE)
+
+    if args.auto_update and args.daemon:
+        from tconnectsync.daemon import run_auto_update_daemon
+        print("Starting auto-update daemon between", time_start, "and", time_end, "(PRETEND)" if args.pretend else "")
+        sys.exit(run_auto_update_daemon(tconnect, nightscout, time_start, time_end, args.pretend))
+    elif args.auto_update:
+        from tconnectsync.autoupdate import process_auto_update
         print("Starting auto-update between", time_start, "and", time_end, "(PRETEND)" if args.pretend else "")
         process_auto_update(tconnect, nightscout, time_start, time_end, args.pretend)
+    elif args.backfill:
+        from tconnectsync.backfill import process_backfill
+        from tconnectsync.journal import BackfillJournal
+        journal_path = args.journal or secret.BACKFILL_JOURNAL_PATH
+        print("Backfilling data between", time_start, "and", time_end, "(PRETEND)" if args.pretend else "")
+        added = process_backfill(tconnect, nightscout, time_start, time_end, args.pretend,
+            chunk_days=args.chunk_days or secret.BACKFILL_CHUNK_DAYS,
+            max_workers=secret.BACKFILL_MAX_WORKERS,
+            requests_per_minute=secret.BACKFILL_REQUESTS_PER_MINUTE,
+            journal=BackfillJournal(journal_path) if journal_path else None)
+        print("Added", added, "items")
     else:
+        from tconnectsync.process import process_time_range
         print("Processing data between", time_start, "and", time_end, "(PRETEND)" if args.pretend else "")
         added = process_time_range(tconnect, nightscout, time_start, time_end, args.pretend)
         print("Added", added, "items")
+        if profiler:
+            print(profiler.summary())
+
+"""
+Runs the multi-account sync service until SIGINT or SIGTERM.
+"""
+def run_service(args, secret, time_start, time_end, cache):
+    import signal
+    from tconnectsync.service import load_accounts, create_service
+
+    accounts = load_accounts(args.accounts)
+
+    token_store = None
+    if secret.TOKEN_STORE_PATH:
+        from tconnectsync.tokenstore import TokenStore
+        if not TokenStore.available():
+            logging.warning("TOKEN_STORE_PATH is set, but the cryptography package is not installed: logins will not be stored")
+        elif not secret.TOKEN_STORE_SECRET:
+            # Each account has its own password, so none can encrypt a shared store
+            logging.warning("TOKEN_STORE_SECRET must be set to store logins in multi-account mode")
+        else:
+            token_store = TokenStore(secret.TOKEN_STORE_PATH, secret.TOKEN_STORE_SECRET)
+
+    service = create_service(accounts, time_start, time_end, args.pretend,
+        max_workers=secret.SERVICE_MAX_WORKERS,
+        requests_per_minute=secret.SERVICE_REQUESTS_PER_MINUTE,
+        batch_size=secret.NS_UPLOAD_BATCH_SIZE,
+        cache=cache,
+        token_store=token_store)
+
+    def on_signal(signum, frame):
+        logging.info("Received signal %d: stopping after accounts in progress complete" % signum)
+        service.stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    print("Starting multi-account sync of", len(accounts), "accounts between", time_start, "and", time_end, "(PRETEND)" if args.pretend else "")
+    service.run()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -12,4 +12,4 @@ CUR_DATE=$(python3 -c "import datetime; print(str(datetime.datetime.now()).split
 echo "Will run with start date $SINCE_DATE and end date $CUR_DATE"
 
 PRETEND="--pretend"
-$PIPENV run python3 -u ../main.py --start-date "$SINCE_DATE" --end-date "$CUR_DATE" $PRETEND
\ No newline at end of file
+$PIPENV run python3 -u ../main.py --backfill --start-date "$SINCE_DATE" --end-date "$CUR_DATE" $PRETEND
\ No newline at end of file
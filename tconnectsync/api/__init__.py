@@ -1,12 +1,34 @@
 import logging
-
-from .android import AndroidApi
-from .controliq import ControlIQApi
-from .ws2 import WS2Api
+import importlib
 
 logger = logging.getLogger(__name__)
 
-"""A wrapper for the three different t:connect API types."""
+_API_MODULES = {
+    'AndroidApi': 'android',
+    'ControlIQApi': 'controliq',
+    'WS2Api': 'ws2',
+}
+
+"""
+Imports the API classes, and their modules, the first time they are
+accessed from this package, so that `from tconnectsync.api import WS2Api`
+keeps working without slowing down `import tconnectsync.api`.
+Module-level __getattr__ requires Python 3.7; on 3.6 import the classes
+from their own modules.
+"""
+def __getattr__(name):
+    if name in _API_MODULES:
+        module = importlib.import_module('.' + _API_MODULES[name], __name__)
+        return getattr(module, name)
+    if name in _API_MODULES.values():
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+"""
+A wrapper for the three different t:connect API types. Each API module
+is only imported when it is first used, since they import requests and
+HTML parsing libraries which are slow to load.
+"""
 class TConnectApi:
     email = None
     password = None
@@ -15,9 +37,16 @@ class TConnectApi:
     _ws2 = None
     _android = None
 
-    def __init__(self, email, password):
+    cache = None
+    token_store = None
+    limiter = None
+
+    def __init__(self, email, password, cache=None, token_store=None, limiter=None):
         self.email = email
         self.password = password
+        self.cache = cache
+        self.token_store = token_store
+        self.limiter = limiter
 
 
     @property
@@ -26,8 +55,9 @@ class TConnectApi:
             return self._ciq
 
         logger.debug("Instantiating new ControlIQApi")
+        from .controliq import ControlIQApi
 
-        self._ciq = ControlIQApi(self.email, self.password)
+        self._ciq = ControlIQApi(self.email, self.password, cache=self.cache, token_store=self.token_store, limiter=self.limiter)
         return self._ciq
 
     @property
@@ -36,21 +66,25 @@ class TConnectApi:
             return self._ws2
 
         logger.debug("Instantiating new WS2Api")
+        from .ws2 import WS2Api
 
         # Trigger login or re-login via controliq api if necessary
         # so userGuid can be accessed from it
         self.controliq
 
-        self._ws2 = WS2Api(self._ciq.userGuid)
+        self._ws2 = WS2Api(self._ciq.userGuid, cache=self.cache, limiter=self.limiter)
         return self._ws2
 
     @property
     def android(self):
-        if self._android and not self._android.needs_relogin():
+        if self._android:
+            # Renews the access token with the refresh token if necessary
+            self._android.ensure_token()
             return self._android
 
         logger.debug("Instantiating new AndroidApi")
+        from .android import AndroidApi
 
-        self._android = AndroidApi(self.email, self.password)
+        self._android = AndroidApi(self.email, self.password, token_store=self.token_store, limiter=self.limiter)
         return self._android
 
@@ -5,12 +5,11 @@ import datetime
 import csv
 import base64
 import arrow
-import time
 import logging
 
-from bs4 import BeautifulSoup
-
+from .. import metrics, tracing
 from ..util import timeago
+from ..util.http import limited_session
 from .common import ApiException, ApiLoginException
 
 logger = logging.getLogger(__name__)
@@ -37,24 +36,71 @@ class AndroidApi:
     userId = None
     patientObjectId = None
 
-    def __init__(self, email, password):
-        self.login(email, password)
+    token_store = None
+    limiter = None
+    session = None
+
+    TOKEN_FIELDS = ('accessToken', 'accessTokenExpiresAt', 'refreshToken', 'refreshTokenExpiresAt', 'userId', 'patientObjectId')
+
+    # The access token is renewed when it expires within this many seconds
+    REFRESH_BEFORE_SECONDS = 5 * 60
+
+    def __init__(self, email, password, token_store=None, limiter=None):
+        self.token_store = token_store
+        self.limiter = limiter
+        # Requests are rate limited by a session, if a limiter is given
+        if limiter is not None:
+            self.session = limited_session(limiter)
         self._email = email
         self._password = password
+        if not self._load_tokens():
+            self._login()
 
-    def login(self, email, password):
-        r = requests.post(
+    """
+    Restores a previous login from the token store. Returns whether a
+    stored refresh token was found. If the stored access token has
+    expired, it is renewed with the refresh token.
+    """
+    def _load_tokens(self):
+        if not self.token_store:
+            return False
+
+        tokens = self.token_store.load('android', self._email, expires_key='refreshTokenExpiresAt')
+        if not tokens:
+            return False
+
+        for field in self.TOKEN_FIELDS:
+            setattr(self, field, tokens[field])
+        logger.info("Using stored AndroidApi login (expiration: %s, %s)" % (self.accessTokenExpiresAt, timeago(self.accessTokenExpiresAt)))
+        self.ensure_token()
+        return True
+
+    def _save_tokens(self):
+        if self.token_store:
+            self.token_store.save('android', self._email, {field: getattr(self, field) for field in self.TOKEN_FIELDS})
+
+    @tracing.traced('android_login')
+    def _login(self):
+        self.login(self._email, self._password)
+        self._save_tokens()
+
+    def _oauth_token(self, data):
+        return (self.session or requests).post(
             self.BASE_URL + self.OAUTH_TOKEN_PATH,
-            {
-                'username': email,
-                'password': password,
-                'grant_type': 'password',
-                'scope': self.OAUTH_SCOPES
-            },
+            data,
             headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            auth=requests.auth.HTTPBasicAuth(self.ANDROID_API_USERNAME, self.ANDROID_API_PASSWORD)
+            auth=requests.auth.HTTPBasicAuth(self.ANDROID_API_USERNAME, self.ANDROID_API_PASSWORD),
+            hooks=metrics.hooks('android')
         )
 
+    def login(self, email, password):
+        r = self._oauth_token({
+            'username': email,
+            'password': password,
+            'grant_type': 'password',
+            'scope': self.OAUTH_SCOPES
+        })
+
         if r.status_code != 200:
             raise ApiLoginException(r.status_code, 'Received HTTP %s during login: %s' % (r.status_code, r.text))
 
@@ -62,16 +108,70 @@ class AndroidApi:
         if "user" not in j or not j["user"]:
             raise ApiException(r.status_code, 'No user details present in AndroidApi oauth response: %s' % r.text)
 
+        self._set_tokens(j)
+        metrics.LOGINS.inc(api='android', kind='login')
+
+        logger.info("Logged in to AndroidApi successfully (expiration: %s, %s)" % (self.accessTokenExpiresAt, timeago(self.accessTokenExpiresAt)))
+
+    """
+    Obtains a new access token using the refresh token from a previous
+    login, which avoids a full login with the account password.
+    """
+    @tracing.traced('android_refresh')
+    def refresh(self):
+        if not self.refreshToken:
+            raise ApiLoginException(None, 'No refresh token present for AndroidApi')
+
+        r = self._oauth_token({
+            'grant_type': 'refresh_token',
+            'refresh_token': self.refreshToken,
+            'scope': self.OAUTH_SCOPES
+        })
+
+        if r.status_code != 200:
+            raise ApiLoginException(r.status_code, 'Received HTTP %s during token refresh: %s' % (r.status_code, r.text))
+
+        self._set_tokens(r.json())
+        self._save_tokens()
+        metrics.LOGINS.inc(api='android', kind='refresh')
+
+        logger.info("Refreshed AndroidApi access token (expiration: %s, %s)" % (self.accessTokenExpiresAt, timeago(self.accessTokenExpiresAt)))
+
+    def _set_tokens(self, j):
         self.accessToken = j["accessToken"]
         self.accessTokenExpiresAt = j["accessTokenExpiresAt"]
-        # NOTE: the refresh token is currently unused, instead a new access
-        # token is obtained from scratch by re-logging in when it expires.
-        self.refreshToken = j["refreshToken"]
-        self.refreshTokenExpiresAt = j["refreshTokenExpiresAt"]
-        self.userId = j["user"]["id"]
-        self.patientObjectId = j["user"]["patientObjectId"]
+        # The refresh token may or may not be rotated on refresh
+        self.refreshToken = j.get("refreshToken", self.refreshToken)
+        self.refreshTokenExpiresAt = j.get("refreshTokenExpiresAt", self.refreshTokenExpiresAt)
+        if j.get("user"):
+            self.userId = j["user"]["id"]
+            self.patientObjectId = j["user"]["patientObjectId"]
 
-        logger.info("Logged in to AndroidApi successfully (expiration: %s, %s)" % (self.accessTokenExpiresAt, timeago(self.accessTokenExpiresAt)))
+    @staticmethod
+    def _expires_within(expires_at, seconds):
+        return (arrow.get(expires_at) - arrow.get()).total_seconds() <= seconds
+
+    """
+    Renews the access token with the refresh token, falling back to a
+    full login if the refresh token has expired or is rejected.
+    """
+    def renew_token(self):
+        if self.refreshToken and self.refreshTokenExpiresAt and not self._expires_within(self.refreshTokenExpiresAt, self.REFRESH_BEFORE_SECONDS):
+            try:
+                return self.refresh()
+            except ApiException as e:
+                logger.warning("Unable to refresh AndroidApi access token, logging in again: %s" % e)
+
+        self._login()
+
+    """
+    Renews the access token if it expires within min_validity seconds.
+    """
+    def ensure_token(self, min_validity=None):
+        if min_validity is None:
+            min_validity = self.REFRESH_BEFORE_SECONDS
+        if self.accessTokenExpiresAt and self._expires_within(self.accessTokenExpiresAt, min_validity):
+            self.renew_token()
 
     def needs_relogin(self):
         diff = (arrow.get(self.accessTokenExpiresAt) - arrow.get())
@@ -83,23 +183,23 @@ class AndroidApi:
         return {'Authorization': 'Bearer %s' % self.accessToken}
 
     def _get(self, endpoint, query={}, **kwargs):
-        r = requests.get(self.BASE_URL + endpoint, query, headers=self.api_headers(), **kwargs)
+        r = (self.session or requests).get(self.BASE_URL + endpoint, params=query, headers=self.api_headers(), hooks=metrics.hooks('android'), **kwargs)
 
         if r.status_code != 200:
             raise ApiException(r.status_code, "Android API HTTP %s response: %s" % (str(r.status_code), r.text))
         return r.json()
 
     def get(self, endpoint, query={}, tries=0, **kwargs):
+        self.ensure_token()
         try:
             return self._get(endpoint, query, **kwargs)
         except ApiException as e:
             if tries > 0:
                 raise ApiException(e.status_code, "Android API HTTP %s on retry #%d: %s" % (e.status_code, tries, e))
 
-            # Trigger automatic re-login, and try again once
+            # Trigger automatic token renewal, and try again once
             if e.status_code == 401:
-                self.accessTokenExpiresAt = time.time()
-                self.login(self._email, self._password)
+                self.renew_token()
 
                 return self.get(endpoint, query, tries=tries+1, **kwargs)
 
@@ -110,7 +210,8 @@ class AndroidApi:
 
 
     def post(self, endpoint, query={}, **kwargs):
-        r = requests.post(self.BASE_URL + endpoint, query, headers=self.api_headers(), **kwargs)
+        self.ensure_token()
+        r = (self.session or requests).post(self.BASE_URL + endpoint, query, headers=self.api_headers(), hooks=metrics.hooks('android'), **kwargs)
         if r.status_code != 200:
             raise ApiException(r.status_code, "Internal API HTTP %s response: %s" % (str(r.status_code), r.text))
         return r.json()
@@ -8,10 +8,16 @@ def parse_date(date):
 def base_headers():
     return {'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.182 Safari/537.36'}
 
+"""
+An error from a t:connect API. status_code is the HTTP status of the
+response, or None for errors raised before any request is made.
+"""
 class ApiException(Exception):
     def __init__(self, status_code, text, *args, **kwargs):
         self.status_code = status_code
-        super().__init__('%s (HTTP %s)' % (text, status_code), *args, **kwargs)
+        if status_code is not None:
+            text = '%s (HTTP %s)' % (text, status_code)
+        super().__init__(text, *args, **kwargs)
 
 class ApiLoginException(ApiException):
     pass
\ No newline at end of file
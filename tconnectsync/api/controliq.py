@@ -1,13 +1,15 @@
 import requests
 import urllib
+import json
 import datetime
 import arrow
 import time
 import logging
 
-from bs4 import BeautifulSoup
-
+from .. import metrics, tracing
 from ..util import timeago
+from ..cache import days_between
+from ..util.http import limited_session
 from .common import parse_date, base_headers, ApiException, ApiLoginException
 
 logger = logging.getLogger(__name__)
@@ -20,14 +22,57 @@ class ControlIQApi:
     accessToken = None
     accessTokenExpiresAt = None
 
-    def __init__(self, email, password):
-        self.login(email, password)
+    cache = None
+    token_store = None
+    limiter = None
+    session = None
+
+    TOKEN_FIELDS = ('userGuid', 'accessToken', 'accessTokenExpiresAt')
+
+    def __init__(self, email, password, cache=None, token_store=None, limiter=None):
+        self.cache = cache
+        self.token_store = token_store
+        self.limiter = limiter
+        # Requests are rate limited by a session, if a limiter is given
+        if limiter is not None:
+            self.session = limited_session(limiter)
         self._email = email
         self._password = password
+        if not self._load_tokens():
+            self._login()
+
+    """
+    Restores a previous login from the token store. Returns whether
+    unexpired tokens were found.
+    """
+    def _load_tokens(self):
+        if not self.token_store:
+            return False
+
+        tokens = self.token_store.load('controliq', self._email)
+        if not tokens:
+            return False
+
+        for field in self.TOKEN_FIELDS:
+            setattr(self, field, tokens[field])
+        logger.info("Using stored ControlIQApi login (expiration: %s, %s)" % (self.accessTokenExpiresAt, timeago(self.accessTokenExpiresAt)))
+        return True
+
+    @tracing.traced('controliq_login')
+    def _login(self):
+        self.login(self._email, self._password)
+        if self.token_store:
+            self.token_store.save('controliq', self._email, {field: getattr(self, field) for field in self.TOKEN_FIELDS})
 
     def login(self, email, password):
         logger.info("Logging in to ControlIQApi...")
+        # Imported here, since bs4 and lxml are only needed to log in
+        from bs4 import BeautifulSoup
+
         with requests.Session() as s:
+            if self.limiter is not None:
+                limited_session(self.limiter, s)
+            s.hooks['response'].extend(metrics.hooks('controliq')['response'])
             initial = s.get(self.LOGIN_URL, headers=base_headers())
             soup = BeautifulSoup(initial.content, features='lxml')
             data = self._build_login_data(email, password, soup)
@@ -44,6 +89,7 @@ class ControlIQApi:
             self.userGuid = req.cookies['UserGUID']
             self.accessToken = req.cookies['accessToken']
             self.accessTokenExpiresAt = req.cookies['accessTokenExpiresAt']
+            metrics.LOGINS.inc(api='controliq', kind='login')
             logger.info("Logged in to ControlIQApi successfully (expiration: %s, %s)" % (self.accessTokenExpiresAt, timeago(self.accessTokenExpiresAt)))
             return True
 
@@ -71,7 +117,7 @@ class ControlIQApi:
         return {'Authorization': 'Bearer %s' % self.accessToken, **base_headers()}
 
     def _get(self, endpoint, query):
-        r = requests.get(self.BASE_URL + endpoint, query, headers=self.api_headers())
+        r = (self.session or requests).get(self.BASE_URL + endpoint, params=query, headers=self.api_headers(), hooks=metrics.hooks('controliq'))
 
         if r.status_code != 200:
             raise ApiException(r.status_code, "ControlIQ API HTTP %s response: %s" % (str(r.status_code), r.text))
@@ -90,7 +136,7 @@ class ControlIQApi:
             if e.status_code == 401:
                 logger.info("Performing automatic re-login after HTTP 401 for ControlIQApi")
                 self.accessTokenExpiresAt = time.time()
-                self.login(self._email, self._password)
+                self._login()
 
                 return self.get(endpoint, query, tries=tries+1)
 
@@ -103,6 +149,9 @@ class ControlIQApi:
     Returns detailed basal event information and reasons for delivery suspension.
     """
     def therapy_timeline(self, start=None, end=None):
+        if self.cache and start and end and type(start) != str and type(end) != str:
+            return self._cached_therapy_timeline(start, end)
+
         startDate = parse_date(start)
         endDate = parse_date(end)
 
@@ -111,6 +160,35 @@ class ControlIQApi:
             "endDate": endDate
         })
 
+    def _cached_therapy_timeline(self, start, end):
+        days = []
+        for day in days_between(start, end):
+            days.append(self.cache.get_or_fetch('therapytimeline', self.userGuid, day,
+                lambda day=day: self.therapy_timeline(parse_date(day), parse_date(day))))
+
+        return ControlIQApi._merge_therapy_timelines(days)
+
+    """
+    Merges therapy timeline responses for consecutive date ranges into a
+    single response, concatenating lists of events. Events which appear in
+    more than one response (e.g. basal deliveries spanning midnight) are
+    only included once.
+    """
+    @staticmethod
+    def _merge_therapy_timelines(timelines):
+        def merge(a, b):
+            if isinstance(a, dict) and isinstance(b, dict):
+                return {k: merge(a[k], b[k]) if k in a and k in b else b.get(k, a.get(k)) for k in {**a, **b}}
+            if isinstance(a, list) and isinstance(b, list):
+                seen = set(json.dumps(x, sort_keys=True) for x in a)
+                return a + [x for x in b if json.dumps(x, sort_keys=True) not in seen]
+            return b if b is not None else a
+
+        merged = None
+        for t in timelines:
+            merged = t if merged is None else merge(merged, t)
+        return merged
+
     """
     Returns a summary of pump and cgm activity.
     {'averageReading': <integer>, 'timeInUseMinutes': <integer>, 'controlIqSetToOffMinutes': <integer>,
@@ -1,9 +1,15 @@
+import codecs
 import requests
 import datetime
 import csv
+import itertools
 import logging
 import time
 
+from .. import metrics, tracing
+from ..cache import days_between
+from ..parser.columnar import build_timeline_columns
+from ..util.http import limited_session
 from .common import parse_date, base_headers, ApiException
 
 logger = logging.getLogger(__name__)
@@ -12,20 +18,30 @@ class WS2Api:
     BASE_URL = 'https://tconnectws2.tandemdiabetes.com/'
 
     MAX_RETRIES = 2
+    # Retries after an HTTP 500 wait this many seconds, times the retry number
+    RETRY_BACKOFF_SECONDS = 60
 
     userGuid = None
+    cache = None
+    limiter = None
+    session = None
 
-    def __init__(self, userGuid):
+    def __init__(self, userGuid, cache=None, limiter=None):
         self.userGuid = userGuid
+        self.cache = cache
+        self.limiter = limiter
+        # Requests are rate limited by a session, if a limiter is given
+        if limiter is not None:
+            self.session = limited_session(limiter)
 
     def get(self, endpoint, query):
-        r = requests.get(self.BASE_URL + endpoint, query, headers=base_headers())
+        r = (self.session or requests).get(self.BASE_URL + endpoint, params=query, headers=base_headers(), hooks=metrics.hooks('ws2'))
         if r.status_code != 200:
             raise ApiException(r.status_code, "WS2 API HTTP %s response: %s" % (str(r.status_code), r.text))
         return r.text
 
     def get_jsonp(self, endpoint):
-        r = requests.get(self.BASE_URL + endpoint, {'callback': 'cb'}, headers=base_headers())
+        r = (self.session or requests).get(self.BASE_URL + endpoint, params={'callback': 'cb'}, headers=base_headers(), hooks=metrics.hooks('ws2'))
         if r.status_code != 200:
             raise ApiException(r.status_code, "WS2 API HTTP %s response: %s" % (str(r.status_code), r.text))
 
@@ -37,73 +53,189 @@ class WS2Api:
 
         return t
 
-    def _split_empty_sections(self, text):
-        sections = [[]]
-        sectionIndex = 0
-        for line in text.splitlines():
-            if len(line.strip()) > 0:
-                sections[sectionIndex].append(line)
-            else:
-                sections.append([])
-                sectionIndex += 1
-
-        return sections + [None] * (4 - len(sections))
-
-    def _csv_to_dict(self, rawdata):
-        data = []
-        if not rawdata or len(rawdata) == 0:
-            return data
-        headers = rawdata[0].split(",")
-        for row in csv.reader(rawdata[1:]):
-            data.append({headers[i]: row[i] for i in range(len(row)) if i < len(headers)})
+    """
+    Performs a streaming GET request, returning an iterator over the lines of
+    the response body. The body is never held in memory in full.
+    """
+    def get_lines(self, endpoint, query):
+        r = (self.session or requests).get(self.BASE_URL + endpoint, params=query, headers=base_headers(), stream=True, hooks=metrics.hooks('ws2'))
+        if r.status_code != 200:
+            raise ApiException(r.status_code, "WS2 API HTTP %s response: %s" % (str(r.status_code), r.text))
 
-        return data
+        return self._iter_response_lines(r)
 
+    CHUNK_SIZE = 64 * 1024
 
-    def therapy_timeline_csv(self, start=None, end=None, tries=0):
-        startDate = parse_date(start)
-        endDate = parse_date(end)
+    def _iter_response_lines(self, r):
+        try:
+            yield from self._split_lines(self._decode_chunks(r.encoding, r.iter_content(chunk_size=self.CHUNK_SIZE)))
+        finally:
+            r.close()
+
+    """
+    Incrementally decodes a response's chunks of bytes. If the response
+    declares no encoding, it is guessed from the first chunk, as
+    Response.text guesses it from the whole body.
+    """
+    @staticmethod
+    def _decode_chunks(encoding, chunks):
+        decoder = None
+        for chunk in chunks:
+            if decoder is None:
+                if encoding is None:
+                    # Imported here, since it is only needed when no encoding is declared
+                    from requests.compat import chardet
+                    encoding = chardet.detect(chunk)['encoding'] or 'utf-8'
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+
+        if decoder is not None:
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield text
+
+    """
+    Splits an iterable of text chunks into lines. Unlike
+    Response.iter_lines(), a "\r\n" which straddles two chunks does not
+    produce a spurious empty line, which would end the current section.
+    """
+    @staticmethod
+    def _split_lines(chunks):
+        pending = ''
+        for chunk in chunks:
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+
+        if pending:
+            yield pending.rstrip('\r')
+
+    SECTIONS = (
+        ("t:slim X2 Insulin Pump", "readingData"),
+        ("IOB", "iobData"),
+        ("Basal", "basalData"),
+        ("Bolus", "bolusData"),
+    )
+
+    """
+    Lazily parses the lines of a therapy timeline CSV export, yielding a
+    (section, row) tuple for each row, where section is one of readingData,
+    iobData, basalData or bolusData, and row is a dict keyed by the section's
+    headers. Sections are separated by empty lines, and only sections with
+    a header and at least two rows are parsed. At most three lines are
+    buffered at a time.
+    """
+    def _iter_therapy_timeline_csv(self, lines):
+        for nonempty, group in itertools.groupby(lines, key=lambda line: len(line.strip()) > 0):
+            if not nonempty:
+                continue
+
+            first = list(itertools.islice(group, 3))
+            if len(first) < 3:
+                continue
+
+            firstrow = first[1].replace('"', '').strip()
+            section = None
+            for prefix, name in self.SECTIONS:
+                if firstrow.startswith(prefix):
+                    section = name
+                    break
 
+            if section is None:
+                # Drain the group so that the next section can be read
+                for _ in group:
+                    pass
+                continue
+
+            headers = first[0].split(",")
+            count = 0
+            for row in csv.reader(itertools.chain(first[1:], group)):
+                count += 1
+                yield section, dict(zip(headers, row))
+            metrics.ROWS_PARSED.inc(count, section=section)
+
+    def _therapy_timeline_csv_text(self, startDate, endDate, tries=0, stream=False):
+        get = self.get_lines if stream else self.get
         try:
-            req_text = self.get('therapytimeline2csv/%s/%s/%s?format=csv' % (self.userGuid, startDate, endDate), {})
+            return get('therapytimeline2csv/%s/%s/%s?format=csv' % (self.userGuid, startDate, endDate), {})
         except ApiException as e:
             # This seems to occur as some kind of soft rate-limit.
             logger.warning("Received ApiException in therapy_timeline_csv: (retry count %d) %s" % (tries, e))
             if e.status_code == 500:
-                sleep_seconds = (tries+1) * 60
+                sleep_seconds = (tries+1) * self.RETRY_BACKOFF_SECONDS
                 logger.error("Retrying in %d seconds after HTTP 500 in therapy_timeline_csv (retry count %d): %s" % (sleep_seconds, tries, e))
                 time.sleep(sleep_seconds)
                 if tries < self.MAX_RETRIES:
-                    return self.therapy_timeline_csv(start, end, tries+1)
+                    return self._therapy_timeline_csv_text(startDate, endDate, tries+1, stream)
             raise e
 
-        sections = self._split_empty_sections(req_text)
-
-        readingData = None
-        iobData = None
-        basalData = None
-        bolusData = None
-
-        for s in sections:
-            if s and len(s) > 2:
-                firstrow = s[1].replace('"', '').strip()
-                if firstrow.startswith("t:slim X2 Insulin Pump"):
-                    readingData = s
-                elif firstrow.startswith("IOB"):
-                    iobData = s
-                elif firstrow.startswith("Basal"):
-                    basalData = s
-                elif firstrow.startswith("Bolus"):
-                    bolusData = s
-
-
-        return {
-            "readingData": self._csv_to_dict(readingData),
-            "iobData": self._csv_to_dict(iobData),
-            "basalData": self._csv_to_dict(basalData),
-            "bolusData": self._csv_to_dict(bolusData)
-        }
-    
+    """
+    Collects (section, row) tuples into a dict of section name to a list
+    of row dicts. Given a lazy iterator, rows are parsed as they are
+    collected.
+    """
+    @tracing.traced('parse_csv')
+    def _collect_therapy_timeline_csv(self, rows):
+        data = {"readingData": [], "iobData": [], "basalData": [], "bolusData": []}
+        for section, row in rows:
+            data[section].append(row)
+
+        return data
+
+    def _parse_therapy_timeline_csv(self, req_text):
+        return self._collect_therapy_timeline_csv(self._iter_therapy_timeline_csv(req_text.splitlines()))
+
+    """
+    Returns the therapy timeline CSV for the given range, as a dict of
+    section name to a list of row dicts. If columnar is set, readingData,
+    iobData and basalData are instead returned as TimelineColumns.
+    Unless the response cache is used, which stores each response in
+    full, rows are parsed while the response is streamed.
+    """
+    def therapy_timeline_csv(self, start=None, end=None, columnar=False):
+        if self.cache and start and end and type(start) != str and type(end) != str:
+            data = self._cached_therapy_timeline_csv(start, end)
+            if columnar:
+                return build_timeline_columns((section, row) for section, rows in data.items() for row in rows)
+            return data
+
+        rows = self._stream_therapy_timeline_csv(start, end)
+        if columnar:
+            return build_timeline_columns(rows)
+        return self._collect_therapy_timeline_csv(rows)
+
+    """
+    Streams the therapy timeline CSV for the given range, lazily yielding
+    a (section, row) tuple for each row as the response is received.
+    """
+    def _stream_therapy_timeline_csv(self, start, end):
+        startDate = parse_date(start)
+        endDate = parse_date(end)
+
+        return self._iter_therapy_timeline_csv(self._therapy_timeline_csv_text(startDate, endDate, stream=True))
+
+    def _cached_therapy_timeline_csv(self, start, end):
+        merged = {"readingData": [], "iobData": [], "basalData": [], "bolusData": []}
+        seen = {section: set() for section in merged}
+
+        for day in days_between(start, end):
+            req_text = self.cache.get_or_fetch('therapytimeline2csv', self.userGuid, day,
+                lambda day=day: self._therapy_timeline_csv_text(parse_date(day), parse_date(day)))
+
+            # Rows which are included in the responses for two
+            # consecutive days are only added once.
+            for section, rows in self._parse_therapy_timeline_csv(req_text).items():
+                for row in rows:
+                    key = tuple(row.items())
+                    if key not in seen[section]:
+                        seen[section].add(key)
+                        merged[section].append(row)
+
+        return merged
+
     """
     Returns information on basal suspension. The filterbasal option only returns site/cartridge changes.
     SuspendReason values are:
@@ -1,30 +1,78 @@
 import time
+import arrow
 import logging
+import datetime
 import sys
 
 from .process import process_time_range
+from .api.common import ApiException
 from .secret import (
     PUMP_SERIAL_NUMBER,
     AUTOUPDATE_DEFAULT_SLEEP_SECONDS,
     AUTOUPDATE_MAX_SLEEP_SECONDS,
     AUTOUPDATE_USE_FIXED_SLEEP,
     AUTOUPDATE_FAILURE_MINUTES,
-    AUTOUPDATE_RESTART_ON_FAILURE
+    AUTOUPDATE_RESTART_ON_FAILURE,
+    AUTOUPDATE_INCREMENTAL,
+    AUTOUPDATE_INCREMENTAL_OVERLAP_MINUTES,
+    TIMEZONE_NAME
 )
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait before polling again when no new data was reported
+# although an update was expected
+UNEXPECTED_NO_CHANGE_SLEEP_SECONDS = 60
+
+"""
+Returns the current time as a naive datetime in TIMEZONE_NAME, the
+timezone in which t:connect reads the dates of a queried time range,
+whatever the timezone of the host.
+"""
+def timezone_now():
+    return arrow.now(TIMEZONE_NAME).naive
+
+"""
+Returns the (time_start, time_end) range to synchronize in incremental
+mode. Before any events have been synced, this is the initial time_start
+until now. Afterwards, it begins overlap_minutes before the newest event
+synced so far, so each cycle only covers newly uploaded data, however
+late the mobile app uploaded it.
+"""
+def incremental_time_range(time_start, last_synced_time, now, overlap_minutes=AUTOUPDATE_INCREMENTAL_OVERLAP_MINUTES):
+    if last_synced_time is None:
+        return time_start, now
+    return last_synced_time - datetime.timedelta(minutes=overlap_minutes), now
+
+"""
+Returns the number of seconds to sleep before checking for new data:
+the rolling average of the time between the last updates, up to
+AUTOUPDATE_MAX_SLEEP_SECONDS, unless AUTOUPDATE_USE_FIXED_SLEEP is set.
+"""
+def rolling_sleep_seconds(time_diffs):
+    sleep_secs = AUTOUPDATE_DEFAULT_SLEEP_SECONDS
+    if AUTOUPDATE_USE_FIXED_SLEEP != 1:
+        if len(time_diffs) > 2:
+            sleep_secs = sum(time_diffs) / len(time_diffs)
+
+        if sleep_secs > AUTOUPDATE_MAX_SLEEP_SECONDS:
+            sleep_secs = AUTOUPDATE_MAX_SLEEP_SECONDS
+    return sleep_secs
+
 """
 Performs the auto-update functionality. Runs indefinitely in a loop
 until stopped (ctrl+c).
+If incremental is set, the synchronized time range slides forward
+with each cycle instead of staying fixed at time_start to time_end.
 """
-def process_auto_update(tconnect, nightscout, time_start, time_end, pretend):
+def process_auto_update(tconnect, nightscout, time_start, time_end, pretend, incremental=AUTOUPDATE_INCREMENTAL):
     # Read from android api, find exact interval to cut down on API calls
     # Refresh API token. If failure, die, have wrapper script re-run.
 
     last_event_index = None
     last_event_time = None
     last_process_time_range = None
+    last_synced_time = None
     time_diffs = []
     while True:
         last_event = tconnect.android.last_event_uploaded(PUMP_SERIAL_NUMBER)
@@ -35,7 +83,15 @@ def process_auto_update(tconnect, nightscout, time_start, time_end, pretend):
             if pretend:
                 logger.info('Would update now if not in pretend mode')
             else:
-                added = process_time_range(tconnect, nightscout, time_start, time_end, pretend)
+                sync_start, sync_end = time_start, time_end
+                if incremental:
+                    sync_start, sync_end = incremental_time_range(time_start, last_synced_time, timezone_now())
+                    logger.info('Incrementally syncing between %s and %s' % (sync_start, sync_end))
+
+                synced = []
+                added = process_time_range(tconnect, nightscout, sync_start, sync_end, pretend, synced_until=synced.append)
+                if synced:
+                    last_synced_time = synced[0]
                 logger.info('Added %d items from process_time_range' % added)
                 if added == 0:
                     if last_event_index:
@@ -71,24 +127,36 @@ def process_auto_update(tconnect, nightscout, time_start, time_end, pretend):
 
 
             if len(time_diffs) > 2:
-                logger.info('Sleeping 60 seconds after unexpected no index change. (New data might be delayed.)')
-                time.sleep(60)
+                logger.info('Sleeping %d seconds after unexpected no index change. (New data might be delayed.)' % UNEXPECTED_NO_CHANGE_SLEEP_SECONDS)
+                time.sleep(UNEXPECTED_NO_CHANGE_SLEEP_SECONDS)
                 continue
 
-        sleep_secs = AUTOUPDATE_DEFAULT_SLEEP_SECONDS
-        if AUTOUPDATE_USE_FIXED_SLEEP != 1:
-            if len(time_diffs) > 10:
-                time_diffs = time_diffs[1:]
-
-            if len(time_diffs) > 2:
-                sleep_secs = sum(time_diffs) / len(time_diffs)
+        if AUTOUPDATE_USE_FIXED_SLEEP != 1 and len(time_diffs) > 10:
+            time_diffs = time_diffs[1:]
+        sleep_secs = rolling_sleep_seconds(time_diffs)
 
-            if sleep_secs > AUTOUPDATE_MAX_SLEEP_SECONDS:
-                sleep_secs = AUTOUPDATE_MAX_SLEEP_SECONDS
+        renew_android_token(tconnect, sleep_secs)
 
         # Sleep for a rolling average of time between updates
         logger.info('Sleeping for %d sec' % sleep_secs)
         time.sleep(sleep_secs)
 
+"""
+Renews the Android API access token ahead of time if it would otherwise
+expire before the next poll after sleep_secs, so that polls do not wait
+on a token refresh. Failures are retried by the next poll. This runs on
+the polling thread, so a renewal delays the start of the sleep by one
+token request; the daemon runs it in its executor instead.
+"""
+def renew_android_token(tconnect, sleep_secs):
+    android = tconnect._android
+    if not android:
+        return
+
+    try:
+        android.ensure_token(min_validity=sleep_secs + android.REFRESH_BEFORE_SECONDS)
+    except ApiException as e:
+        logger.warning('Unable to renew Android API token before sleeping: %s' % e)
+
 class AutoupdateFailureException(RuntimeError):
     pass
\ No newline at end of file
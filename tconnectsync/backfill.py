@@ -0,0 +1,145 @@
+import logging
+import datetime
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .process import download_time_range, sync_time_range_data
+from .util.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Each chunk performs one ControlIQ and one WS2 request.
+REQUESTS_PER_CHUNK = 2
+
+"""
+Splits the inclusive date range between time_start and time_end into
+consecutive, non-overlapping chunks of at most chunk_days days.
+Returns a list of (chunk_start, chunk_end) datetimes, where chunk_end
+is the (inclusive) final day of the chunk.
+"""
+def chunk_time_range(time_start, time_end, chunk_days):
+    if chunk_days < 1:
+        raise ValueError('chunk_days must be at least 1')
+
+    day = time_start.date()
+    last_day = time_end.date()
+
+    chunks = []
+    while day <= last_day:
+        chunk_end = min(day + datetime.timedelta(days=chunk_days - 1), last_day)
+        chunks.append((
+            datetime.datetime.combine(day, datetime.time()),
+            datetime.datetime.combine(chunk_end, datetime.time())
+        ))
+        day = chunk_end + datetime.timedelta(days=1)
+
+    return chunks
+
+"""
+Downloads the given chunks using up to max_workers concurrent requests,
+and yields (chunk, (ciqTherapyTimelineData, csvdata)) in chronological
+order. At most max_workers chunks are downloaded ahead of the chunk
+currently being consumed, so memory use stays bounded regardless of the
+length of the full range.
+If a journal is given, chunks which were already downloaded are read
+from it, and newly downloaded chunks are saved to it.
+"""
+def download_chunks(tconnect, chunks, max_workers, limiter=None, journal=None):
+    # Log in on this thread before any downloads are started, so that
+    # worker threads share a single ControlIQ session.
+    tconnect.controliq
+    tconnect.ws2
+
+    def download(chunk):
+        if journal:
+            saved = journal.load_download(chunk)
+            if saved:
+                logger.info("Using journaled download of backfill chunk %s to %s" % (chunk[0].date(), chunk[1].date()))
+                return saved
+
+        if limiter:
+            limiter.acquire(REQUESTS_PER_CHUNK)
+        logger.info("Downloading backfill chunk %s to %s" % (chunk[0].date(), chunk[1].date()))
+        ciqTherapyTimelineData, csvdata = download_time_range(tconnect, chunk[0], chunk[1])
+
+        if journal:
+            journal.save_download(chunk, ciqTherapyTimelineData, csvdata)
+        return ciqTherapyTimelineData, csvdata
+
+    pending = collections.deque()
+    remaining = iter(chunks)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for chunk in remaining:
+                pending.append((chunk, executor.submit(download, chunk)))
+                if len(pending) >= max_workers:
+                    break
+
+            while pending:
+                chunk, future = pending.popleft()
+                result = future.result()
+
+                nextChunk = next(remaining, None)
+                if nextChunk:
+                    pending.append((nextChunk, executor.submit(download, nextChunk)))
+
+                yield chunk, result
+        finally:
+            # Don't start any further downloads if a download failed
+            # or the consumer stopped early.
+            for _, f in pending:
+                f.cancel()
+
+"""
+Backfills Nightscout with t:connect data between time_start and time_end.
+The range is split into chunks of chunk_days days, which are downloaded
+concurrently (rate limited to requests_per_minute t:connect requests) and
+written to Nightscout in chronological order as each one becomes available.
+If a BackfillJournal is given, progress is checkpointed to it, and chunks
+and event types which a previous run completed are skipped.
+"""
+def process_backfill(tconnect, nightscout, time_start, time_end, pretend, chunk_days=7, max_workers=2, requests_per_minute=12, journal=None):
+    chunks = chunk_time_range(time_start, time_end, chunk_days)
+    logger.info("Backfilling %d chunks of up to %d days between %s and %s" % (len(chunks), chunk_days, time_start, time_end))
+
+    if pretend and journal:
+        logger.info("Not using backfill journal in pretend mode")
+        journal = None
+
+    completed = set()
+    if journal:
+        completed = set(c for c in chunks if journal.is_complete(c))
+        if completed:
+            logger.info("Skipping %d backfill chunks which were completed by a previous run" % len(completed))
+
+    limiter = None
+    if requests_per_minute:
+        limiter = TokenBucket(requests_per_minute / 60, capacity=max(REQUESTS_PER_CHUNK, max_workers * REQUESTS_PER_CHUNK))
+
+    downloads = download_chunks(tconnect, [c for c in chunks if c not in completed], max_workers, limiter, journal)
+
+    added = 0
+    lastCsvBasalRow = None
+    for chunk in chunks:
+        if chunk in completed:
+            lastCsvBasalRow = journal.last_csv_basal_row(chunk) or lastCsvBasalRow
+            continue
+
+        _, (ciqTherapyTimelineData, csvdata) = next(downloads)
+        logger.info("Processing backfill chunk %s to %s" % (chunk[0].date(), chunk[1].date()))
+
+        skip = ()
+        checkpoint = None
+        if journal:
+            skip = journal.completed_stages(chunk)
+            checkpoint = lambda stage, count, chunk=chunk: journal.mark_stage(chunk, stage, count)
+
+        added += sync_time_range_data(nightscout, ciqTherapyTimelineData, csvdata, pretend,
+            lastCsvBasalRow=lastCsvBasalRow, skip=skip, checkpoint=checkpoint)
+
+        if csvdata["basalData"]:
+            lastCsvBasalRow = csvdata["basalData"][-1]
+
+    logger.info("Wrote %d events to Nightscout during backfill" % added)
+    return added
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import uuid
+import logging
+import datetime
+
+logger = logging.getLogger(__name__)
+
+"""
+An on-disk cache of t:connect API responses, keyed by endpoint, user
+and date. Each entry holds the response for a single day.
+
+A day's data can no longer change once immutable_days have passed since
+the end of that day, so responses fetched after then are cached
+indefinitely. Other responses, including those for a day which was still
+open when they were fetched, are re-fetched once they are older than
+ttl_seconds.
+"""
+class ResponseCache:
+    def __init__(self, directory, immutable_days=1, ttl_seconds=60, clock=time.time):
+        self.directory = directory
+        self.immutable_days = immutable_days
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, endpoint, user, date):
+        return os.path.join(self.directory, endpoint, str(user), '%s.json' % date.isoformat())
+
+    """
+    Returns the Unix time after which the response for the given day can
+    no longer change: immutable_days after the end of that day.
+    """
+    def immutable_after(self, date):
+        horizon = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(days=1 + self.immutable_days)
+        return time.mktime(horizon.timetuple())
+
+    def is_immutable(self, date, fetched_at):
+        return fetched_at >= self.immutable_after(date)
+
+    """
+    Returns the cached response for the given key, or None if there is
+    no entry or the entry has expired.
+    """
+    def get(self, endpoint, user, date):
+        path = self._path(endpoint, user, date)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning("Ignoring corrupt cache entry: %s" % path)
+            return None
+
+        if not self.is_immutable(date, entry["fetched_at"]) and self._clock() - entry["fetched_at"] > self.ttl_seconds:
+            return None
+
+        return entry["data"]
+
+    def set(self, endpoint, user, date, data):
+        path = self._path(endpoint, user, date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file and rename it, so that concurrent
+        # readers never see a partially written entry.
+        tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(tmp, 'w') as f:
+            json.dump({"fetched_at": self._clock(), "data": data}, f)
+        os.replace(tmp, path)
+
+    """
+    Returns the cached response for the given key if it is present and has
+    not expired. Otherwise, calls fetch() and caches its return value.
+    """
+    def get_or_fetch(self, endpoint, user, date, fetch):
+        data = self.get(endpoint, user, date)
+        if data is not None:
+            logger.debug("Using cached %s response for %s" % (endpoint, date))
+            return data
+
+        data = fetch()
+        self.set(endpoint, user, date, data)
+        return data
+
+"""
+Returns each date between start and end, inclusive.
+"""
+def days_between(start, end):
+    day = start.date() if hasattr(start, 'date') else start
+    last = end.date() if hasattr(end, 'date') else end
+
+    days = []
+    while day <= last:
+        days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
@@ -0,0 +1,242 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+import datetime
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .process import process_time_range
+from .autoupdate import (
+    incremental_time_range,
+    timezone_now,
+    rolling_sleep_seconds,
+    renew_android_token,
+    AutoupdateFailureException,
+    UNEXPECTED_NO_CHANGE_SLEEP_SECONDS
+)
+from .secret import (
+    PUMP_SERIAL_NUMBER,
+    AUTOUPDATE_USE_FIXED_SLEEP,
+    AUTOUPDATE_FAILURE_MINUTES,
+    AUTOUPDATE_RESTART_ON_FAILURE,
+    AUTOUPDATE_INCREMENTAL
+)
+
+logger = logging.getLogger(__name__)
+
+"""
+An asyncio variant of process_auto_update. Polling the Android API for
+newly uploaded pump events runs concurrently with synchronizing data to
+Nightscout, so that a slow sync does not delay the next poll, and new data
+reported during a sync is synchronized as soon as it completes.
+
+The t:connect and Nightscout API clients are synchronous, so their calls
+are run in a thread pool. stop() shuts the daemon down gracefully: polling
+stops at once, and a sync in progress is allowed to complete.
+"""
+class AutoUpdateDaemon:
+    def __init__(self, tconnect, nightscout, time_start, time_end, pretend, incremental=AUTOUPDATE_INCREMENTAL):
+        self.tconnect = tconnect
+        self.nightscout = nightscout
+        self.time_start = time_start
+        self.time_end = time_end
+        self.pretend = pretend
+        self.incremental = incremental
+
+        self.exit_code = 0
+        self.last_event_index = None
+        self.last_event_time = None
+        self.last_process_time_range = None
+        self.last_synced_time = None
+        self.time_diffs = []
+        self.syncs = 0
+
+        self._stop_requested = False
+        self._stopping = None
+        self._new_data = None
+        self._loop = None
+        # One thread polls while the other synchronizes
+        self._executor = ThreadPoolExecutor(max_workers=2)
+
+    """
+    Requests a graceful shutdown. Safe to call from a signal handler on
+    the event loop's thread.
+    """
+    def stop(self, exit_code=None):
+        if exit_code is not None:
+            self.exit_code = exit_code
+        self._stop_requested = True
+        if self._stopping:
+            self._stopping.set()
+            self._new_data.set()
+
+    @property
+    def stopping(self):
+        return self._stop_requested
+
+    def _call(self, fn, *args):
+        return self._loop.run_in_executor(self._executor, fn, *args)
+
+    """
+    Sleeps for the given number of seconds, returning early if the daemon
+    is stopped. Returns whether it was stopped.
+    """
+    async def _sleep(self, secs):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), secs)
+        except asyncio.TimeoutError:
+            pass
+        return self._stopping.is_set()
+
+    def _check_failure(self, now):
+        if self.last_event_time and (now - self.last_event_time) >= 60 * AUTOUPDATE_FAILURE_MINUTES:
+            logger.error(AutoupdateFailureException("No new data event indexes have been detected for over %d minutes. " % AUTOUPDATE_FAILURE_MINUTES +
+                         "The t:connect app might no longer be functioning."))
+
+            if AUTOUPDATE_RESTART_ON_FAILURE:
+                self.stop(exit_code=1)
+
+        elif self.last_process_time_range and (now - self.last_process_time_range) >= 60 * AUTOUPDATE_FAILURE_MINUTES:
+            logger.error(AutoupdateFailureException("No new data has been found via the API for over %d minutes. " % AUTOUPDATE_FAILURE_MINUTES +
+                         "tconnectsync might not be functioning properly."))
+
+            if AUTOUPDATE_RESTART_ON_FAILURE:
+                self.stop(exit_code=1)
+
+    async def _poll(self):
+        while not self._stopping.is_set():
+            last_event = await self._call(lambda: self.tconnect.android.last_event_uploaded(PUMP_SERIAL_NUMBER))
+            now = time.time()
+
+            sleep_secs = None
+            if self.last_event_index is None or last_event['maxPumpEventIndex'] > self.last_event_index:
+                logger.info('New reported t:connect data. (event index: %s last: %s)' % (last_event['maxPumpEventIndex'], self.last_event_index))
+
+                if self.last_event_index is not None:
+                    self.time_diffs.append(now - self.last_event_time)
+                    logger.debug('Updating tracking of time since last update: %s' % self.time_diffs)
+
+                self.last_event_index = last_event['maxPumpEventIndex']
+                self.last_event_time = now
+                self._new_data.set()
+            else:
+                logger.info('No new reported t:connect data. (last event index: %s)' % last_event['maxPumpEventIndex'])
+                self._check_failure(now)
+
+                if len(self.time_diffs) > 2:
+                    logger.info('Sleeping %d seconds after unexpected no index change. (New data might be delayed.)' % UNEXPECTED_NO_CHANGE_SLEEP_SECONDS)
+                    sleep_secs = UNEXPECTED_NO_CHANGE_SLEEP_SECONDS
+
+            if sleep_secs is None:
+                if AUTOUPDATE_USE_FIXED_SLEEP != 1 and len(self.time_diffs) > 10:
+                    self.time_diffs = self.time_diffs[1:]
+                sleep_secs = rolling_sleep_seconds(self.time_diffs)
+
+                await self._call(renew_android_token, self.tconnect, sleep_secs)
+
+                # Sleep for a rolling average of time between updates
+                logger.info('Sleeping for %d sec' % sleep_secs)
+
+            if await self._sleep(sleep_secs):
+                return
+
+    async def _sync(self):
+        while True:
+            await self._new_data.wait()
+            if self._stopping.is_set():
+                return
+            self._new_data.clear()
+
+            if self.pretend:
+                logger.info('Would update now if not in pretend mode')
+                continue
+
+            sync_start, sync_end = self.time_start, self.time_end
+            if self.incremental:
+                sync_start, sync_end = incremental_time_range(self.time_start, self.last_synced_time, timezone_now())
+                logger.info('Incrementally syncing between %s and %s' % (sync_start, sync_end))
+
+            now = time.time()
+            synced = []
+            added = await self._call(process_time_range, self.tconnect, self.nightscout, sync_start, sync_end, self.pretend, synced.append)
+            if synced:
+                self.last_synced_time = synced[0]
+            logger.info('Added %d items from process_time_range' % added)
+            if added == 0:
+                if self.syncs > 0:
+                    logger.error('An event index change was recorded, but no new data was found via the API. ' +
+                                 'If this error reoccurs, try restarting tconnectsync.')
+            else:
+                self.last_process_time_range = now
+            self.syncs += 1
+
+    """
+    Runs the daemon until it is stopped. If polling or synchronizing
+    raises an exception, the daemon is stopped, any sync in progress is
+    completed and the exception is re-raised. If the task running the
+    daemon is cancelled, work in progress is abandoned.
+    """
+    async def run(self):
+        self._loop = asyncio.get_event_loop()
+        self._stopping = asyncio.Event()
+        self._new_data = asyncio.Event()
+        if self._stop_requested:
+            return self.exit_code
+
+        tasks = [asyncio.ensure_future(self._poll()), asyncio.ensure_future(self._sync())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            if any(t.exception() is not None for t in done):
+                self.stop(exit_code=1)
+
+            # The poller exits once stopped; wait for the sync to complete
+            await asyncio.wait(tasks)
+            for task in tasks:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._executor.shutdown(wait=False)
+
+        return self.exit_code
+
+"""
+Runs the asyncio auto-update daemon in a new event loop until it is shut
+down with SIGINT or SIGTERM, and returns its exit code. A second signal
+abandons any sync in progress.
+"""
+def run_auto_update_daemon(tconnect, nightscout, time_start, time_end, pretend, incremental=AUTOUPDATE_INCREMENTAL):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    daemon = AutoUpdateDaemon(tconnect, nightscout, time_start, time_end, pretend, incremental=incremental)
+    task = loop.create_task(daemon.run())
+
+    def on_signal(signum):
+        if daemon.stopping:
+            logger.warning('Received signal %d again: exiting without waiting for the current sync' % signum)
+            # The sync runs on an executor thread, which cancelling the task
+            # would leave running, so exit the process directly
+            os._exit(1)
+        else:
+            logger.info('Received signal %d: shutting down after the current sync completes' % signum)
+            daemon.stop()
+
+    signals = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, on_signal, signum)
+            signals.append(signum)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on Windows, where Ctrl+C raises KeyboardInterrupt
+            pass
+
+    try:
+        return loop.run_until_complete(task)
+    finally:
+        for signum in signals:
+            loop.remove_signal_handler(signum)
+        loop.close()
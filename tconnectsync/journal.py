@@ -0,0 +1,114 @@
+import json
+import time
+import sqlite3
+import logging
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+"""
+A persistent checkpoint journal for backfills, stored in a local SQLite
+database. For each chunk of a backfill it records the downloaded t:connect
+data, and which event types have been written to Nightscout, so that a
+restarted backfill can skip work which was already completed.
+
+Downloaded data is only kept until every event type in its chunk has been
+written. Each method opens its own connection, so a journal can be shared
+between the threads which download chunks.
+"""
+class BackfillJournal:
+    STAGES = ('basal', 'bolus', 'iob')
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS chunks (
+                chunk_start TEXT NOT NULL,
+                chunk_end TEXT NOT NULL,
+                payload TEXT,
+                last_csv_basal_row TEXT,
+                downloaded_at REAL,
+                completed_at REAL,
+                PRIMARY KEY (chunk_start, chunk_end)
+            )''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS stages (
+                chunk_start TEXT NOT NULL,
+                chunk_end TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                added INTEGER NOT NULL,
+                written_at REAL NOT NULL,
+                PRIMARY KEY (chunk_start, chunk_end, stage)
+            )''')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(chunk):
+        return (chunk[0].date().isoformat(), chunk[1].date().isoformat())
+
+    """
+    Returns the (ciqTherapyTimelineData, csvdata) previously downloaded
+    for the given chunk, or None if it has not been downloaded.
+    """
+    def load_download(self, chunk):
+        with self._connect() as conn:
+            row = conn.execute('SELECT payload FROM chunks WHERE chunk_start=? AND chunk_end=?', self._key(chunk)).fetchone()
+
+        if not row or row[0] is None:
+            return None
+        ciqTherapyTimelineData, csvdata = json.loads(row[0])
+        return ciqTherapyTimelineData, csvdata
+
+    def save_download(self, chunk, ciqTherapyTimelineData, csvdata):
+        basalData = csvdata.get("basalData") if csvdata else None
+        last_csv_basal_row = json.dumps(basalData[-1]) if basalData else None
+
+        with self._connect() as conn:
+            conn.execute('''INSERT OR REPLACE INTO chunks
+                (chunk_start, chunk_end, payload, last_csv_basal_row, downloaded_at, completed_at)
+                VALUES (?, ?, ?, ?, ?, NULL)''',
+                self._key(chunk) + (json.dumps([ciqTherapyTimelineData, csvdata]), last_csv_basal_row, time.time()))
+
+    """
+    Returns the set of stages which have been written for the given chunk.
+    """
+    def completed_stages(self, chunk):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT stage FROM stages WHERE chunk_start=? AND chunk_end=?', self._key(chunk)).fetchall()
+        return set(r[0] for r in rows)
+
+    """
+    Records that the given stage was written for a chunk. Once every stage
+    has been written, the chunk's downloaded data is discarded.
+    """
+    def mark_stage(self, chunk, stage, added=0):
+        key = self._key(chunk)
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO stages (chunk_start, chunk_end, stage, added, written_at) VALUES (?, ?, ?, ?, ?)',
+                key + (stage, added, time.time()))
+
+            written = set(r[0] for r in conn.execute('SELECT stage FROM stages WHERE chunk_start=? AND chunk_end=?', key))
+            if written.issuperset(self.STAGES):
+                conn.execute('UPDATE chunks SET payload=NULL, completed_at=? WHERE chunk_start=? AND chunk_end=?',
+                    (time.time(),) + key)
+
+    def is_complete(self, chunk):
+        return self.completed_stages(chunk).issuperset(self.STAGES)
+
+    """
+    Returns the final CSV basal row which was downloaded for the given chunk.
+    """
+    def last_csv_basal_row(self, chunk):
+        with self._connect() as conn:
+            row = conn.execute('SELECT last_csv_basal_row FROM chunks WHERE chunk_start=? AND chunk_end=?', self._key(chunk)).fetchone()
+
+        if not row or row[0] is None:
+            return None
+        return json.loads(row[0])
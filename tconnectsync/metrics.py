@@ -0,0 +1,265 @@
+import re
+import time
+import logging
+import threading
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+"""
+Process-wide metrics in the Prometheus text exposition format, covering
+t:connect and Nightscout requests, parsed rows, Nightscout writes, logins
+and sync cycles.
+
+Metrics are always recorded, which only costs a lock and a dict update
+per observation, and are exposed over HTTP only if start_metrics_server()
+is called, such as with the METRICS_PORT setting.
+"""
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class _Metric:
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s expects labels %s, got %s' % (self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.TYPE)]
+        with self._lock:
+            for suffix, key, extra, value in self._samples():
+                lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(self.labelnames, key, extra), _format_value(value)))
+        return '\n'.join(lines)
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield '', key, (), value
+
+class Gauge(_Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield '', key, (), value
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, followed by the sum of observations
+                counts = self._values[key] = [0] * len(self.buckets) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def count(self, **labels):
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return sum(counts[:-1]) if counts else 0
+
+    """
+    Context manager which observes the time taken by its block.
+    """
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _samples(self):
+        for key, counts in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', key, (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', key, (), counts[-1]
+            yield '_count', key, (), cumulative
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+REGISTRY = Registry()
+
+API_REQUEST_SECONDS = REGISTRY.histogram('tconnectsync_api_request_duration_seconds',
+    'Time taken by t:connect and Nightscout API requests', ('api', 'method', 'endpoint'))
+API_REQUESTS = REGISTRY.counter('tconnectsync_api_requests_total',
+    'Responses to t:connect and Nightscout API requests, by HTTP status', ('api', 'method', 'endpoint', 'status'))
+ROWS_PARSED = REGISTRY.counter('tconnectsync_rows_parsed_total',
+    'Rows of t:connect data parsed, by section', ('section',))
+ENTRIES_WRITTEN = REGISTRY.counter('tconnectsync_nightscout_entries_written_total',
+    'Entries created or replaced in Nightscout, by eventType', ('event_type',))
+LOGINS = REGISTRY.counter('tconnectsync_logins_total',
+    'Logins to t:connect APIs, and access token refreshes', ('api', 'kind'))
+CYCLE_SECONDS = REGISTRY.histogram('tconnectsync_sync_cycle_duration_seconds',
+    'Time taken to download, process and upload a time range', ('account', 'result'),
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 90, 120, 300, 600))
+LAST_SUCCESSFUL_CYCLE = REGISTRY.gauge('tconnectsync_last_successful_sync_timestamp_seconds',
+    'Unix time at which the last successful sync cycle completed', ('account',))
+
+# Numbers, dates, and hexadecimal ids such as GUIDs and Nightscout _ids
+_ID_SEGMENT = re.compile(r'^([\d.-]+|[0-9a-fA-F-]{8,})$')
+
+"""
+Returns an endpoint label for a request URL: its path, with any segment
+which is an id, such as a user GUID, date or Nightscout _id, replaced by
+':id' so that the number of label values stays small.
+"""
+def endpoint_label(url):
+    path = urllib.parse.urlsplit(url).path
+    return '/'.join(':id' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+"""
+Returns a requests response hook which records the latency and status
+of each response from the given API.
+"""
+def response_hook(api):
+    def hook(r, *args, **kwargs):
+        method = r.request.method if r.request is not None else ''
+        endpoint = endpoint_label(r.url)
+        if r.elapsed is not None:
+            API_REQUEST_SECONDS.observe(r.elapsed.total_seconds(), api=api, method=method, endpoint=endpoint)
+        API_REQUESTS.inc(api=api, method=method, endpoint=endpoint, status=r.status_code)
+    return hook
+
+_hooks = {}
+
+"""
+Returns the hooks argument for a requests call to the given API, which
+records metrics and tracing spans for each response.
+"""
+def hooks(api):
+    if api not in _hooks:
+        # Imported here, since tracing imports endpoint_label from this module
+        from . import tracing
+        _hooks[api] = {'response': [response_hook(api), tracing.response_hook(api)]}
+    return _hooks[api]
+
+"""
+Starts a daemon thread serving the registry's metrics at /metrics on the
+given port, and returns the server, which can be stopped with shutdown().
+"""
+def start_metrics_server(port, host='127.0.0.1', registry=REGISTRY):
+    # Imported here, since the server is rarely used
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format % args)
+
+    class Server(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info("Serving metrics at http://%s:%d/metrics" % (host, server.server_address[1]))
+    return server
@@ -2,12 +2,20 @@ import sys
 import requests
 import hashlib
 import time
+import arrow
+import logging
 import urllib.parse
 
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
+from . import metrics, tracing
 from .api.common import ApiException
 from .parser.nightscout import ENTERED_BY
+from .util.http import RateLimitedAdapter
+
+logger = logging.getLogger(__name__)
 
 # try:
 #     from .secret import NS_URL, NS_SECRET
@@ -16,42 +24,178 @@ from .parser.nightscout import ENTERED_BY
 #     sys.exit(1)
 
 class NightscoutApi:
-	def __init__(self, url, secret):
+	DEFAULT_POOL_SIZE = 10
+	DEFAULT_BATCH_SIZE = 50
+	DEFAULT_PAGE_SIZE = 500
+
+	def __init__(self, url, secret, pool_size=DEFAULT_POOL_SIZE, batch_size=DEFAULT_BATCH_SIZE, session=None, limiter=None):
 		self.url = url
 		self.secret = secret
+		self.pool_size = pool_size
+		self.batch_size = batch_size
+		self.limiter = limiter
 
+		# A session may be shared between NightscoutApi instances for the
+		# same host, in which case it is not closed by close().
+		self._session = session
+		self._shared_session = session is not None
+		self._headers = None
 
-	def upload_entry(self, ns_format, entity='treatments'):
-		r = requests.post(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json=ns_format, headers={
+	"""
+	A keep-alive session shared between all requests made to Nightscout,
+	so that repeated uploads reuse pooled connections instead of paying
+	for a new TCP and TLS handshake each time.
+	"""
+	@property
+	def session(self):
+		if self._session is None:
+			self._session = NightscoutApi.new_session(self.pool_size, self.limiter)
+		return self._session
+
+	"""
+	Creates a pooled session. If a limiter is given, every request made
+	with the session waits for it before being sent.
+	"""
+	@staticmethod
+	def new_session(pool_size=DEFAULT_POOL_SIZE, limiter=None):
+		s = requests.Session()
+		if limiter is not None:
+			adapter = RateLimitedAdapter(limiter, pool_connections=1, pool_maxsize=pool_size)
+		else:
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+		s.mount('http://', adapter)
+		s.mount('https://', adapter)
+		s.hooks['response'].extend(metrics.hooks('nightscout')['response'])
+		return s
+
+	"""
+	Authentication headers, computed once per instance.
+	"""
+	@property
+	def auth_headers(self):
+		if self._headers is None:
+			self._headers = {
+				'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
+			}
+		return self._headers
+
+	def json_headers(self):
+		return {
 			'Accept': 'application/json',
 			'Content-Type': 'application/json',
-			'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
-		})
+			**self.auth_headers
+		}
+
+	def close(self):
+		if self._session is not None and not self._shared_session:
+			self._session.close()
+			self._session = None
+
+	def upload_entry(self, ns_format, entity='treatments'):
+		r = self.session.post(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json=ns_format, headers=self.json_headers())
 		if r.status_code != 200:
 			raise ApiException(r.status_code, "Nightscout upload response: %s" % r.text)
+		NightscoutApi._count_written([ns_format], entity)
+
+	"""
+	Uploads a list of entries, sending up to batch_size entries per request
+	as a JSON array. If a batch request fails, its entries are uploaded one
+	at a time instead. Entries which are missing from a successful batch
+	response are also re-sent individually; Nightscout upserts treatments
+	on created_at and eventType, so re-sending an entry does not duplicate it.
+	"""
+	def upload_entries(self, ns_formats, entity='treatments', batch_size=None):
+		batch_size = batch_size or self.batch_size
+		for i in range(0, len(ns_formats), batch_size):
+			batch = ns_formats[i:i+batch_size]
+			try:
+				created = self._upload_batch(batch, entity)
+			except ApiException as e:
+				logger.warning("Nightscout batch upload of %d entries failed, falling back to single uploads: %s" % (len(batch), e))
+				for entry in batch:
+					self.upload_entry(entry, entity=entity)
+				continue
+
+			missing = self._missing_from_batch(batch, created)
+			missing_ids = set(id(entry) for entry in missing)
+			NightscoutApi._count_written([entry for entry in batch if id(entry) not in missing_ids], entity)
+			if missing:
+				logger.warning("Nightscout batch upload response was missing %d of %d entries, re-sending them individually" % (len(missing), len(batch)))
+				for entry in missing:
+					self.upload_entry(entry, entity=entity)
+
+	def _upload_batch(self, batch, entity):
+		r = self.session.post(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json=batch, headers=self.json_headers())
+		if r.status_code != 200:
+			raise ApiException(r.status_code, "Nightscout batch upload response: %s" % r.text)
+		try:
+			return r.json()
+		except ValueError:
+			return None
+
+	@staticmethod
+	def _entry_key(entry):
+		try:
+			return (entry.get("eventType"), arrow.get(entry.get("created_at")).int_timestamp)
+		except (TypeError, ValueError):
+			return None
+
+	@staticmethod
+	def _count_written(entries, entity):
+		for entry in entries:
+			event_type = entry.get('eventType') or entry.get('activityType') or entity
+			metrics.ENTRIES_WRITTEN.inc(event_type=event_type)
+
+	def _missing_from_batch(self, batch, created):
+		if not isinstance(created, list):
+			return batch
+		if len(created) >= len(batch):
+			return []
+
+		created_keys = set(NightscoutApi._entry_key(c) for c in created if isinstance(c, dict))
+		return [e for e in batch if NightscoutApi._entry_key(e) not in created_keys]
 
 	def delete_entry(self, entity):
-		r = requests.delete(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json={}, headers={
-			'Accept': 'application/json',
-			'Content-Type': 'application/json',
-			'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
-		})
+		r = self.session.delete(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json={}, headers=self.json_headers())
 		if r.status_code != 200:
 			raise ApiException(r.status_code, "Nightscout delete response: %s" % r.text)
 
 	def put_entry(self, ns_format, entity):
-		r = requests.put(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json=ns_format, headers={
-			'Accept': 'application/json',
-			'Content-Type': 'application/json',
-			'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
-		})
+		r = self.session.put(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json=ns_format, headers=self.json_headers())
 		if r.status_code != 200:
 			raise ApiException(r.status_code, "Nightscout put response: %s" % r.text)
+		NightscoutApi._count_written([ns_format], entity)
+
+	"""
+	Creates or replaces each entry by its _id, using PUT requests, so entries
+	with deterministic ids can be re-sent any number of times without
+	creating duplicates. Requests are spread over the pooled connections.
+	Entries are not batched into a POST, since Nightscout matches posted
+	treatments by created_at and eventType rather than by _id, which would
+	merge distinct entries with the same time.
+	"""
+	def upsert_entries(self, ns_formats, entity='treatments'):
+		if not ns_formats:
+			return
+
+		# Entries which share an _id are sent in order by the same thread, so
+		# that concurrent requests never race to write the same treatment
+		groups = {}
+		for entry in ns_formats:
+			groups.setdefault(entry.get('_id'), []).append(entry)
+
+		def put_group(entries):
+			for entry in entries:
+				self.put_entry(entry, entity=entity)
+
+		# Create the session before it is shared between threads
+		self.session
+		with ThreadPoolExecutor(max_workers=min(self.pool_size, len(groups))) as executor:
+			for _ in executor.map(tracing.propagate(put_group), groups.values()):
+				pass
 
 	def last_uploaded_entry(self, eventType):
-		latest = requests.get(urljoin(self.url, 'api/v1/treatments?count=1&find[enteredBy]=' + urllib.parse.quote(ENTERED_BY) + '&find[eventType]=' + urllib.parse.quote(eventType) + '&ts=' + str(time.time())), headers={
-			'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
-		})
+		latest = self.session.get(urljoin(self.url, 'api/v1/treatments?count=1&find[enteredBy]=' + urllib.parse.quote(ENTERED_BY) + '&find[eventType]=' + urllib.parse.quote(eventType) + '&ts=' + str(time.time())), headers=self.auth_headers)
 		if latest.status_code != 200:
 			raise ApiException(latest.status_code, "Nightscout treatments response: %s" % latest.text)
 
@@ -60,10 +204,55 @@ class NightscoutApi:
 			return j[0]
 		return None
 
+	@staticmethod
+	def _query_time(t):
+		return arrow.get(t).to('utc').format('YYYY-MM-DDTHH:mm:ss.SSS') + 'Z'
+
+	"""
+	Returns every treatment of the given eventType uploaded by tconnectsync
+	with a created_at between time_start and time_end, inclusive. Treatments
+	are returned newest first, fetched in pages of up to page_size entries.
+	Each page after the first begins at the created_at of the last treatment
+	in the previous one, inclusive, so that treatments sharing that time are
+	not skipped, and treatments which were already returned are dropped.
+	"""
+	def treatments_in_range(self, eventType, time_start, time_end, page_size=DEFAULT_PAGE_SIZE):
+		treatments = []
+		seen = set()
+		upper = self._query_time(time_end)
+		count = page_size
+		while True:
+			query = 'api/v1/treatments?count=%d&find[enteredBy]=%s&find[eventType]=%s&find[created_at][$gte]=%s&find[created_at][$lte]=%s&ts=%s' % (
+				count,
+				urllib.parse.quote(ENTERED_BY),
+				urllib.parse.quote(eventType),
+				urllib.parse.quote(self._query_time(time_start)),
+				urllib.parse.quote(upper),
+				str(time.time()))
+
+			r = self.session.get(urljoin(self.url, query), headers=self.auth_headers)
+			if r.status_code != 200:
+				raise ApiException(r.status_code, "Nightscout treatments response: %s" % r.text)
+
+			page = r.json() or []
+			for t in page:
+				if t.get("_id") not in seen:
+					seen.add(t.get("_id"))
+					treatments.append(t)
+			if len(page) < count:
+				return treatments
+
+			# Treatments are sorted by created_at, newest first. If the whole
+			# page shares one created_at, the next page would be the same, so
+			# a larger one is requested instead.
+			if page[0]["created_at"] == page[-1]["created_at"]:
+				count *= 2
+			else:
+				count = page_size
+			upper = page[-1]["created_at"]
+
 	def last_uploaded_activity(self, activityType):
-		latest = requests.get(urljoin(self.url, 'api/v1/activity?find[enteredBy]=' + urllib.parse.quote(ENTERED_BY) + '&find[activityType]=' + urllib.parse.quote(activityType) + '&ts=' + str(time.time())), headers={
-			'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
-		})
+		latest = self.session.get(urljoin(self.url, 'api/v1/activity?find[enteredBy]=' + urllib.parse.quote(ENTERED_BY) + '&find[activityType]=' + urllib.parse.quote(activityType) + '&ts=' + str(time.time())), headers=self.auth_headers)
 		if latest.status_code != 200:
 			raise ApiException(latest.status_code, "Nightscout activity response: %s" % latest.text)
 
@@ -76,9 +265,7 @@ class NightscoutApi:
 	Returns general status information about the Nightscout server.
 	"""
 	def api_status(self):
-		status = requests.get(urljoin(self.url, 'api/v1/status.json'), headers={
-			'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
-		})
+		status = self.session.get(urljoin(self.url, 'api/v1/status.json'), headers=self.auth_headers)
 		if status.status_code != 200:
 			raise Exception('HTTP error status code (%d) from Nightscout: %s' % (status.status_code, status.text))
-		return status.json()
\ No newline at end of file
+		return status.json()
@@ -0,0 +1,183 @@
+import array
+import bisect
+
+from .tconnect import TConnectEntry
+
+"""
+A compact, column-oriented representation of the therapy timeline CSV.
+
+Instead of a dict per row, each section holds one typed array per column:
+int64 UTC epochs, float64 values, and integer codes for categorical
+strings such as Description, which are interned once per section. IOB
+values are uploaded to Nightscout exactly as exported, so they are kept
+as their original strings.
+"""
+
+FLOAT = 'd'
+INT = 'q'
+CATEGORY = 'H'
+STRING = 'str'
+
+"""
+For each section, the (name, CSV header, kind) of each column stored in
+addition to the epoch of the row's EventDateTime.
+"""
+SECTION_COLUMNS = {
+    "readingData": (
+        ("reading", "Readings (CGM / BGM)", FLOAT),
+        ("description", "Description", CATEGORY),
+    ),
+    "iobData": (
+        ("iob", "IOB", STRING),
+        ("event_id", "EventID", INT),
+    ),
+    "basalData": (
+        ("basal_rate", "BasalRate", FLOAT),
+    ),
+}
+
+MISSING_INT = -1
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_INT
+
+"""
+Interns the distinct values of a categorical column, mapping each to a
+small integer code.
+"""
+class Categories:
+    def __init__(self, values=()):
+        self.values = []
+        self._codes = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._codes[value] = code
+        return code
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+"""
+The rows of a single therapy timeline section, stored by column and
+sorted by epoch.
+"""
+class TimelineColumns:
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.epoch = array.array('q')
+        self.columns = {name: [] if kind == STRING else array.array(kind) for name, _, kind in self.fields}
+        self.categories = {name: Categories() for name, _, kind in self.fields if kind == CATEGORY}
+
+    def append(self, epoch, row):
+        self.epoch.append(epoch)
+        for name, header, kind in self.fields:
+            value = row.get(header)
+            if kind == FLOAT:
+                self.columns[name].append(_parse_float(value))
+            elif kind == INT:
+                self.columns[name].append(_parse_int(value))
+            elif kind == STRING:
+                self.columns[name].append(value)
+            else:
+                self.columns[name].append(self.categories[name].code(value))
+
+    def __len__(self):
+        return len(self.epoch)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    """
+    Returns the decoded value of the given column for row i.
+    """
+    def value(self, name, i):
+        value = self.columns[name][i]
+        if name in self.categories:
+            return self.categories[name][value]
+        return value
+
+    def _take(self, indexes):
+        taken = TimelineColumns(self.fields)
+        taken.categories = self.categories
+        taken.epoch = array.array('q', (self.epoch[i] for i in indexes))
+        for name, column in self.columns.items():
+            values = (column[i] for i in indexes)
+            taken.columns[name] = list(values) if isinstance(column, list) else array.array(column.typecode, values)
+        return taken
+
+    def _slice(self, start, stop=None):
+        sliced = TimelineColumns(self.fields)
+        sliced.categories = self.categories
+        sliced.epoch = self.epoch[start:stop]
+        for name, column in self.columns.items():
+            sliced.columns[name] = column[start:stop]
+        return sliced
+
+    """
+    Sorts all columns by epoch, in place. Rows with equal epochs keep
+    their order.
+    """
+    def sort(self):
+        epoch = self.epoch
+        if all(epoch[i] <= epoch[i+1] for i in range(len(epoch) - 1)):
+            return
+        order = sorted(range(len(epoch)), key=epoch.__getitem__)
+        sorted_columns = self._take(order)
+        self.epoch = sorted_columns.epoch
+        self.columns = sorted_columns.columns
+
+    """
+    Returns the rows with an epoch at or after the given epoch, found by
+    binary search. Columns must be sorted.
+    """
+    def since(self, epoch):
+        return self._slice(bisect.bisect_left(self.epoch, epoch))
+
+    """
+    Returns the rows with an epoch strictly after the given epoch.
+    """
+    def after(self, epoch):
+        return self._slice(bisect.bisect_right(self.epoch, epoch))
+
+"""
+Builds columnar sections from an iterable of (section, row) tuples, as
+yielded by WS2Api.iter_therapy_timeline_csv(). Bolus rows have many
+irregular fields and are few in number, so bolusData remains a list of
+row dicts.
+"""
+def build_timeline_columns(rows):
+    converter = TConnectEntry._tz()
+    data = {section: TimelineColumns(fields) for section, fields in SECTION_COLUMNS.items()}
+    data["bolusData"] = []
+
+    for section, row in rows:
+        if section == "bolusData":
+            data[section].append(row)
+            continue
+
+        # EventDateTime is stored in the user's timezone.
+        _, epoch = converter.convert_datetime(row["EventDateTime"])
+        data[section].append(epoch, row)
+
+    for section in SECTION_COLUMNS:
+        data[section].sort()
+
+    return data
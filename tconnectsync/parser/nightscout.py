@@ -1,15 +1,28 @@
+import hashlib
+
 ENTERED_BY = "Pump (tconnectsync)"
 BASAL_EVENTTYPE = "Temp Basal"
 BOLUS_EVENTTYPE = "Combo Bolus"
 IOB_ACTIVITYTYPE = "tconnect_iob"
 
+"""
+Returns a deterministic identifier for a pump event, derived from its type,
+its time as an epoch, and its event ID if it has one. Identifiers are 24
+hex characters, the format of a MongoDB ObjectId, so Nightscout accepts
+them as an _id. Uploading an entry with the same identifier again replaces
+it rather than creating a duplicate.
+"""
+def entry_id(event_type, epoch, event_id=None):
+    key = "%s|%s|%s" % (event_type, epoch, "" if event_id is None else event_id)
+    return hashlib.sha1(key.encode()).hexdigest()[:24]
+
 """
 Conversion methods for parsing data into Nightscout objects.
 """
 class NightscoutEntry:
     @staticmethod
-    def basal(value, duration_mins, created_at, reason=""):
-        return {
+    def basal(value, duration_mins, created_at, reason="", _id=None):
+        entry = {
             "eventType": BASAL_EVENTTYPE,
             "reason": reason,
             "duration": float(duration_mins) if duration_mins else None,
@@ -20,10 +33,13 @@ class NightscoutEntry:
             "insulin": None,
             "enteredBy": ENTERED_BY
         }
+        if _id:
+            entry["_id"] = _id
+        return entry
 
     @staticmethod
-    def bolus(bolus, carbs, created_at, notes=""):
-        return {
+    def bolus(bolus, carbs, created_at, notes="", _id=None):
+        entry = {
             "eventType": BOLUS_EVENTTYPE,
 			"created_at": created_at,
 			"carbs": int(carbs),
@@ -31,6 +47,9 @@ class NightscoutEntry:
 			"notes": notes,
 			"enteredBy": ENTERED_BY,
         }
+        if _id:
+            entry["_id"] = _id
+        return entry
 
     @staticmethod
     def iob(iob, created_at):
@@ -0,0 +1,89 @@
+"""
+Compact record types for parsed t:connect events.
+
+Each record stores its timestamp both as the formatted string used in
+Nightscout entries (time) and as an integer UTC epoch (epoch), so that
+events can be sorted and compared without re-parsing the string.
+"""
+class Record:
+    __slots__ = ()
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def _replace(self, **kwargs):
+        return type(self)(**{**self._asdict(), **kwargs})
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+class BasalEvent(Record):
+    __slots__ = ('time', 'epoch', 'delivery_type', 'duration_mins', 'basal_rate', 'suspend_reason')
+
+    def __init__(self, time, epoch, delivery_type, duration_mins, basal_rate, suspend_reason=None):
+        self.time = time
+        self.epoch = epoch
+        self.delivery_type = delivery_type
+        self.duration_mins = duration_mins
+        self.basal_rate = basal_rate
+        self.suspend_reason = suspend_reason
+
+class SuspensionEvent(Record):
+    __slots__ = ('time', 'epoch', 'continuation', 'suspend_reason')
+
+    def __init__(self, time, epoch, continuation, suspend_reason):
+        self.time = time
+        self.epoch = epoch
+        self.continuation = continuation
+        self.suspend_reason = suspend_reason
+
+class CgmReading(Record):
+    __slots__ = ('time', 'epoch', 'reading', 'reading_type')
+
+    def __init__(self, time, epoch, reading, reading_type):
+        self.time = time
+        self.epoch = epoch
+        self.reading = reading
+        self.reading_type = reading_type
+
+class IobEvent(Record):
+    __slots__ = ('time', 'epoch', 'iob', 'event_id')
+
+    def __init__(self, time, epoch, iob, event_id):
+        self.time = time
+        self.epoch = epoch
+        self.iob = iob
+        self.event_id = event_id
+
+"""
+time and epoch hold the time at which the bolus is recorded in Nightscout:
+its completion time, or for extended boluses, the time the extended
+portion started. Both are None for incomplete boluses.
+"""
+class BolusEvent(Record):
+    __slots__ = ('description', 'complete', 'completion', 'request_time', 'completion_time',
+                 'insulin', 'carbs', 'user_override', 'extended_bolus', 'bolex_completion_time',
+                 'bolex_start_time', 'request_id', 'time', 'epoch')
+
+    def __init__(self, description, complete, completion, request_time, completion_time,
+                 insulin, carbs, user_override, extended_bolus, bolex_completion_time,
+                 bolex_start_time, request_id, time, epoch):
+        self.description = description
+        self.complete = complete
+        self.completion = completion
+        self.request_time = request_time
+        self.completion_time = completion_time
+        self.insulin = insulin
+        self.carbs = carbs
+        self.user_override = user_override
+        self.extended_bolus = extended_bolus
+        self.bolex_completion_time = bolex_completion_time
+        self.bolex_start_time = bolex_start_time
+        self.request_id = request_id
+        self.time = time
+        self.epoch = epoch
@@ -1,6 +1,9 @@
 import sys
 import arrow
 
+from .tz import TimezoneConverter
+from .records import BasalEvent, SuspensionEvent, CgmReading, IobEvent, BolusEvent
+
 try:
     from ..secret import TIMEZONE_NAME
 except Exception:
@@ -28,27 +31,51 @@ class TConnectEntry:
         # correct timestamp.
         return arrow.get(x, tzinfo="America/Los_Angeles").replace(tzinfo=TIMEZONE_NAME)
 
+    _converter = None
+
+    @staticmethod
+    def _tz():
+        if TConnectEntry._converter is None:
+            TConnectEntry._converter = TimezoneConverter(TIMEZONE_NAME)
+        return TConnectEntry._converter
+
+    """
+    Equivalent to _epoch_parse(x).format(), but faster.
+    """
+    @staticmethod
+    def _epoch_format(x):
+        return TConnectEntry._tz().convert_epoch(x)[0]
+
+    """
+    Equivalent to _datetime_parse(date).format(), but faster.
+    """
+    @staticmethod
+    def _datetime_format(date):
+        return TConnectEntry._tz().convert_datetime(date)[0]
+
     @staticmethod
     def parse_ciq_basal_entry(data, delivery_type=""):
-        time = TConnectEntry._epoch_parse(data["x"])
+        time, epoch = TConnectEntry._tz().convert_epoch(data["x"])
         duration_mins = data["duration"] / 60
         basal_rate = data["y"]
 
-        return {
-            "time": time.format(),
-            "delivery_type": delivery_type,
-            "duration_mins": duration_mins,
-            "basal_rate": basal_rate,
-        }
+        return BasalEvent(
+            time=time,
+            epoch=epoch,
+            delivery_type=delivery_type,
+            duration_mins=duration_mins,
+            basal_rate=basal_rate,
+        )
 
     @staticmethod
     def parse_suspension_entry(data):
-        time = TConnectEntry._epoch_parse(data["x"])
-        return {
-            "time": time.format(),
-            "continuation": data["continuation"],
-            "suspendReason": data["suspendReason"],
-        }
+        time, epoch = TConnectEntry._tz().convert_epoch(data["x"])
+        return SuspensionEvent(
+            time=time,
+            epoch=epoch,
+            continuation=data["continuation"],
+            suspend_reason=data["suspendReason"],
+        )
 
     @staticmethod
     def _datetime_parse(date):
@@ -57,30 +84,36 @@ class TConnectEntry:
     @staticmethod
     def parse_cgm_entry(data):
         # EventDateTime is stored in the user's timezone.
-        return {
-            "time": TConnectEntry._datetime_parse(data["EventDateTime"]).format(),
-            "reading": data["Readings (CGM / BGM)"],
-            "reading_type": data["Description"],
-        }
+        time, epoch = TConnectEntry._tz().convert_datetime(data["EventDateTime"])
+        return CgmReading(
+            time=time,
+            epoch=epoch,
+            reading=data["Readings (CGM / BGM)"],
+            reading_type=data["Description"],
+        )
 
     @staticmethod
     def parse_iob_entry(data):
         # EventDateTime is stored in the user's timezone.
-        return {
-            "time": TConnectEntry._datetime_parse(data["EventDateTime"]).format(),
-            "iob": data["IOB"],
-            "event_id": data["EventID"],
-        }
+        time, epoch = TConnectEntry._tz().convert_datetime(data["EventDateTime"])
+        return IobEvent(
+            time=time,
+            epoch=epoch,
+            iob=data["IOB"],
+            event_id=data["EventID"],
+        )
 
     @staticmethod
     def parse_csv_basal_entry(data, duration_mins=None):
         # EventDateTime is stored in the user's timezone.
-        return {
-            "time": TConnectEntry._datetime_parse(data["EventDateTime"]).format(),
-            "delivery_type": "Unknown",
-            "duration_mins": duration_mins,
-            "basal_rate": data["BasalRate"],
-        }
+        time, epoch = TConnectEntry._tz().convert_datetime(data["EventDateTime"])
+        return BasalEvent(
+            time=time,
+            epoch=epoch,
+            delivery_type="Unknown",
+            duration_mins=duration_mins,
+            basal_rate=data["BasalRate"],
+        )
 
     @staticmethod
     def parse_bolus_entry(data):
@@ -88,16 +121,30 @@ class TConnectEntry:
         complete = (data["ExtendedBolusIsComplete"] or data["BolusIsComplete"])
         extended_bolus = ("extended" in data["Description"].lower())
 
-        return {
-            "description": data["Description"],
-            "complete": "1" if complete else "",
-            "completion": data["CompletionStatusDesc"] if not extended_bolus else data["BolexCompletionStatusDesc"],
-            "request_time": TConnectEntry._datetime_parse(data["RequestDateTime"]).format() if complete and not extended_bolus else None,
-            "completion_time": TConnectEntry._datetime_parse(data["CompletionDateTime"]).format() if complete and not extended_bolus else None,
-            "insulin": data["InsulinDelivered"],
-            "carbs": data["CarbSize"],
-            "user_override": data["UserOverride"],
-            "extended_bolus": "1" if extended_bolus else "",
-            "bolex_completion_time": TConnectEntry._datetime_parse(data["BolexCompletionDateTime"]).format() if complete and extended_bolus else None,
-            "bolex_start_time": TConnectEntry._datetime_parse(data["BolexStartDateTime"]).format() if complete and extended_bolus else None,
-        }
\ No newline at end of file
+        request_time = completion_time = bolex_completion_time = bolex_start_time = None
+        time = epoch = None
+        if complete and not extended_bolus:
+            request_time = TConnectEntry._datetime_format(data["RequestDateTime"])
+            completion_time, epoch = TConnectEntry._tz().convert_datetime(data["CompletionDateTime"])
+            time = completion_time
+        elif complete:
+            bolex_completion_time = TConnectEntry._datetime_format(data["BolexCompletionDateTime"])
+            bolex_start_time, epoch = TConnectEntry._tz().convert_datetime(data["BolexStartDateTime"])
+            time = bolex_start_time
+
+        return BolusEvent(
+            description=data["Description"],
+            complete="1" if complete else "",
+            completion=data["CompletionStatusDesc"] if not extended_bolus else data["BolexCompletionStatusDesc"],
+            request_time=request_time,
+            completion_time=completion_time,
+            insulin=data["InsulinDelivered"],
+            carbs=data["CarbSize"],
+            user_override=data["UserOverride"],
+            extended_bolus="1" if extended_bolus else "",
+            bolex_completion_time=bolex_completion_time,
+            bolex_start_time=bolex_start_time,
+            request_id=data.get("BolusRequestID"),
+            time=time,
+            epoch=epoch,
+        )
@@ -0,0 +1,121 @@
+import arrow
+import datetime
+import functools
+
+try:
+    from zoneinfo import ZoneInfo as _get_timezone
+except ImportError:
+    # Python < 3.9
+    from dateutil.tz import gettz as _get_timezone
+
+"""
+Fast conversion of t:connect timestamps into the formatted timestamp
+strings used internally (e.g. "2021-03-16 00:00:00-04:00", the same format
+as arrow's default format()), using only the standard library.
+
+UTC offsets only change at timezone transitions, which occur on
+quarter-hour boundaries, so offsets are looked up once per quarter hour
+and cached. Date strings are cached per day. Each cache is cleared once
+it reaches _CACHE_SIZE entries, so that memory use stays bounded over
+long ranges.
+"""
+
+_BUCKET_SECONDS = 15 * 60
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_EPOCH = datetime.datetime(1970, 1, 1)
+_UTC = datetime.timezone.utc
+_CACHE_SIZE = 8192
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    tz = _get_timezone(name)
+    if tz is None:
+        raise ValueError('Unknown timezone: %s' % name)
+    return tz
+
+@functools.lru_cache(maxsize=None)
+def _format_offset(offset_seconds):
+    sign = '-' if offset_seconds < 0 else '+'
+    hours, minutes = divmod(abs(offset_seconds) // 60, 60)
+    return '%s%02d:%02d' % (sign, hours, minutes)
+
+class TimezoneConverter:
+    def __init__(self, tz_name, source_tz_name='America/Los_Angeles'):
+        self.tz = get_timezone(tz_name)
+        self.source_tz = get_timezone(source_tz_name)
+
+        # utc bucket -> (source utc offset seconds, fold)
+        self._source_offsets = {}
+        # (wall bucket, fold) -> (utc offset seconds, formatted offset)
+        self._local_offsets = {}
+        # days since epoch -> "YYYY-MM-DD"
+        self._dates = {}
+
+    def _source_offset(self, epoch):
+        bucket = epoch // _BUCKET_SECONDS
+        cached = self._source_offsets.get(bucket)
+        if cached is None:
+            dt = datetime.datetime.fromtimestamp(bucket * _BUCKET_SECONDS, self.source_tz)
+            cached = (int(dt.utcoffset().total_seconds()), dt.fold)
+            if len(self._source_offsets) >= _CACHE_SIZE:
+                self._source_offsets.clear()
+            self._source_offsets[bucket] = cached
+        return cached
+
+    def _local_offset(self, wall_seconds, fold):
+        key = (wall_seconds // _BUCKET_SECONDS, fold)
+        cached = self._local_offsets.get(key)
+        if cached is None:
+            dt = (_EPOCH + datetime.timedelta(seconds=key[0] * _BUCKET_SECONDS)).replace(tzinfo=self.tz, fold=fold)
+            offset = int(dt.utcoffset().total_seconds())
+            cached = (offset, _format_offset(offset))
+            if len(self._local_offsets) >= _CACHE_SIZE:
+                self._local_offsets.clear()
+            self._local_offsets[key] = cached
+        return cached
+
+    def _format_wall(self, wall_seconds, offset_str):
+        days, secs = divmod(wall_seconds, 86400)
+        date = self._dates.get(days)
+        if date is None:
+            date = datetime.date.fromordinal(days + _EPOCH_ORDINAL).isoformat()
+            if len(self._dates) >= _CACHE_SIZE:
+                self._dates.clear()
+            self._dates[days] = date
+
+        hours, secs = divmod(secs, 3600)
+        minutes, secs = divmod(secs, 60)
+        return '%s %02d:%02d:%02d%s' % (date, hours, minutes, secs, offset_str)
+
+    """
+    Converts an integer epoch timestamp from the ControlIQ API, which holds
+    the user's local wall time when read in the source (Pacific) timezone,
+    into a (formatted time, UTC epoch) tuple in the user's timezone.
+    """
+    def convert_epoch(self, x):
+        x = int(x)
+        source_offset, fold = self._source_offset(x)
+        wall_seconds = x + source_offset
+        offset, offset_str = self._local_offset(wall_seconds, fold)
+        return self._format_wall(wall_seconds, offset_str), wall_seconds - offset
+
+    """
+    Converts a "YYYY-MM-DDTHH:MM:SS" timestamp, stored in the user's
+    timezone, into a (formatted time, UTC epoch) tuple.
+    """
+    def convert_datetime(self, date):
+        if len(date) == 19 and date[10] == 'T':
+            try:
+                days = datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10])).toordinal() - _EPOCH_ORDINAL
+                wall_seconds = days * 86400 + int(date[11:13]) * 3600 + int(date[14:16]) * 60 + int(date[17:19])
+            except ValueError:
+                return self._convert_datetime_slow(date)
+
+            offset, offset_str = self._local_offset(wall_seconds, 0)
+            return self._format_wall(wall_seconds, offset_str), wall_seconds - offset
+
+        return self._convert_datetime_slow(date)
+
+    def _convert_datetime_slow(self, date):
+        t = arrow.get(date, tzinfo=self.tz)
+        return t.format(), t.int_timestamp
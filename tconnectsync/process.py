@@ -1,48 +1,149 @@
 import logging
 import datetime
-import arrow
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics, profiling, tracing
 from .util import timeago
 from .api.common import ApiException
 from .sync.basal import (
     process_ciq_basal_events,
     add_csv_basal_events,
-    ns_write_basal_events
+    ns_write_basal_events,
+    ns_sync_basal_events
 )
 from .sync.bolus import (
     process_bolus_events,
-    ns_write_bolus_events
+    ns_write_bolus_events,
+    ns_sync_bolus_events
 )
 from .sync.iob import (
     process_iob_events,
     ns_write_iob_events
 )
 from .parser.tconnect import TConnectEntry
+from .parser.tz import get_timezone
+from .secret import (
+    BASAL_ENGINE,
+    BASAL_SUSPENSION_TOLERANCE_SECONDS,
+    NS_SYNC_WINDOW,
+    NS_DETERMINISTIC_IDS,
+    TIMEZONE_NAME
+)
 
 logger = logging.getLogger(__name__)
 
 """
-Given a TConnectApi object and start/end range, performs a single
-cycle of synchronizing data within the time range.
-If pretend is true, then doesn't actually write data to Nightscout.
+Downloads therapy timeline data from the ControlIQ API. Returns None if the
+API has no data because ControlIQ had not launched in the queried range.
 """
-def process_time_range(tconnect, nightscout, time_start, time_end, pretend):
+@tracing.traced('download_ciq')
+def download_ciq_therapy_timeline(controliq, time_start, time_end):
     logger.info("Downloading t:connect ControlIQ data")
     try:
-        ciqTherapyTimelineData = tconnect.controliq.therapy_timeline(time_start, time_end)
+        data = controliq.therapy_timeline(time_start, time_end)
     except ApiException as e:
         # The ControlIQ API returns a 404 if the user did not have a ControlIQ enabled
         # device in the time range which is queried. Since it launched in early 2020,
         # ignore 404's before February.
         if e.status_code == 404 and time_start.date() < datetime.date(2020, 2, 1):
             logger.warning("Ignoring HTTP 404 for ControlIQ API request before Feb 2020")
-            ciqTherapyTimelineData = None
+            return None
         else:
             raise e
 
+    count_ciq_rows(data)
+    return data
+
+CIQ_SECTIONS = ('tempDeliveryEvents', 'algorithmDeliveryEvents', 'profileDeliveryEvents')
+
+def count_ciq_rows(data):
+    if not data:
+        return
+    metrics.ROWS_PARSED.inc(len(data.get("suspensionDeliveryEvents") or []), section="suspensionDeliveryEvents")
+    for section in CIQ_SECTIONS:
+        metrics.ROWS_PARSED.inc(len((data.get("basal") or {}).get(section) or []), section=section)
+
+"""
+Downloads therapy timeline data from the WS2 CSV API.
+"""
+@tracing.traced('download_csv')
+def download_ws2_therapy_timeline_csv(ws2, time_start, time_end):
     logger.info("Downloading t:connect CSV data")
-    csvdata = tconnect.ws2.therapy_timeline_csv(time_start, time_end)
+    return ws2.therapy_timeline_csv(time_start, time_end)
+
+"""
+Downloads the ControlIQ therapy timeline and WS2 CSV data for the given
+time range. The two endpoints are independent and live on different hosts,
+so they are fetched concurrently. Any exception raised by either download
+is re-raised to the caller.
+"""
+@tracing.traced('download')
+def download_time_range(tconnect, time_start, time_end):
+    # Resolve (and if needed, log in to) both APIs on the calling thread,
+    # since WS2Api is instantiated using the ControlIQ login's userGuid.
+    controliq = tconnect.controliq
+    ws2 = tconnect.ws2
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ciq_future = executor.submit(_in_worker(download_ciq_therapy_timeline), controliq, time_start, time_end)
+        csv_future = executor.submit(_in_worker(download_ws2_therapy_timeline_csv), ws2, time_start, time_end)
+
+        return ciq_future.result(), csv_future.result()
+
+def _in_worker(fn):
+    return profiling.propagate(tracing.propagate(fn))
+
+"""
+Given a TConnectApi object and start/end range, performs a single
+cycle of synchronizing data within the time range.
+If pretend is true, then doesn't actually write data to Nightscout.
+If a profiler is configured, the cycle is profiled.
+synced_until, if given, is called as in sync_time_range_data.
+account labels the cycle's metrics, and is empty outside of
+multi-account mode.
+"""
+def process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None, account=''):
+    start = time.monotonic()
+    try:
+        with profiling.cycle(), tracing.span('process_time_range', time_start=str(time_start), time_end=str(time_end)) as s:
+            ciqTherapyTimelineData, csvdata = download_time_range(tconnect, time_start, time_end)
+            added = sync_time_range_data(nightscout, ciqTherapyTimelineData, csvdata, pretend, synced_until=synced_until)
+            if s:
+                s.attrs['added'] = added
+    except Exception:
+        metrics.CYCLE_SECONDS.observe(time.monotonic() - start, account=account, result='failure')
+        raise
+
+    metrics.CYCLE_SECONDS.observe(time.monotonic() - start, account=account, result='success')
+    metrics.LAST_SUCCESSFUL_CYCLE.set(time.time(), account=account)
+    return added
+
+"""
+Given downloaded ControlIQ and CSV data, processes it and writes
+any new basal, bolus and IOB events to Nightscout.
+lastCsvBasalRow, if given, is the final CSV basal row preceding this
+data, which is used to compute the duration of the first basal row.
+Event types ('basal', 'bolus' or 'iob') listed in skip are not written,
+and checkpoint, if given, is called with each event type and the number
+of events added once that type has been written.
+If sync_window is true, basal and bolus events are compared against all
+treatments already uploaded within the time range, rather than only the
+most recent one, so that gaps are filled and duplicates are not created.
+If deterministic_ids is true, basal and bolus entries are upserted with an
+_id derived from the pump event, so that re-sending them is idempotent.
+synced_until, if given, is called once all events have been written with
+the time of the newest of them, as a naive datetime in TIMEZONE_NAME,
+unless there were none.
+"""
+def sync_time_range_data(nightscout, ciqTherapyTimelineData, csvdata, pretend, lastCsvBasalRow=None, skip=(), checkpoint=None, sync_window=None, deterministic_ids=None, synced_until=None):
+    if sync_window is None:
+        sync_window = NS_SYNC_WINDOW
+    if deterministic_ids is None:
+        deterministic_ids = NS_DETERMINISTIC_IDS
+    write_basal_events = ns_sync_basal_events if sync_window else ns_write_basal_events
+    write_bolus_events = ns_sync_bolus_events if sync_window else ns_write_bolus_events
 
     readingData = csvdata["readingData"]
     iobData = csvdata["iobData"]
@@ -58,21 +159,60 @@ def process_time_range(tconnect, nightscout, time_start, time_end, pretend):
         logger.warning("No last CGM reading is able to be determined")
 
     added = 0
+    newest_epoch = None
 
-    basalEvents = process_ciq_basal_events(ciqTherapyTimelineData)
-    if csvBasalData:
-        logger.debug("CSV basal data found: processing it")
-        add_csv_basal_events(basalEvents, csvBasalData)
-    else:
-        logger.debug("No CSV basal data found")
+    def track_newest(events):
+        nonlocal newest_epoch
+        for event in events:
+            if event.epoch is not None and (newest_epoch is None or event.epoch > newest_epoch):
+                newest_epoch = event.epoch
+
+    if 'basal' not in skip:
+        with tracing.span('process_basal'):
+            if BASAL_ENGINE == 'numpy':
+                # Imported here, since numpy is slow to import
+                from .sync import basal_vectorized
+            if BASAL_ENGINE == 'numpy' and basal_vectorized.available():
+                basalEvents = basal_vectorized.process_ciq_basal_events(ciqTherapyTimelineData,
+                    suspension_tolerance=BASAL_SUSPENSION_TOLERANCE_SECONDS)
+                add_csv = basal_vectorized.add_csv_basal_events
+            else:
+                if BASAL_ENGINE == 'numpy':
+                    logger.warning("BASAL_ENGINE is numpy, but numpy is not installed: using the default basal engine")
+                basalEvents = process_ciq_basal_events(ciqTherapyTimelineData)
+                add_csv = add_csv_basal_events
+
+            if csvBasalData:
+                logger.debug("CSV basal data found: processing it")
+                add_csv(basalEvents, csvBasalData, last_row=lastCsvBasalRow)
+            else:
+                logger.debug("No CSV basal data found")
 
-    added += ns_write_basal_events(nightscout, basalEvents, pretend=pretend)
+        count = write_basal_events(nightscout, basalEvents, pretend=pretend, deterministic_ids=deterministic_ids)
+        if checkpoint:
+            checkpoint('basal', count)
+        added += count
+        track_newest(basalEvents)
 
-    bolusEvents = process_bolus_events(bolusData)
-    added += ns_write_bolus_events(nightscout, bolusEvents, pretend=pretend)
+    if 'bolus' not in skip:
+        with tracing.span('process_bolus'):
+            bolusEvents = process_bolus_events(bolusData)
+        count = write_bolus_events(nightscout, bolusEvents, pretend=pretend, deterministic_ids=deterministic_ids)
+        if checkpoint:
+            checkpoint('bolus', count)
+        added += count
+        track_newest(bolusEvents)
 
-    iobEvents = process_iob_events(iobData)
-    added += ns_write_iob_events(nightscout, iobEvents, pretend=pretend)
+    if 'iob' not in skip:
+        with tracing.span('process_iob'):
+            iobEvents = process_iob_events(iobData)
+        count = ns_write_iob_events(nightscout, iobEvents, pretend=pretend)
+        if checkpoint:
+            checkpoint('iob', count)
+        added += count
+        track_newest(iobEvents)
 
     logger.info("Wrote %d events to Nightscout this process cycle" % added)
+    if synced_until and newest_epoch is not None:
+        synced_until(datetime.datetime.fromtimestamp(newest_epoch, get_timezone(TIMEZONE_NAME)).replace(tzinfo=None))
     return added
\ No newline at end of file
@@ -0,0 +1,252 @@
+import io
+import inspect
+import logging
+import functools
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+"""
+cProfile profiling of sync cycles, for finding which functions a slow
+sync spends its time in, where tracing only shows which stage.
+
+Each process_time_range() call made while a profiler is configured is
+profiled, including work it hands to download threads. Results from all
+cycles are accumulated, and after each cycle are written to a pstats
+file, which can be read with the pstats module or tools such as
+snakeviz, along with a human-readable summary of the top functions.
+When no profiler is configured, which is the default, nothing is
+profiled.
+"""
+
+DEFAULT_TOP = 25
+DEFAULT_SORT = 'cumulative'
+
+_local = threading.local()
+_profiler = None
+
+class Profiler:
+    def __init__(self, path, top=DEFAULT_TOP, sort=DEFAULT_SORT):
+        self.path = path
+        self.summary_path = path + '.txt'
+        self.top = top
+        self.sort = sort
+        self.cycles = 0
+        self._stats = None
+        self._lock = threading.Lock()
+
+    """
+    Context manager which profiles its block on the current thread, and
+    adds the result to the accumulated stats. Blocks nested within one
+    which is already being profiled are not profiled again.
+    """
+    @contextlib.contextmanager
+    def profile(self):
+        if getattr(_local, 'active', False):
+            yield
+            return
+
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Python 3.12+ allows only one active profiler per process
+            logger.debug("Unable to profile thread: %s" % e)
+            yield
+            return
+
+        _local.active = True
+        try:
+            yield
+        finally:
+            profile.disable()
+            _local.active = False
+            self._add(profile)
+
+    def _add(self, profile):
+        import pstats
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    """
+    Context manager which profiles its block as one sync cycle, and then
+    writes the stats and summary of all cycles so far.
+    """
+    @contextlib.contextmanager
+    def cycle(self):
+        try:
+            with self.profile():
+                yield
+        finally:
+            with self._lock:
+                self.cycles += 1
+            self.write()
+
+    """
+    Writes the accumulated stats to path, and their summary to path.txt.
+    """
+    def write(self):
+        summary = self.summary()
+        if summary is None:
+            return
+
+        with self._lock:
+            self._stats.dump_stats(self.path)
+        with open(self.summary_path, 'w') as f:
+            f.write(summary)
+        logger.info("Wrote profile of %d sync cycle(s) to %s" % (self.cycles, self.path))
+
+    """
+    Returns the top functions by the sort key as text, or None if nothing
+    has been profiled yet.
+    """
+    def summary(self):
+        import pstats
+        stream = io.StringIO()
+        with self._lock:
+            if self._stats is None:
+                return None
+            # Summarized from a copy, since strip_dirs() would also shorten the paths in the pstats file
+            stats = pstats.Stats(stream=stream)
+            stats.add(self._stats)
+            cycles = self.cycles
+
+        stream.write('Profile of %d sync cycle(s), top %d functions by %s time\n' % (cycles, self.top, self.sort))
+        stats.strip_dirs().sort_stats(self.sort).print_stats(self.top)
+        return stream.getvalue()
+
+"""
+Sets the profiler used for sync cycles, or disables profiling if profiler
+is None. Returns the previous profiler.
+"""
+def configure(profiler):
+    global _profiler
+    previous, _profiler = _profiler, profiler
+    return previous
+
+def enabled():
+    return _profiler is not None
+
+"""
+Context manager which profiles its block as a sync cycle with the
+configured profiler, if any.
+"""
+@contextlib.contextmanager
+def cycle():
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+
+    with profiler.cycle():
+        yield
+
+"""
+Wraps fn so that, if it is called on another thread, such as by a thread
+pool, while the current thread is being profiled, that thread is
+profiled too.
+"""
+def propagate(fn):
+    profiler = _profiler
+    if profiler is None or not getattr(_local, 'active', False):
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with profiler.profile():
+            return fn(*args, **kwargs)
+    return wrapper
+
+"""
+Replaces request methods of API objects with ones which make each
+distinct request once, and afterwards return the recorded response, so
+that parsing and processing can be profiled without network time.
+Streamed responses are recorded as a list of their lines.
+"""
+class RecordedResponses:
+    def __init__(self):
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def install(self, api, method):
+        fetch = getattr(api, method)
+
+        @functools.wraps(fetch)
+        def replay(*args, **kwargs):
+            key = (id(api), method, repr(args), repr(sorted(kwargs.items())))
+            with self._lock:
+                if key in self.responses:
+                    return self.responses[key]
+            response = fetch(*args, **kwargs)
+            if inspect.isgenerator(response):
+                response = list(response)
+            with self._lock:
+                self.responses[key] = response
+            return response
+
+        setattr(api, method, replay)
+
+"""
+Stands in for NightscoutApi when profiling, as a Nightscout site with no
+entries which accepts writes without making requests.
+"""
+class OfflineNightscoutApi:
+    url = 'offline://'
+
+    def last_uploaded_entry(self, eventType):
+        return None
+
+    def last_uploaded_activity(self, activityType):
+        return None
+
+    def treatments_in_range(self, eventType, time_start, time_end, page_size=None):
+        return []
+
+    def upload_entry(self, ns_format, entity='treatments'):
+        pass
+
+    def upload_entries(self, ns_formats, entity='treatments', batch_size=None):
+        pass
+
+    def put_entry(self, ns_format, entity):
+        pass
+
+    def delete_entry(self, entity):
+        pass
+
+    def upsert_entries(self, ns_formats, entity='treatments'):
+        pass
+
+"""
+Profiles only the CPU-side stages of a sync of the given time range:
+parsing the t:connect responses and processing them into Nightscout
+entries. The t:connect data is downloaded first without profiling, or
+read from the response cache if one is configured, and the profiled
+cycles are run against the recorded responses. Entries are processed as
+if Nightscout had no data, but nothing is uploaded. Returns the number
+of entries which would have been added.
+"""
+def profile_cpu_stages(tconnect, time_start, time_end, cycles=1):
+    # Imported here, since process imports this module
+    from .process import download_time_range, sync_time_range_data
+
+    responses = RecordedResponses()
+    responses.install(tconnect.controliq, '_get')
+    responses.install(tconnect.ws2, 'get')
+    responses.install(tconnect.ws2, 'get_lines')
+
+    logger.info("Downloading t:connect data before profiling")
+    download_time_range(tconnect, time_start, time_end)
+
+    nightscout = OfflineNightscoutApi()
+    added = 0
+    for _ in range(cycles):
+        with cycle():
+            ciqTherapyTimelineData, csvdata = download_time_range(tconnect, time_start, time_end)
+            added = sync_time_range_data(nightscout, ciqTherapyTimelineData, csvdata, pretend=False)
+    return added
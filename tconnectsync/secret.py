@@ -35,12 +35,52 @@ AUTOUPDATE_MAX_SLEEP_SECONDS = get_number('AUTOUPDATE_MAX_SLEEP_SECONDS', '1500'
 AUTOUPDATE_USE_FIXED_SLEEP = get_bool('AUTOUPDATE_USE_FIXED_SLEEP', 'false')
 AUTOUPDATE_FAILURE_MINUTES = get_number('AUTOUPDATE_FAILURE_MINUTES', '180') # 3 hours
 AUTOUPDATE_RESTART_ON_FAILURE = get_bool('AUTOUPDATE_RESTART_ON_FAILURE', 'false')
+AUTOUPDATE_INCREMENTAL = get_bool('AUTOUPDATE_INCREMENTAL', 'false')
+AUTOUPDATE_INCREMENTAL_OVERLAP_MINUTES = get_number('AUTOUPDATE_INCREMENTAL_OVERLAP_MINUTES', '60')
+
+NS_POOL_SIZE = get_number('NS_POOL_SIZE', '10')
+NS_UPLOAD_BATCH_SIZE = get_number('NS_UPLOAD_BATCH_SIZE', '50')
+NS_SYNC_WINDOW = get_bool('NS_SYNC_WINDOW', 'false')
+NS_DETERMINISTIC_IDS = get_bool('NS_DETERMINISTIC_IDS', 'false')
+
+BACKFILL_CHUNK_DAYS = get_number('BACKFILL_CHUNK_DAYS', '7')
+BACKFILL_MAX_WORKERS = get_number('BACKFILL_MAX_WORKERS', '2')
+BACKFILL_REQUESTS_PER_MINUTE = get_number('BACKFILL_REQUESTS_PER_MINUTE', '12')
+BACKFILL_JOURNAL_PATH = get('BACKFILL_JOURNAL_PATH', '')
+
+CACHE_DIR = get('CACHE_DIR', '')
+CACHE_IMMUTABLE_DAYS = get_number('CACHE_IMMUTABLE_DAYS', '1')
+CACHE_TTL_SECONDS = get_number('CACHE_TTL_SECONDS', '60')
+
+TOKEN_STORE_PATH = get('TOKEN_STORE_PATH', '')
+TOKEN_STORE_SECRET = get('TOKEN_STORE_SECRET', '')
+
+SERVICE_MAX_WORKERS = get_number('SERVICE_MAX_WORKERS', '4')
+SERVICE_REQUESTS_PER_MINUTE = get_number('SERVICE_REQUESTS_PER_MINUTE', '30')
+
+METRICS_PORT = get_number('METRICS_PORT', '0')
+METRICS_HOST = get('METRICS_HOST', '127.0.0.1')
+
+TRACE_PATH = get('TRACE_PATH', '')
+TRACE_FORMAT = get('TRACE_FORMAT', 'jsonl')
+
+BASAL_ENGINE = get('BASAL_ENGINE', 'python')
+BASAL_SUSPENSION_TOLERANCE_SECONDS = get_number('BASAL_SUSPENSION_TOLERANCE_SECONDS', '0')
 
 _config = ['TCONNECT_EMAIL', 'TCONNECT_PASSWORD', 'PUMP_SERIAL_NUMBER',
           'NS_URL', 'NS_SECRET', 'TIMEZONE_NAME',
           'AUTOUPDATE_DEFAULT_SLEEP_SECONDS', 'AUTOUPDATE_MAX_SLEEP_SECONDS',
           'AUTOUPDATE_USE_FIXED_SLEEP', 'AUTOUPDATE_FAILURE_MINUTES',
-          'AUTOUPDATE_RESTART_ON_FAILURE']
+          'AUTOUPDATE_RESTART_ON_FAILURE', 'AUTOUPDATE_INCREMENTAL',
+          'AUTOUPDATE_INCREMENTAL_OVERLAP_MINUTES', 'NS_POOL_SIZE',
+          'NS_UPLOAD_BATCH_SIZE', 'NS_SYNC_WINDOW', 'NS_DETERMINISTIC_IDS',
+          'BACKFILL_CHUNK_DAYS', 'BACKFILL_MAX_WORKERS',
+          'BACKFILL_REQUESTS_PER_MINUTE', 'BACKFILL_JOURNAL_PATH',
+          'CACHE_DIR', 'CACHE_IMMUTABLE_DAYS', 'CACHE_TTL_SECONDS',
+          'TOKEN_STORE_PATH', 'TOKEN_STORE_SECRET',
+          'SERVICE_MAX_WORKERS', 'SERVICE_REQUESTS_PER_MINUTE',
+          'METRICS_PORT', 'METRICS_HOST', 'TRACE_PATH', 'TRACE_FORMAT',
+          'BASAL_ENGINE', 'BASAL_SUSPENSION_TOLERANCE_SECONDS']
 
 if __name__ == '__main__':
     for k in locals():
@@ -0,0 +1,297 @@
+import json
+import heapq
+import logging
+import datetime
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .api import TConnectApi
+from .nightscout import NightscoutApi
+from .process import process_time_range
+from .util.ratelimit import HostRateLimiter
+from .autoupdate import (
+    incremental_time_range,
+    timezone_now,
+    rolling_sleep_seconds,
+    renew_android_token,
+    AutoupdateFailureException,
+    UNEXPECTED_NO_CHANGE_SLEEP_SECONDS
+)
+from .secret import (
+    AUTOUPDATE_USE_FIXED_SLEEP,
+    AUTOUPDATE_FAILURE_MINUTES,
+    AUTOUPDATE_INCREMENTAL,
+    SERVICE_MAX_WORKERS,
+    SERVICE_REQUESTS_PER_MINUTE
+)
+
+logger = logging.getLogger(__name__)
+
+"""
+A multi-account sync service, which runs auto-update for several
+t:connect accounts in one process.
+
+A single scheduler thread keeps a heap of the time at which each account
+is next due to poll for new data, and hands due accounts to a thread pool
+of bounded size. t:connect and Nightscout requests are rate limited per
+host across all accounts, and accounts whose Nightscout sites share a host
+share one pooled session. Accounts which fail to sync are retried later,
+without affecting the others.
+
+All accounts use the same TIMEZONE_NAME.
+"""
+
+# Seconds to wait before retrying an account whose poll or sync failed
+RETRY_SECONDS = 60
+
+ACCOUNT_FIELDS = ('TCONNECT_EMAIL', 'TCONNECT_PASSWORD', 'PUMP_SERIAL_NUMBER', 'NS_URL', 'NS_SECRET')
+
+"""
+The configuration of a single account, read from the accounts file.
+"""
+class Account:
+    def __init__(self, name, email, password, pump_serial_number, ns_url, ns_secret):
+        self.name = name
+        self.email = email
+        self.password = password
+        self.pump_serial_number = pump_serial_number
+        self.ns_url = ns_url
+        self.ns_secret = ns_secret
+
+    def __repr__(self):
+        return 'Account(%s)' % self.name
+
+"""
+Reads a JSON accounts file containing a list of objects, each with the
+same TCONNECT_EMAIL, TCONNECT_PASSWORD, PUMP_SERIAL_NUMBER, NS_URL and
+NS_SECRET settings as a single-account .env file, and an optional NAME
+used in log messages.
+"""
+def load_accounts(path):
+    with open(path, 'r') as f:
+        entries = json.load(f)
+
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('%s must contain a list of accounts' % path)
+
+    accounts = []
+    for i, entry in enumerate(entries):
+        missing = [field for field in ACCOUNT_FIELDS if not entry.get(field)]
+        if missing:
+            raise ValueError('Account %d in %s is missing %s' % (i, path, ', '.join(missing)))
+
+        try:
+            pump_serial_number = int(entry['PUMP_SERIAL_NUMBER'])
+        except ValueError:
+            raise ValueError('Account %d in %s: PUMP_SERIAL_NUMBER must be a number' % (i, path))
+
+        accounts.append(Account(
+            name=entry.get('NAME') or entry['TCONNECT_EMAIL'],
+            email=entry['TCONNECT_EMAIL'],
+            password=entry['TCONNECT_PASSWORD'],
+            pump_serial_number=pump_serial_number,
+            ns_url=entry['NS_URL'],
+            ns_secret=entry['NS_SECRET']
+        ))
+
+    names = [a.name for a in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError('Account names in %s must be unique' % path)
+    return accounts
+
+"""
+The API clients and auto-update progress of a single account.
+"""
+class AccountState:
+    def __init__(self, account, tconnect, nightscout):
+        self.account = account
+        self.tconnect = tconnect
+        self.nightscout = nightscout
+
+        self.last_event_index = None
+        self.last_event_time = None
+        self.last_process_time_range = None
+        self.last_synced_time = None
+        self.time_diffs = []
+        self.syncs = 0
+        self.failures = 0
+
+class SyncService:
+    def __init__(self, states, time_start, time_end, pretend, max_workers=SERVICE_MAX_WORKERS,
+                 incremental=AUTOUPDATE_INCREMENTAL, clock=time.time):
+        self.states = states
+        self.time_start = time_start
+        self.time_end = time_end
+        self.pretend = pretend
+        self.max_workers = max_workers
+        self.incremental = incremental
+        self._clock = clock
+
+        self._queue = []
+        self._cond = threading.Condition()
+        self._stopping = False
+        # Limits accounts in progress, so that due accounts wait in the
+        # heap rather than in the executor's queue
+        self._slots = threading.Semaphore(max_workers)
+
+    """
+    Requests a graceful shutdown: no further accounts are started, and
+    run() returns once those in progress complete.
+    """
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def _schedule(self, state, due):
+        with self._cond:
+            heapq.heappush(self._queue, (due, id(state), state))
+            self._cond.notify_all()
+
+    """
+    Blocks until an account is due, and returns it, or returns None once
+    the service is stopped.
+    """
+    def _next_due(self):
+        with self._cond:
+            while not self._stopping:
+                if self._queue:
+                    wait = self._queue[0][0] - self._clock()
+                    if wait <= 0:
+                        return heapq.heappop(self._queue)[2]
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+            return None
+
+    """
+    Polls a single account for new data, synchronizes it if there is any,
+    and returns the number of seconds until the account should be polled
+    again.
+    """
+    def poll_account(self, state):
+        account = state.account
+
+        last_event = state.tconnect.android.last_event_uploaded(account.pump_serial_number)
+        now = self._clock()
+
+        if state.last_event_index is not None and last_event['maxPumpEventIndex'] <= state.last_event_index:
+            logger.info('[%s] No new reported t:connect data. (last event index: %s)' % (account.name, last_event['maxPumpEventIndex']))
+            self._check_failure(state, now)
+
+            if len(state.time_diffs) > 2:
+                return UNEXPECTED_NO_CHANGE_SLEEP_SECONDS
+        else:
+            logger.info('[%s] New reported t:connect data. (event index: %s last: %s)' % (account.name, last_event['maxPumpEventIndex'], state.last_event_index))
+            if state.last_event_index is not None:
+                state.time_diffs.append(now - state.last_event_time)
+            state.last_event_index = last_event['maxPumpEventIndex']
+            state.last_event_time = now
+
+            self.sync_account(state, now)
+
+        if AUTOUPDATE_USE_FIXED_SLEEP != 1 and len(state.time_diffs) > 10:
+            state.time_diffs = state.time_diffs[1:]
+        sleep_secs = rolling_sleep_seconds(state.time_diffs)
+
+        renew_android_token(state.tconnect, sleep_secs)
+        return sleep_secs
+
+    def sync_account(self, state, now):
+        account = state.account
+        if self.pretend:
+            logger.info('[%s] Would update now if not in pretend mode' % account.name)
+            return
+
+        sync_start, sync_end = self.time_start, self.time_end
+        if self.incremental:
+            sync_start, sync_end = incremental_time_range(self.time_start, state.last_synced_time, timezone_now())
+
+        logger.info('[%s] Syncing between %s and %s' % (account.name, sync_start, sync_end))
+        synced = []
+        added = process_time_range(state.tconnect, state.nightscout, sync_start, sync_end, self.pretend, synced_until=synced.append, account=account.name)
+        if synced:
+            state.last_synced_time = synced[0]
+
+        logger.info('[%s] Added %d items from process_time_range' % (account.name, added))
+        if added == 0:
+            if state.syncs > 0:
+                logger.error('[%s] An event index change was recorded, but no new data was found via the API.' % account.name)
+        else:
+            state.last_process_time_range = now
+        state.syncs += 1
+
+    def _check_failure(self, state, now):
+        if state.last_event_time and (now - state.last_event_time) >= 60 * AUTOUPDATE_FAILURE_MINUTES:
+            logger.error(AutoupdateFailureException("[%s] No new data event indexes have been detected for over %d minutes. " % (state.account.name, AUTOUPDATE_FAILURE_MINUTES) +
+                         "The t:connect app might no longer be functioning."))
+        elif state.last_process_time_range and (now - state.last_process_time_range) >= 60 * AUTOUPDATE_FAILURE_MINUTES:
+            logger.error(AutoupdateFailureException("[%s] No new data has been found via the API for over %d minutes. " % (state.account.name, AUTOUPDATE_FAILURE_MINUTES) +
+                         "tconnectsync might not be functioning properly."))
+
+    def _run_account(self, state):
+        try:
+            sleep_secs = self.poll_account(state)
+            state.failures = 0
+        except Exception:
+            state.failures += 1
+            logger.exception('[%s] Error synchronizing account (%d consecutive failures), retrying in %d sec' % (state.account.name, state.failures, RETRY_SECONDS))
+            sleep_secs = RETRY_SECONDS
+        finally:
+            self._slots.release()
+
+        logger.info('[%s] Next poll in %d sec' % (state.account.name, sleep_secs))
+        self._schedule(state, self._clock() + sleep_secs)
+
+    """
+    Runs the service until stop() is called. All accounts are first
+    polled immediately, in the order given.
+    """
+    def run(self):
+        logger.info('Starting sync service for %d accounts with %d workers' % (len(self.states), self.max_workers))
+        now = self._clock()
+        for i, state in enumerate(self.states):
+            # Keeps the initial order, since ties are broken by id()
+            self._schedule(state, now + i * 1e-6)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                self._slots.acquire()
+                state = self._next_due()
+                if state is None:
+                    self._slots.release()
+                    break
+                executor.submit(self._run_account, state)
+
+        logger.info('Sync service stopped')
+
+"""
+Creates a SyncService for the given accounts. Nightscout sessions are
+shared between accounts on the same host, and at most pool_size
+connections are kept open to each host. If requests_per_minute is set,
+every request the accounts' API clients make is rate limited per host.
+"""
+def create_service(accounts, time_start, time_end, pretend, max_workers=SERVICE_MAX_WORKERS,
+                   requests_per_minute=SERVICE_REQUESTS_PER_MINUTE, pool_size=None,
+                   batch_size=NightscoutApi.DEFAULT_BATCH_SIZE, cache=None, token_store=None):
+    if pool_size is None:
+        pool_size = max_workers
+
+    limiter = None
+    if requests_per_minute:
+        limiter = HostRateLimiter(requests_per_minute / 60, capacity=max_workers)
+
+    sessions = {}
+    states = []
+    for account in accounts:
+        host = HostRateLimiter.host(account.ns_url)
+        if host not in sessions:
+            sessions[host] = NightscoutApi.new_session(pool_size, limiter)
+
+        tconnect = TConnectApi(account.email, account.password, cache=cache, token_store=token_store, limiter=limiter)
+        nightscout = NightscoutApi(account.ns_url, account.ns_secret, pool_size=pool_size, batch_size=batch_size, session=sessions[host], limiter=limiter)
+        states.append(AccountState(account, tconnect, nightscout))
+
+    return SyncService(states, time_start, time_end, pretend, max_workers=max_workers)
@@ -1,11 +1,15 @@
 import arrow
 import logging
+import collections
 
 from ..parser.nightscout import (
     BASAL_EVENTTYPE,
-    NightscoutEntry
+    NightscoutEntry,
+    entry_id
 )
 from ..parser.tconnect import TConnectEntry
+from .. import tracing
+from .window import ns_sync_treatments
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +24,7 @@ def process_ciq_basal_events(data):
     suspensionEvents = {}
     for s in data["suspensionDeliveryEvents"]:
         entry = TConnectEntry.parse_suspension_entry(s)
-        suspensionEvents[entry["time"]] = entry
+        suspensionEvents[entry.time] = entry
 
     basalEvents = []
     for b in data["basal"]["tempDeliveryEvents"]:
@@ -32,71 +36,107 @@ def process_ciq_basal_events(data):
     for b in data["basal"]["profileDeliveryEvents"]:
         basalEvents.append(TConnectEntry.parse_ciq_basal_entry(b, delivery_type="profileDelivery"))
 
-    basalEvents.sort(key=lambda x: arrow.get(x["time"]))
+    basalEvents.sort(key=lambda x: x.epoch)
 
     for i in basalEvents:
-        if i["time"] in suspensionEvents:
-            i["suspendReason"] = suspensionEvents[i["time"]]["suspendReason"]
+        if i.time in suspensionEvents:
+            i.suspend_reason = suspensionEvents[i.time].suspend_reason
 
     return basalEvents
 
 """
 Processes basal data input from the therapy timeline CSV (which only
 exists for pre Control-IQ data) into a digestable format.
+If last_row is given, it is the CSV row immediately preceding data, and
+is only used to compute the duration of the first row.
 """
-def add_csv_basal_events(basalEvents, data):
-    last_entry = {}
+def add_csv_basal_events(basalEvents, data, last_row=None):
+    last_entry = TConnectEntry.parse_csv_basal_entry(last_row) if last_row else None
     for row in data:
         entry = TConnectEntry.parse_csv_basal_entry(row)
         if last_entry:
-            diff_mins = (arrow.get(entry["time"]) - arrow.get(last_entry["time"])).seconds // 60
-            entry["duration_mins"] = diff_mins
+            # Equivalent to timedelta.seconds // 60, which ignores whole days
+            diff_mins = ((entry.epoch - last_entry.epoch) % 86400) // 60
+            entry.duration_mins = diff_mins
 
         basalEvents.append(entry)
         last_entry = entry
 
-    basalEvents.sort(key=lambda x: arrow.get(x["time"]))
+    basalEvents.sort(key=lambda x: x.epoch)
     return basalEvents
 
+"""
+Returns a deterministic _id for each processed basal event. Basal events
+carry no event ID, so events at the same time are told apart by their
+delivery type and by their order among events with the same time and
+delivery type.
+"""
+def basal_entry_ids(basalEvents):
+    seen = collections.Counter()
+    ids = []
+    for event in basalEvents:
+        key = (event.epoch, str(event.delivery_type))
+        ids.append(entry_id(BASAL_EVENTTYPE, event.epoch, "%s#%d" % (key[1], seen[key])))
+        seen[key] += 1
+    return ids
+
+"""
+Converts a processed basal event into a Nightscout entry with the given
+_id, if any.
+"""
+def basal_entry(event, _id=None):
+    reason = event.delivery_type
+    if "suspendReason" in reason:
+        reason += " (" + reason["suspendReason"] + ")"
+
+    return NightscoutEntry.basal(
+        value=event.basal_rate,
+        duration_mins=event.duration_mins,
+        created_at=event.time,
+        reason=reason,
+        _id=_id
+    )
+
 """
 Given processed basal data, adds basal events to Nightscout.
+If deterministic_ids is true, entries are upserted by a deterministic _id,
+so re-sending them never creates duplicates, and the last uploaded entry
+is not queried: every event is sent.
 """
-def ns_write_basal_events(nightscout, basalEvents, pretend=False):
-    logger.debug("ns_write_basal_events: querying for last uploaded entry")
-    last_upload = nightscout.last_uploaded_entry(BASAL_EVENTTYPE)
+@tracing.traced()
+def ns_write_basal_events(nightscout, basalEvents, pretend=False, deterministic_ids=False):
+    last_upload = None
+    if not deterministic_ids:
+        logger.debug("ns_write_basal_events: querying for last uploaded entry")
+        last_upload = nightscout.last_uploaded_entry(BASAL_EVENTTYPE)
     last_upload_time = None
+    last_upload_epoch = None
     if last_upload:
         last_upload_time = arrow.get(last_upload["created_at"])
+        last_upload_epoch = last_upload_time.int_timestamp
     logger.info("Last Nightscout basal upload: %s" % last_upload_time)
 
+    ids = basal_entry_ids(basalEvents) if deterministic_ids else [None] * len(basalEvents)
     add_count = 0
-    for event in basalEvents:
-        if last_upload_time and arrow.get(event["time"]) < last_upload_time:
+    entries = []
+    for event, _id in zip(basalEvents, ids):
+        if last_upload_epoch is not None and event.epoch < last_upload_epoch:
             if pretend:
                 logger.info("Skipping basal event before last upload time: %s" % event)
             continue
 
         recent_needs_update = False
-        if last_upload_time and arrow.get(event["time"]) == last_upload_time:
+        if last_upload_epoch is not None and event.epoch == last_upload_epoch:
             # If this entry has the same time as the most recent upload, but
             # has newer info, then delete and recreate it.
-            recent_needs_update = (round(last_upload["duration"]) < round(event["duration_mins"]))
+            recent_needs_update = (round(last_upload["duration"]) < round(event.duration_mins))
 
             # If the timestamps are identical, and the duration is identical, 
             # then don't upload a duplicate entry of what we already have.
             if not recent_needs_update:
                 continue
 
-        reason = event["delivery_type"]
-        if "suspendReason" in reason:
-            reason += " (" + reason["suspendReason"] + ")"
-
-        entry = NightscoutEntry.basal(
-            value=event["basal_rate"],
-            duration_mins=event["duration_mins"],
-            created_at=event["time"],
-            reason=reason
-        )
+        entry = basal_entry(event, _id)
 
         add_count += 1
 
@@ -106,8 +146,28 @@ def ns_write_basal_events(nightscout, basalEvents, pretend=False):
             if not pretend:
                 entry['_id'] = last_upload['_id']
                 nightscout.put_entry(entry, entity='treatments')
-        elif not pretend:
-            nightscout.upload_entry(entry)
+        else:
+            entries.append(entry)
+
+    if entries and not pretend:
+        if deterministic_ids:
+            nightscout.upsert_entries(entries, entity='treatments')
+        else:
+            nightscout.upload_entries(entries, entity='treatments')
 
     logger.debug("ns_write_basal_events: added %d events" % add_count)
     return add_count
+
+"""
+Given processed basal data, adds basal events to Nightscout which are
+missing from, or differ from, the basal treatments already uploaded
+within the same time window.
+"""
+@tracing.traced()
+def ns_sync_basal_events(nightscout, basalEvents, pretend=False, deterministic_ids=False):
+    ids = basal_entry_ids(basalEvents) if deterministic_ids else [None] * len(basalEvents)
+    entries = [(event.epoch, basal_entry(event, _id)) for event, _id in zip(basalEvents, ids)]
+    add_count = ns_sync_treatments(nightscout, BASAL_EVENTTYPE, entries, pretend=pretend, upsert=deterministic_ids)
+
+    logger.debug("ns_sync_basal_events: wrote %d events" % add_count)
+    return add_count
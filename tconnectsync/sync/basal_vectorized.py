@@ -0,0 +1,199 @@
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ..parser.records import BasalEvent
+from ..parser.tconnect import TConnectEntry
+from ..parser.tz import _BUCKET_SECONDS
+
+logger = logging.getLogger(__name__)
+
+"""
+A vectorized implementation of the basal processing in sync/basal.py.
+Timestamps are converted, sorted, joined with suspensions and turned into
+durations as numpy arrays, and BasalEvent objects are only created once
+every column has been computed. Its output is equivalent to
+process_ciq_basal_events and add_csv_basal_events.
+
+numpy is an optional dependency: available() returns False if it is not
+installed.
+"""
+
+DELIVERY_TYPES = (
+    ("tempDeliveryEvents", "tempDelivery"),
+    ("algorithmDeliveryEvents", "algorithmDelivery"),
+    ("profileDeliveryEvents", "profileDelivery"),
+)
+
+def available():
+    return numpy is not None
+
+"""
+Calls lookup once for each distinct value in keys. Returns the list of
+results and, for each key, the index of its result in that list. UTC
+offsets only change on quarter hour boundaries, so there are far fewer
+distinct keys than timestamps.
+"""
+def _lookup_unique(keys, lookup):
+    unique, inverse = numpy.unique(keys, return_inverse=True)
+    values = [lookup(int(key)) for key in unique.tolist()]
+    return values, inverse
+
+"""
+Converts an array of wall clock seconds in the converter's timezone, with
+the given fold for each, into (formatted times, UTC epochs) arrays.
+"""
+def _localize(converter, wall_seconds, folds):
+    keys = (wall_seconds // _BUCKET_SECONDS) * 2 + folds
+    values, inverse = _lookup_unique(keys, lambda key: converter._local_offset(
+        (key // 2) * _BUCKET_SECONDS, key % 2))
+
+    offsets = numpy.array([offset for offset, _ in values], dtype=numpy.int64)[inverse]
+    offset_strs = numpy.array([offset_str for _, offset_str in values], dtype=object)[inverse]
+
+    # "YYYY-MM-DDTHH:MM:SS", the same as TimezoneConverter._format_wall
+    walls = numpy.datetime_as_string(wall_seconds.astype('datetime64[s]'), unit='s')
+    times = numpy.char.replace(walls, 'T', ' ').astype(object) + offset_strs
+    return times, wall_seconds - offsets
+
+"""
+Equivalent to TimezoneConverter.convert_epoch for each value of xs.
+"""
+def _convert_epochs(converter, xs):
+    xs = numpy.array(xs, dtype=numpy.int64)
+    values, inverse = _lookup_unique(xs // _BUCKET_SECONDS,
+        lambda bucket: converter._source_offset(bucket * _BUCKET_SECONDS))
+
+    source_offsets = numpy.array([offset for offset, _ in values], dtype=numpy.int64)[inverse]
+    folds = numpy.array([fold for _, fold in values], dtype=numpy.int64)[inverse]
+    return _localize(converter, xs + source_offsets, folds)
+
+"""
+Equivalent to TimezoneConverter.convert_datetime for each date string.
+Returns None if any of them is not in the "YYYY-MM-DDTHH:MM:SS" format.
+"""
+def _convert_datetimes(converter, dates):
+    if not all(len(date) == 19 and date[10] == 'T' for date in dates):
+        return None
+    try:
+        wall_seconds = numpy.array(dates, dtype='datetime64[s]').astype(numpy.int64)
+    except ValueError:
+        return None
+    return _localize(converter, wall_seconds, numpy.zeros(len(dates), dtype=numpy.int64))
+
+"""
+For each value in epochs, returns the index in targets of the nearest
+target within tolerance seconds, or -1 if there is none. targets must be
+sorted. Ties are broken in favour of the earlier target.
+"""
+def nearest_within(epochs, targets, tolerance=0):
+    if len(targets) == 0:
+        return numpy.full(len(epochs), -1, dtype=numpy.int64)
+
+    right = numpy.searchsorted(targets, epochs, side='left')
+    left = numpy.clip(right - 1, 0, len(targets) - 1)
+    right = numpy.clip(right, 0, len(targets) - 1)
+
+    left_dist = numpy.abs(epochs - targets[left])
+    right_dist = numpy.abs(targets[right] - epochs)
+    nearest = numpy.where(left_dist <= right_dist, left, right)
+    dist = numpy.minimum(left_dist, right_dist)
+
+    return numpy.where(dist <= tolerance, nearest, -1)
+
+"""
+Merges together input from the therapy timeline API into a digestable
+format of basal data. The three delivery event lists are merged by epoch,
+and each event is given the suspendReason of the suspension at the same
+time. If suspension_tolerance is given, the nearest suspension within that
+many seconds is used instead.
+"""
+def process_ciq_basal_events(data, suspension_tolerance=0):
+    if data is None:
+        return []
+
+    converter = TConnectEntry._tz()
+
+    events = []
+    delivery_types = []
+    for key, delivery_type in DELIVERY_TYPES:
+        events += data["basal"][key]
+        delivery_types.append(numpy.full(len(data["basal"][key]), delivery_type, dtype=object))
+
+    if not events:
+        return []
+
+    times, epochs = _convert_epochs(converter, [e["x"] for e in events])
+    # A stable sort, so that events at the same time keep the order in
+    # which the delivery event lists are concatenated.
+    order = numpy.argsort(epochs, kind='stable')
+
+    suspensions = data["suspensionDeliveryEvents"]
+    _, suspension_epochs = _convert_epochs(converter, [s["x"] for s in suspensions])
+    suspend_reasons = numpy.array([s["suspendReason"] for s in suspensions] + [None], dtype=object)
+
+    # When two suspensions share a time, the later one in the list is used.
+    reversed_epochs = suspension_epochs[::-1]
+    unique_epochs, first_reversed = numpy.unique(reversed_epochs, return_index=True)
+    unique_suspensions = len(suspensions) - 1 - first_reversed
+
+    matches = nearest_within(epochs[order], unique_epochs, suspension_tolerance)
+    # Unmatched events index the trailing None in suspend_reasons
+    suspension_index = numpy.full(len(matches), -1, dtype=numpy.int64)
+    matched = matches >= 0
+    suspension_index[matched] = unique_suspensions[matches[matched]]
+
+    durations = numpy.fromiter((e["duration"] for e in events), dtype=numpy.float64, count=len(events))
+    basal_rates = numpy.array([e["y"] for e in events], dtype=object)
+
+    columns = zip(
+        times[order].tolist(),
+        epochs[order].tolist(),
+        numpy.concatenate(delivery_types)[order].tolist(),
+        (durations[order] / 60).tolist(),
+        basal_rates[order].tolist(),
+        suspend_reasons[suspension_index].tolist())
+    return [BasalEvent(*column) for column in columns]
+
+"""
+Processes basal data input from the therapy timeline CSV into a digestable
+format, computing each row's duration from the difference between
+consecutive rows. If last_row is given, it is the CSV row immediately
+preceding data, and is only used to compute the duration of the first row.
+"""
+def add_csv_basal_events(basalEvents, data, last_row=None):
+    rows = ([last_row] if last_row else []) + list(data)
+    if not rows:
+        return basalEvents
+
+    converted = _convert_datetimes(TConnectEntry._tz(), [row["EventDateTime"] for row in rows])
+    if converted is None:
+        # Timestamps in another format are parsed one at a time
+        entries = [TConnectEntry.parse_csv_basal_entry(row) for row in rows]
+        times = numpy.array([e.time for e in entries], dtype=object)
+        epochs = numpy.fromiter((e.epoch for e in entries), dtype=numpy.int64, count=len(entries))
+    else:
+        times, epochs = converted
+
+    # Equivalent to timedelta.seconds // 60, which ignores whole days
+    durations = numpy.concatenate(([None], (numpy.diff(epochs) % 86400) // 60)).astype(object)
+    basal_rates = [row["BasalRate"] for row in rows]
+
+    first = 1 if last_row else 0
+    columns = zip(
+        times[first:].tolist(),
+        epochs[first:].tolist(),
+        durations[first:].tolist(),
+        basal_rates[first:])
+    basalEvents.extend(BasalEvent(
+        time=time,
+        epoch=epoch,
+        delivery_type="Unknown",
+        duration_mins=duration,
+        basal_rate=basal_rate,
+    ) for time, epoch, duration, basal_rate in columns)
+    basalEvents.sort(key=lambda x: x.epoch)
+    return basalEvents
@@ -3,9 +3,12 @@ import logging
 
 from ..parser.nightscout import (
     BOLUS_EVENTTYPE,
-    NightscoutEntry
+    NightscoutEntry,
+    entry_id
 )
 from ..parser.tconnect import TConnectEntry
+from .. import tracing
+from .window import ns_sync_treatments
 
 logger = logging.getLogger(__name__)
 
@@ -17,49 +20,80 @@ def process_bolus_events(bolusdata):
 
     for b in bolusdata:
         parsed = TConnectEntry.parse_bolus_entry(b)
-        if parsed["completion"] != "Completed":
-            if parsed["insulin"] and float(parsed["insulin"]) > 0:
+        if parsed.completion != "Completed":
+            if parsed.insulin and float(parsed.insulin) > 0:
                 # Count non-completed bolus if any insulin was delivered (vs. the amount of insulin requested)
-                parsed["description"] += " (%s)" % parsed["completion"]
+                parsed.description += " (%s)" % parsed.completion
             else:
                 logger.warning("Skipping non-completed bolus data (was a bolus in progress?): %s parsed: %s" % (b, parsed))
                 continue
         bolusEvents.append(parsed)
 
-    bolusEvents.sort(key=lambda event: arrow.get(event["completion_time"] if not event["extended_bolus"] else event["bolex_start_time"]))
+    bolusEvents.sort(key=lambda event: event.epoch)
 
     return bolusEvents
 
+"""
+Converts a processed bolus event into a Nightscout entry. If
+deterministic_ids is true, the entry's _id is derived from the event.
+"""
+def bolus_entry(event, deterministic_ids=False):
+    return NightscoutEntry.bolus(
+        bolus=event.insulin,
+        carbs=event.carbs,
+        created_at=event.time,
+        notes="{}{}{}".format(event.description, " (Override)" if event.user_override == "1" else "", " (Extended)" if event.extended_bolus == "1" else ""),
+        _id=entry_id(BOLUS_EVENTTYPE, event.epoch, event.request_id) if deterministic_ids else None
+    )
+
 """
 Given processed bolus data, adds bolus events to Nightscout.
+If deterministic_ids is true, entries are upserted by a deterministic _id,
+so re-sending them never creates duplicates, and the last uploaded entry
+is not queried: every event is sent.
 """
-def ns_write_bolus_events(nightscout, bolusEvents, pretend=False):
-    logger.debug("ns_write_bolus_events: querying for last uploaded entry")
-    last_upload = nightscout.last_uploaded_entry(BOLUS_EVENTTYPE)
+@tracing.traced()
+def ns_write_bolus_events(nightscout, bolusEvents, pretend=False, deterministic_ids=False):
+    last_upload = None
+    if not deterministic_ids:
+        logger.debug("ns_write_bolus_events: querying for last uploaded entry")
+        last_upload = nightscout.last_uploaded_entry(BOLUS_EVENTTYPE)
     last_upload_time = None
+    last_upload_epoch = None
     if last_upload:
         last_upload_time = arrow.get(last_upload["created_at"])
+        last_upload_epoch = last_upload_time.int_timestamp
     logger.info("Last Nightscout bolus upload: %s" % last_upload_time)
 
     add_count = 0
+    entries = []
     for event in bolusEvents:
-        created_at = event["completion_time"] if not event["extended_bolus"] else event["bolex_start_time"]
-        if last_upload_time and arrow.get(created_at) <= last_upload_time:
+        if last_upload_epoch is not None and event.epoch <= last_upload_epoch:
             if pretend:
                 logger.info("Skipping basal event before last upload time: %s" % event)
             continue
 
-        entry = NightscoutEntry.bolus(
-            bolus=event["insulin"],
-            carbs=event["carbs"],
-            created_at=created_at,
-            notes="{}{}{}".format(event["description"], " (Override)" if event["user_override"] == "1" else "", " (Extended)" if event["extended_bolus"] == "1" else "")
-        )
+        entry = bolus_entry(event, deterministic_ids)
 
         add_count += 1
 
         logger.info("  Processing bolus: %s entry: %s" % (event, entry))
-        if not pretend:
-            nightscout.upload_entry(entry)
+        entries.append(entry)
+
+    if entries and not pretend:
+        if deterministic_ids:
+            nightscout.upsert_entries(entries, entity='treatments')
+        else:
+            nightscout.upload_entries(entries, entity='treatments')
 
     return add_count
+
+"""
+Given processed bolus data, adds bolus events to Nightscout which are
+missing from, or differ from, the bolus treatments already uploaded
+within the same time window.
+"""
+@tracing.traced()
+def ns_sync_bolus_events(nightscout, bolusEvents, pretend=False, deterministic_ids=False):
+    entries = [(event.epoch, bolus_entry(event, deterministic_ids)) for event in bolusEvents]
+    return ns_sync_treatments(nightscout, BOLUS_EVENTTYPE, entries, pretend=pretend, upsert=deterministic_ids)
@@ -6,6 +6,7 @@ from ..parser.nightscout import (
     NightscoutEntry
 )
 from ..parser.tconnect import TConnectEntry
+from .. import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -17,19 +18,22 @@ def process_iob_events(iobdata):
     for d in iobdata:
         iobEvents.append(TConnectEntry.parse_iob_entry(d))
 
-    iobEvents.sort(key=lambda x: arrow.get(x["time"]))
+    iobEvents.sort(key=lambda x: x.epoch)
 
     return iobEvents
 
 """
 Given processed IOB data, creates a single Nightscout activity definition to store IOB.
 """
+@tracing.traced()
 def ns_write_iob_events(nightscout, iobEvents, pretend=False):
     logger.debug("ns_write_iob_events: querying for last uploaded entry")
     last_upload = nightscout.last_uploaded_activity(IOB_ACTIVITYTYPE)
     last_upload_time = None
+    last_upload_epoch = None
     if last_upload:
         last_upload_time = arrow.get(last_upload["created_at"])
+        last_upload_epoch = last_upload_time.int_timestamp
     logger.info("Last Nightscout iob upload: %s" % last_upload_time)
 
     if not iobEvents or len(iobEvents) == 0:
@@ -37,13 +41,13 @@ def ns_write_iob_events(nightscout, iobEvents, pretend=False):
         return 0
 
     event = iobEvents[-1]
-    if last_upload_time and arrow.get(event["time"]) <= last_upload_time:
+    if last_upload_epoch is not None and event.epoch <= last_upload_epoch:
         logger.info("  Skipping already uploaded iob event: %s" % event)
         return 0
 
     entry = NightscoutEntry.iob(
-        iob=event["iob"],
-        created_at=event["time"]
+        iob=event.iob,
+        created_at=event.time
     )
 
     logger.info("  Processing iob: %s entry: %s" % (event, entry))
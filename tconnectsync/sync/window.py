@@ -0,0 +1,102 @@
+import arrow
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Window-based deduplication of treatments. Rather than comparing events
+against the single most recent treatment in Nightscout, all treatments
+which tconnectsync previously uploaded within the synced window are
+fetched at once and indexed by (eventType, created_at epoch). Only
+entries which are missing from Nightscout, or differ from the existing
+treatment at the same time, are then written. Several treatments can
+share a time, such as basal events with different delivery types, so
+each entry is matched by its content to one of them.
+"""
+
+def _treatment_key(treatment):
+    try:
+        return (treatment.get("eventType"), arrow.get(treatment.get("created_at")).int_timestamp)
+    except (TypeError, ValueError):
+        return None
+
+"""
+Returns a dict of (eventType, epoch) to a list of the existing treatments
+at that time, for all treatments of eventType uploaded by tconnectsync
+between the given epochs.
+"""
+def fetch_treatment_index(nightscout, eventType, start_epoch, end_epoch):
+    index = {}
+    for treatment in nightscout.treatments_in_range(eventType, start_epoch, end_epoch):
+        key = _treatment_key(treatment)
+        if key is not None:
+            index.setdefault(key, []).append(treatment)
+    return index
+
+def _values_differ(new, existing):
+    if isinstance(new, (int, float)) and isinstance(existing, (int, float)):
+        return abs(new - existing) > 1e-6
+    return new != existing
+
+"""
+Returns whether any field of entry, other than its timestamp, differs
+from the existing treatment.
+"""
+def entry_changed(entry, existing):
+    for field, value in entry.items():
+        if field in ("created_at", "_id"):
+            continue
+        if _values_differ(value, existing.get(field)):
+            return True
+    return False
+
+"""
+Given a list of (epoch, entry) tuples of Nightscout entries with the given
+eventType, uploads the entries which do not yet exist in Nightscout and
+replaces those which have changed. Returns the number of entries written.
+If upsert is true, new entries carry deterministic _ids and are upserted.
+"""
+def ns_sync_treatments(nightscout, eventType, entries, pretend=False, upsert=False):
+    if not entries:
+        return 0
+
+    epochs = [epoch for epoch, _ in entries]
+    index = fetch_treatment_index(nightscout, eventType, min(epochs), max(epochs))
+    logger.info("Found %d existing %s treatments in the synced window" % (sum(len(t) for t in index.values()), eventType))
+
+    # Entries which are identical to an existing treatment are matched
+    # first, so that a changed entry is never paired with the treatment of
+    # another, unchanged entry at the same time
+    unmatched = []
+    for epoch, entry in entries:
+        existing = index.get((eventType, epoch), [])
+        same = next((t for t in existing if not entry_changed(entry, t)), None)
+        if same is None:
+            unmatched.append((epoch, entry))
+        else:
+            existing.remove(same)
+
+    new_entries = []
+    changed_entries = []
+    for epoch, entry in unmatched:
+        existing = index.get((eventType, epoch))
+        if not existing:
+            new_entries.append(entry)
+            continue
+
+        # Prefer the treatment with the entry's deterministic _id, if any
+        replaced = next((t for t in existing if entry.get("_id") and t.get("_id") == entry["_id"]), existing[0])
+        existing.remove(replaced)
+        logger.info("Replacing changed entry: %s with: %s" % (replaced, entry))
+        changed_entries.append({**entry, "_id": replaced["_id"]})
+
+    logger.info("Writing %d new and %d changed %s treatments" % (len(new_entries), len(changed_entries), eventType))
+    if not pretend:
+        if new_entries and upsert:
+            nightscout.upsert_entries(new_entries, entity='treatments')
+        elif new_entries:
+            nightscout.upload_entries(new_entries, entity='treatments')
+        for entry in changed_entries:
+            nightscout.put_entry(entry, entity='treatments')
+
+    return len(new_entries) + len(changed_entries)
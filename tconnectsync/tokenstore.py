@@ -0,0 +1,121 @@
+import os
+import json
+import uuid
+import base64
+import hashlib
+import logging
+import threading
+
+import arrow
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = ValueError
+
+logger = logging.getLogger(__name__)
+
+"""
+A local store of t:connect login tokens, so that short-lived runs can
+reuse a previous login instead of logging in again.
+
+Tokens are encrypted at rest with Fernet, using a key derived from a
+passphrase with PBKDF2. The file holds the random salt and a single
+encrypted JSON object, keyed by API name and account email. The optional
+cryptography package is required: if it is not installed, tokens are
+never stored.
+"""
+class TokenStore:
+    PBKDF2_ITERATIONS = 200000
+
+    # Stored tokens are not used if they expire within this many seconds
+    MIN_VALIDITY_SECONDS = 5 * 60
+
+    def __init__(self, path, passphrase):
+        self.path = path
+        self._passphrase = passphrase.encode()
+        self._fernet = None
+        self._salt = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return Fernet is not None
+
+    def _key(self, salt):
+        if self._fernet is None or self._salt != salt:
+            derived = hashlib.pbkdf2_hmac('sha256', self._passphrase, salt, self.PBKDF2_ITERATIONS)
+            self._fernet = Fernet(base64.urlsafe_b64encode(derived))
+            self._salt = salt
+        return self._fernet
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                contents = json.load(f)
+            salt = base64.b64decode(contents["salt"])
+            return salt, json.loads(self._key(salt).decrypt(contents["data"].encode()))
+        except FileNotFoundError:
+            return None, {}
+        except (ValueError, KeyError, InvalidToken):
+            logger.warning("Ignoring unreadable token store: %s" % self.path)
+            return None, {}
+
+    def _write(self, salt, tokens):
+        if salt is None:
+            salt = os.urandom(16)
+        data = self._key(salt).encrypt(json.dumps(tokens).encode()).decode()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = '%s.%s.tmp' % (self.path, uuid.uuid4().hex)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"salt": base64.b64encode(salt).decode(), "data": data}, f)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _name(api, email):
+        return '%s:%s' % (api, email)
+
+    """
+    Returns the tokens saved for the given API and account, or None if
+    there are none which remain valid for at least MIN_VALIDITY_SECONDS.
+    The expiration time is read from the expires_key field.
+    """
+    def load(self, api, email, expires_key='accessTokenExpiresAt'):
+        if not self.available():
+            return None
+
+        with self._lock:
+            _, tokens = self._read()
+
+        entry = tokens.get(self._name(api, email))
+        if not entry or not entry.get(expires_key):
+            return None
+
+        remaining = (arrow.get(entry[expires_key]) - arrow.get()).total_seconds()
+        if remaining <= self.MIN_VALIDITY_SECONDS:
+            logger.debug("Stored %s tokens have expired" % api)
+            return None
+        return entry
+
+    def save(self, api, email, entry):
+        if not self.available():
+            logger.warning("Not saving %s tokens: the cryptography package is not installed" % api)
+            return
+
+        with self._lock:
+            salt, tokens = self._read()
+            tokens[self._name(api, email)] = entry
+            self._write(salt, tokens)
+
+    def clear(self, api, email):
+        if not self.available():
+            return
+
+        with self._lock:
+            salt, tokens = self._read()
+            if tokens.pop(self._name(api, email), None) is not None:
+                self._write(salt, tokens)
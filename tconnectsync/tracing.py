@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import logging
+import functools
+import contextlib
+import itertools
+import threading
+
+from .metrics import endpoint_label
+
+logger = logging.getLogger(__name__)
+
+"""
+Lightweight timing spans for finding where a sync cycle spends its time:
+logging in, downloading from ControlIQ or WS2, parsing and processing,
+or uploading to Nightscout.
+
+Spans nest within the thread which opens them. Work handed to another
+thread can be attributed to a span by passing it as the parent. Finished
+spans are passed to the configured exporter; when none is configured,
+which is the default, opening a span does nothing.
+"""
+
+_ids = itertools.count(1)
+_local = threading.local()
+_exporter = None
+
+class Span:
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end', 'thread_id', 'attrs')
+
+    def __init__(self, name, parent_id=None, start=None, attrs=None):
+        self.name = name
+        self.span_id = next(_ids)
+        self.parent_id = parent_id
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.thread_id = threading.get_ident()
+        self.attrs = attrs or {}
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'thread_id': self.thread_id,
+            'attrs': self.attrs,
+        }
+
+    def __repr__(self):
+        return 'Span(%s, %.3fs)' % (self.name, self.duration)
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+"""
+Sets the exporter which receives finished spans, or disables tracing if
+exporter is None. Returns the previous exporter.
+"""
+def configure(exporter):
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+def enabled():
+    return _exporter is not None
+
+"""
+Returns the innermost span open on the current thread, or None.
+"""
+def current_span():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+def _export(s):
+    exporter = _exporter
+    if exporter is not None:
+        try:
+            exporter.export(s)
+        except Exception:
+            logger.exception("Unable to export tracing span %s" % s.name)
+
+"""
+Context manager which times its block as a span. By default, the span's
+parent is the innermost span open on the current thread; parent can be
+given to attribute work on another thread to a span.
+"""
+@contextlib.contextmanager
+def span(name, parent=None, **attrs):
+    if _exporter is None:
+        yield None
+        return
+
+    parent = parent or current_span()
+    s = Span(name, parent.span_id if parent else None, attrs=attrs)
+    stack = _stack()
+    stack.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        s.end = time.time()
+        if stack and stack[-1] is s:
+            stack.pop()
+        _export(s)
+
+"""
+Decorator which records each call of a function as a span, named after
+the function unless a name is given.
+"""
+def traced(name=None):
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return fn(*args, **kwargs)
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+"""
+Wraps fn so that spans it opens are children of the span open on the
+current thread, even if fn is called on another thread, such as by a
+thread pool.
+"""
+def propagate(fn):
+    parent = current_span()
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stack = _stack()
+        stack.append(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stack.remove(parent)
+    return wrapper
+
+"""
+Records a span which has already finished, such as an HTTP request timed
+by requests, as a child of the innermost open span.
+"""
+def record_span(name, start, end, **attrs):
+    if _exporter is None:
+        return
+    parent = current_span()
+    s = Span(name, parent.span_id if parent else None, start=start, attrs=attrs)
+    s.end = end
+    _export(s)
+
+"""
+Returns a requests response hook which records each response from the
+given API as a span. Only the time until the response headers were
+received is included.
+"""
+def response_hook(api):
+    def hook(r, *args, **kwargs):
+        if _exporter is None or r.elapsed is None:
+            return
+
+        end = time.time()
+        method = r.request.method if r.request is not None else ''
+        endpoint = endpoint_label(r.url)
+        record_span('%s %s %s' % (api, method, endpoint), end - r.elapsed.total_seconds(), end,
+                    api=api, method=method, endpoint=endpoint, status=r.status_code)
+    return hook
+
+"""
+Keeps finished spans in memory.
+"""
+class MemoryExporter:
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, s):
+        with self._lock:
+            self.spans.append(s)
+
+    def close(self):
+        pass
+
+class _FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'w')
+        self._start()
+
+    def _start(self):
+        pass
+
+    def _line(self, s):
+        raise NotImplementedError
+
+    def export(self, s):
+        line = self._line(s)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+"""
+Writes each finished span to a file as a line of JSON.
+"""
+class JsonLinesExporter(_FileExporter):
+    def _line(self, s):
+        return json.dumps(s.to_dict(), default=str)
+
+"""
+Writes finished spans to a file in the Chrome trace event format, which
+can be opened with chrome://tracing or https://ui.perfetto.dev. Events are
+written as they finish, so the JSON array is left unterminated, which the
+format allows; a trace which is still being written can be opened too.
+"""
+class ChromeTraceExporter(_FileExporter):
+    def _start(self):
+        self._file.write('[\n')
+
+    def _line(self, s):
+        args = dict(s.attrs, id=s.span_id)
+        if s.parent_id is not None:
+            args['parent_id'] = s.parent_id
+        return json.dumps({
+            'name': s.name,
+            'ph': 'X',
+            'ts': int(s.start * 1e6),
+            'dur': int(s.duration * 1e6),
+            'pid': os.getpid(),
+            'tid': s.thread_id,
+            'args': args,
+        }, default=str) + ','
+
+EXPORTERS = {
+    'jsonl': JsonLinesExporter,
+    'chrome': ChromeTraceExporter,
+}
+
+"""
+Creates an exporter writing to path in the given format, 'jsonl' or
+'chrome'.
+"""
+def file_exporter(path, format='jsonl'):
+    if format not in EXPORTERS:
+        raise ValueError('Unknown trace format %s: must be one of %s' % (format, ', '.join(sorted(EXPORTERS))))
+    return EXPORTERS[format](path)
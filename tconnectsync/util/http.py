@@ -0,0 +1,29 @@
+import requests
+
+from requests.adapters import HTTPAdapter
+
+"""
+A transport adapter which waits for a HostRateLimiter before sending each
+request, so that requests beyond a host's rate are held back before they
+are sent, rather than after their response has arrived.
+"""
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, *args, **kwargs):
+        self.limiter.acquire(request.url)
+        return super().send(request, *args, **kwargs)
+
+"""
+Mounts a RateLimitedAdapter for limiter on the given session, or on a new
+one, and returns the session. Keyword arguments are passed to the adapter.
+"""
+def limited_session(limiter, session=None, **kwargs):
+    if session is None:
+        session = requests.Session()
+    adapter = RateLimitedAdapter(limiter, **kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -0,0 +1,92 @@
+import time
+import threading
+import urllib.parse
+
+"""
+A thread-safe token bucket rate limiter. Tokens are added continuously at
+`rate` tokens per second, up to a maximum of `capacity`, and acquire()
+blocks until the requested number of tokens is available.
+"""
+class TokenBucket:
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self._clock = clock
+        self._sleep = sleep
+
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    """
+    Blocks until `tokens` tokens can be taken from the bucket.
+    Returns the number of seconds spent waiting.
+    """
+    def acquire(self, tokens=1):
+        if tokens > self.capacity:
+            raise ValueError('cannot acquire %s tokens from a bucket of capacity %s' % (tokens, self.capacity))
+
+        waited = 0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+
+            self._sleep(wait)
+            waited += wait
+
+    """
+    Takes `tokens` tokens from the bucket if they are available
+    without waiting, and returns whether they were taken.
+    """
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+"""
+Rate limits requests separately for each host, with a TokenBucket of the
+same rate and capacity per host. Buckets are created on first use, and
+are shared by all callers making requests to the same host.
+"""
+class HostRateLimiter:
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host(url):
+        return urllib.parse.urlparse(url).netloc.lower()
+
+    def bucket(self, url):
+        host = self.host(url)
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.capacity, clock=self._clock, sleep=self._sleep)
+            return self._buckets[host]
+
+    """
+    Blocks until `tokens` requests can be made to the host of the given
+    URL. Returns the number of seconds spent waiting.
+    """
+    def acquire(self, url, tokens=1):
+        return self.bucket(url).acquire(tokens)
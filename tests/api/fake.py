@@ -1,4 +1,7 @@
 import tconnectsync.api
+import tconnectsync.api.android
+import tconnectsync.api.controliq
+import tconnectsync.api.ws2
 
 class ControlIQApi(tconnectsync.api.controliq.ControlIQApi):
     def __init__(self):
@@ -21,6 +24,9 @@ class WS2Api(tconnectsync.api.ws2.WS2Api):
     def get(self, endpoint, query):
         raise NotImplementedError
 
+    def get_lines(self, endpoint, query):
+        raise NotImplementedError
+
     def get_jsonp(self, endpoint):
         raise NotImplementedError
 
@@ -3,10 +3,18 @@
 import unittest
 import itertools
 import datetime
+import tempfile
+import urllib.parse
+import requests_mock
+import arrow
+
+from unittest import mock
 
 from .fake import AndroidApi
 
-from tconnectsync.api.common import ApiException
+from tconnectsync.api.android import AndroidApi as RealAndroidApi
+from tconnectsync.api.common import ApiException, ApiLoginException
+from tconnectsync.tokenstore import TokenStore
 
 class TestAndroidApi(unittest.TestCase):
     def fake_get_with_http_code(self, http_code, expected_endpoint, num_times):
@@ -86,5 +94,135 @@ class TestAndroidApi(unittest.TestCase):
             ('email', 'password')
         ])
 
+class TestAndroidApiTokenRenewal(unittest.TestCase):
+    TOKEN_URL = RealAndroidApi.BASE_URL + RealAndroidApi.OAUTH_TOKEN_PATH
+    LAST_EVENT_URL = RealAndroidApi.BASE_URL + 'cloud/upload/getlasteventuploaded?sn=1111111'
+
+    def token_response(self, suffix, expires_in_minutes=60, user=True):
+        j = {
+            "accessToken": "access_%s" % suffix,
+            "accessTokenExpiresAt": arrow.get().shift(minutes=expires_in_minutes).isoformat(),
+            "refreshToken": "refresh_%s" % suffix,
+            "refreshTokenExpiresAt": arrow.get().shift(days=14).isoformat(),
+        }
+        if user:
+            j["user"] = {"id": "user_id", "patientObjectId": "patient_id"}
+        return j
+
+    def mock_token_endpoint(self, m, responses):
+        grants = []
+        def callback(request, context):
+            body = urllib.parse.parse_qs(request.text)
+            grant = body["grant_type"][0]
+            grants.append((grant, body.get("refresh_token", [None])[0]))
+            status, j = responses[grant].pop(0)
+            context.status_code = status
+            return j
+
+        m.post(self.TOKEN_URL, json=callback)
+        return grants
+
+    def test_refreshes_before_access_token_expiry(self):
+        with requests_mock.Mocker() as m:
+            grants = self.mock_token_endpoint(m, {
+                "password": [(200, self.token_response(1, expires_in_minutes=2))],
+                "refresh_token": [(200, self.token_response(2, user=False))],
+            })
+            m.get(self.LAST_EVENT_URL, json={"maxPumpEventIndex": 1})
+
+            android = RealAndroidApi('email@email.com', 'password')
+            self.assertEqual(android.accessToken, 'access_1')
+
+            self.assertEqual(android.last_event_uploaded(1111111), {"maxPumpEventIndex": 1})
+            self.assertListEqual(grants, [("password", None), ("refresh_token", "refresh_1")])
+
+            self.assertEqual(android.accessToken, 'access_2')
+            self.assertEqual(android.refreshToken, 'refresh_2')
+            self.assertEqual(android.userId, 'user_id')
+            self.assertEqual(m.last_request.headers["Authorization"], "Bearer access_2")
+
+    def test_refreshes_after_http_401(self):
+        with requests_mock.Mocker() as m:
+            grants = self.mock_token_endpoint(m, {
+                "password": [(200, self.token_response(1))],
+                "refresh_token": [(200, self.token_response(2))],
+            })
+            m.get(self.LAST_EVENT_URL, [
+                {"status_code": 401, "text": "expired"},
+                {"status_code": 200, "json": {"maxPumpEventIndex": 1}},
+            ])
+
+            android = RealAndroidApi('email@email.com', 'password')
+            self.assertEqual(android.last_event_uploaded(1111111), {"maxPumpEventIndex": 1})
+
+            self.assertListEqual(grants, [("password", None), ("refresh_token", "refresh_1")])
+            self.assertEqual(m.last_request.headers["Authorization"], "Bearer access_2")
+
+    def test_logs_in_when_refresh_fails(self):
+        with requests_mock.Mocker() as m:
+            grants = self.mock_token_endpoint(m, {
+                "password": [(200, self.token_response(1, expires_in_minutes=2)), (200, self.token_response(3))],
+                "refresh_token": [(400, {"error": "invalid_grant"})],
+            })
+
+            android = RealAndroidApi('email@email.com', 'password')
+            android.ensure_token()
+
+            self.assertListEqual(grants, [("password", None), ("refresh_token", "refresh_1"), ("password", None)])
+            self.assertEqual(android.accessToken, 'access_3')
+
+    def test_refresh_without_refresh_token(self):
+        with requests_mock.Mocker() as m:
+            self.mock_token_endpoint(m, {
+                "password": [(200, self.token_response(1))],
+            })
+
+            android = RealAndroidApi('email@email.com', 'password')
+            android.refreshToken = None
+
+            with self.assertRaises(ApiLoginException) as cm:
+                android.refresh()
+            self.assertIsNone(cm.exception.status_code)
+            self.assertEqual(str(cm.exception), 'No refresh token present for AndroidApi')
+
+    def test_ensure_token_with_min_validity(self):
+        with requests_mock.Mocker() as m:
+            grants = self.mock_token_endpoint(m, {
+                "password": [(200, self.token_response(1, expires_in_minutes=10))],
+                "refresh_token": [(200, self.token_response(2))],
+            })
+
+            android = RealAndroidApi('email@email.com', 'password')
+            android.ensure_token()
+            self.assertEqual(len(grants), 1)
+
+            android.ensure_token(min_validity=15 * 60)
+            self.assertListEqual(grants, [("password", None), ("refresh_token", "refresh_1")])
+
+    @unittest.skipUnless(TokenStore.available(), "cryptography is not installed")
+    def test_uses_token_store(self):
+        with requests_mock.Mocker() as m, \
+                tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.object(TokenStore, 'PBKDF2_ITERATIONS', 1000):
+            grants = self.mock_token_endpoint(m, {
+                "password": [(200, self.token_response(1))],
+                "refresh_token": [(200, self.token_response(2, user=False))],
+            })
+            store = TokenStore(tmpdir + '/tokens.json', 'password')
+
+            RealAndroidApi('email@email.com', 'password', token_store=store)
+
+            android = RealAndroidApi('email@email.com', 'password', token_store=store)
+            self.assertListEqual(grants, [("password", None)])
+            self.assertEqual(android.accessToken, 'access_1')
+            self.assertEqual(android.patientObjectId, 'patient_id')
+
+            # A refreshed token is stored for the next instance
+            android.ensure_token(min_validity=24 * 60 * 60)
+            android = RealAndroidApi('email@email.com', 'password', token_store=store)
+            self.assertListEqual(grants, [("password", None), ("refresh_token", "refresh_1")])
+            self.assertEqual(android.accessToken, 'access_2')
+            self.assertEqual(android.userId, 'user_id')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -4,7 +4,11 @@ import unittest
 import itertools
 import datetime
 import json
+import tempfile
 import requests_mock
+import arrow
+
+from unittest import mock
 
 from bs4 import BeautifulSoup
 
@@ -12,6 +16,8 @@ from .fake import ControlIQApi
 
 from tconnectsync.api.controliq import ControlIQApi as RealControlIQApi
 from tconnectsync.api.common import ApiException, ApiLoginException, base_headers
+from tconnectsync.cache import ResponseCache
+from tconnectsync.tokenstore import TokenStore
 
 class TestControlIQApi(unittest.TestCase):
     LOGIN_HTML = """
@@ -91,6 +97,35 @@ class TestControlIQApi(unittest.TestCase):
             self.assertEqual(ciq.accessTokenExpiresAt, '2021-05-04T11:18:08.381Z')
 
 
+    @unittest.skipUnless(TokenStore.available(), "cryptography is not installed")
+    def test_login_uses_token_store(self):
+        tokens = {
+            "userGuid": "user_guid",
+            "accessToken": "access_tok",
+            "accessTokenExpiresAt": arrow.get().shift(hours=1).isoformat(),
+        }
+
+        def fake_login(ciq, email, password):
+            for field, value in tokens.items():
+                setattr(ciq, field, value)
+            return True
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.object(TokenStore, 'PBKDF2_ITERATIONS', 1000), \
+                mock.patch.object(RealControlIQApi, 'login', autospec=True, side_effect=fake_login) as login:
+            store = TokenStore(tmpdir + '/tokens.json', 'password')
+
+            # The first instance logs in and stores its tokens
+            ciq = RealControlIQApi('email@email.com', 'password', token_store=store)
+            self.assertEqual(login.call_count, 1)
+
+            # Later instances reuse them without logging in
+            ciq = RealControlIQApi('email@email.com', 'password', token_store=store)
+            self.assertEqual(login.call_count, 1)
+            self.assertEqual(ciq.userGuid, 'user_guid')
+            self.assertEqual(ciq.accessToken, 'access_tok')
+            self.assertEqual(ciq.accessTokenExpiresAt, tokens["accessTokenExpiresAt"])
+
     def test_login_invalid_credentials(self):
         ciq = ControlIQApi()
         ciq.LOGIN_URL = RealControlIQApi.LOGIN_URL
@@ -219,6 +254,44 @@ class TestControlIQApi(unittest.TestCase):
                 "faked_json": True
             })
 
+    def test_therapy_timeline_cached_per_day(self):
+        ciq = ControlIQApi()
+        ciq.userGuid = 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee'
+
+        queries = []
+        def fake_get(endpoint, query):
+            queries.append(query)
+            self.assertEqual(query["startDate"], query["endDate"])
+            event = {"x": int(query["startDate"][3:5]), "y": 0.8, "duration": 300}
+            overlap = {"x": 0, "y": 1.0, "duration": 300}
+            return {
+                "basal": {"tempDeliveryEvents": [overlap, event]},
+                "suspensionDeliveryEvents": []
+            }
+
+        ciq._get = fake_get
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ciq.cache = ResponseCache(tmpdir, immutable_days=1)
+
+            expected = {
+                "basal": {"tempDeliveryEvents": [
+                    {"x": 0, "y": 1.0, "duration": 300},
+                    {"x": 1, "y": 0.8, "duration": 300},
+                    {"x": 2, "y": 0.8, "duration": 300},
+                ]},
+                "suspensionDeliveryEvents": []
+            }
+
+            self.assertEqual(ciq.therapy_timeline(datetime.date(2021, 4, 1), datetime.date(2021, 4, 2)), expected)
+            self.assertListEqual(queries, [
+                {"startDate": "04-01-2021", "endDate": "04-01-2021"},
+                {"startDate": "04-02-2021", "endDate": "04-02-2021"},
+            ])
+
+            self.assertEqual(ciq.therapy_timeline(datetime.date(2021, 4, 1), datetime.date(2021, 4, 2)), expected)
+            self.assertEqual(len(queries), 2)
+
     def test_dashboard_summary_parses_date(self):
         ciq = ControlIQApi()
         ciq.userGuid = 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee'
@@ -2,30 +2,38 @@
 
 import unittest
 import itertools
+import datetime
+import tempfile
+import requests_mock
 
 from .fake import WS2Api
 
+import tconnectsync.api.ws2
+
 from tconnectsync.api.common import ApiException
+from tconnectsync.cache import ResponseCache
 
 class TestWS2Api(unittest.TestCase):
-    def fake_get_with_http_500(self, num_times):
+    def fake_get_lines_with_http_500(self, num_times):
         tries = 0
-        def fake_get(endpoint, query):
+        def fake_get_lines(endpoint, query):
             nonlocal tries, num_times
             if "therapytimeline2csv" in endpoint:
                 if tries < num_times:
                     tries += 1
                     raise ApiException(500, "fake HTTP 500")
 
-                return ""
+                return iter([])
             raise NotImplementedError
 
-        return fake_get
+        return fake_get_lines
 
     def test_therapy_timeline_csv_works_after_two_retries(self):
         ws2 = WS2Api()
+        # Retry without waiting
+        ws2.RETRY_BACKOFF_SECONDS = 0
 
-        ws2.get = self.fake_get_with_http_500(2)
+        ws2.get_lines = self.fake_get_lines_with_http_500(2)
 
         self.assertEqual(
             ws2.therapy_timeline_csv('2021-04-01', '2021-04-02'),
@@ -38,8 +46,10 @@ class TestWS2Api(unittest.TestCase):
 
     def test_therapy_timeline_csv_fails_after_three_retries(self):
         ws2 = WS2Api()
+        # Retry without waiting
+        ws2.RETRY_BACKOFF_SECONDS = 0
 
-        ws2.get = self.fake_get_with_http_500(3)
+        ws2.get_lines = self.fake_get_lines_with_http_500(3)
 
         self.assertRaises(ApiException, ws2.therapy_timeline_csv, '2021-04-01', '2021-04-02')
 
@@ -94,12 +104,12 @@ Report Generated On, 4/24/2021 7:50:04 PM
 
         rawData = self.RAW_DATA_FULL
 
-        def fake_get(endpoint, query):
+        def fake_get_lines(endpoint, query):
             nonlocal rawData
             if endpoint == 'therapytimeline2csv/aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee/2021-04-01/2021-04-02?format=csv':
-                return rawData
+                return iter(rawData.splitlines())
 
-        ws2.get = fake_get
+        ws2.get_lines = fake_get_lines
 
         tt = ws2.therapy_timeline_csv('2021-04-01', '2021-04-02')
 
@@ -111,12 +121,12 @@ Report Generated On, 4/24/2021 7:50:04 PM
 
         rawData = ""
 
-        def fake_get(endpoint, query):
+        def fake_get_lines(endpoint, query):
             nonlocal rawData
             if endpoint == 'therapytimeline2csv/aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee/2021-04-01/2021-04-02?format=csv':
-                return rawData
+                return iter(rawData.splitlines())
 
-        ws2.get = fake_get
+        ws2.get_lines = fake_get_lines
 
         # Randomize the order of all sections
         for i in itertools.permutations([self.RAW_DATA_HEADER, self.RAW_DATA_CGM, self.RAW_DATA_IOB, self.RAW_DATA_BOLUS], 4):
@@ -125,5 +135,88 @@ Report Generated On, 4/24/2021 7:50:04 PM
             tt = ws2.therapy_timeline_csv('2021-04-01', '2021-04-02')
             self.assertDictEqual(tt, self.PARSED_DATA)
 
+    def test_therapy_timeline_csv_cached_per_day(self):
+        ws2 = WS2Api()
+        ws2.userGuid = 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee'
+
+        endpoints = []
+        def fake_get(endpoint, query):
+            endpoints.append(endpoint)
+            return self.RAW_DATA_FULL
+
+        ws2.get = fake_get
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ws2.cache = ResponseCache(tmpdir, immutable_days=1)
+
+            # Both days return the same rows, which are only included once
+            tt = ws2.therapy_timeline_csv(datetime.date(2021, 4, 1), datetime.date(2021, 4, 2))
+            self.assertDictEqual(tt, self.PARSED_DATA)
+            self.assertListEqual(endpoints, [
+                'therapytimeline2csv/aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee/04-01-2021/04-01-2021?format=csv',
+                'therapytimeline2csv/aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee/04-02-2021/04-02-2021?format=csv',
+            ])
+
+            tt = ws2.therapy_timeline_csv(datetime.date(2021, 4, 1), datetime.date(2021, 4, 3))
+            self.assertDictEqual(tt, self.PARSED_DATA)
+            self.assertEqual(len(endpoints), 3)
+
+    def test_therapy_timeline_csv_streams_response(self):
+        ws2 = tconnectsync.api.ws2.WS2Api('aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee')
+        ws2.CHUNK_SIZE = 7
+
+        with requests_mock.Mocker() as m:
+            m.get(ws2.BASE_URL + 'therapytimeline2csv/aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee/04-01-2021/04-02-2021?format=csv',
+                text=self.RAW_DATA_FULL.replace("\n", "\r\n"))
+
+            tt = ws2.therapy_timeline_csv(datetime.date(2021, 4, 1), datetime.date(2021, 4, 2))
+
+        self.assertDictEqual(tt, self.PARSED_DATA)
+
+    def test_therapy_timeline_csv_columnar(self):
+        ws2 = tconnectsync.api.ws2.WS2Api('aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee')
+
+        with requests_mock.Mocker() as m:
+            m.get(ws2.BASE_URL + 'therapytimeline2csv/aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee/04-01-2021/04-02-2021?format=csv',
+                text=self.RAW_DATA_FULL)
+
+            tt = ws2.therapy_timeline_csv(datetime.date(2021, 4, 1), datetime.date(2021, 4, 2), columnar=True)
+
+        self.assertListEqual(list(tt["readingData"]["reading"]), [235.0, 230.0, 181.0])
+        self.assertEqual(tt["readingData"].value("description", 0), "EGV")
+        self.assertListEqual(tt["iobData"]["iob"], ["13.24", "12.80", "4.25"])
+        self.assertEqual(len(tt["basalData"]), 0)
+        self.assertListEqual(tt["bolusData"], self.PARSED_DATA["bolusData"])
+
+    def test_decode_chunks(self):
+        text = "Patient Name, Zoë Ångström\n"
+        # A multi-byte character split between chunks is decoded whole
+        chunks = [text.encode("utf-8")[:17], text.encode("utf-8")[17:]]
+        self.assertEqual(''.join(WS2Api._decode_chunks('utf-8', chunks)), text)
+        # With no declared encoding, it is guessed from the content
+        self.assertEqual(''.join(WS2Api._decode_chunks(None, [text.encode('utf-8')])), text)
+        self.assertEqual(''.join(WS2Api._decode_chunks('ISO-8859-1', [text.encode('latin-1')])), text)
+
+    def test_iter_therapy_timeline_csv_is_lazy(self):
+        ws2 = WS2Api()
+
+        consumed = []
+        def lines():
+            for line in (self.RAW_DATA_HEADER + "\n" + self.RAW_DATA_CGM + "\n" + self.RAW_DATA_IOB).splitlines():
+                consumed.append(line)
+                yield line
+
+        rows = ws2._iter_therapy_timeline_csv(lines())
+        self.assertEqual(next(rows), ("readingData", self.PARSED_DATA["readingData"][0]))
+        # Only the header section, the empty line following it, and the
+        # first three lines of the CGM section have been read
+        self.assertEqual(len(consumed), 9)
+
+    def test_split_lines_across_chunks(self):
+        self.assertListEqual(
+            list(WS2Api._split_lines(["a,b\r", "\nc,", "d\r\n\r", "\ne"])),
+            ["a,b", "c,d", "", "e"])
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
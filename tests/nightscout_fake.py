@@ -14,18 +14,27 @@ class NightscoutApi(tconnectsync.nightscout.NightscoutApi):
     def upload_entry(self, ns_format, entity='treatments'):
         self.uploaded_entries[entity].append(ns_format)
 
+    def upload_entries(self, ns_formats, entity='treatments', batch_size=None):
+        self.uploaded_entries[entity].extend(ns_formats)
+
     def delete_entry(self, ns_format, entity):
         self.deleted_entries[entity].append(ns_format)
 
     def put_entry(self, ns_format, entity):
         self.put_entries[entity].append(ns_format)
 
+    def upsert_entries(self, ns_formats, entity='treatments'):
+        self.put_entries[entity].extend(ns_formats)
+
     def last_uploaded_entry(self, eventType):
         raise NotImplementedError
 
     def last_uploaded_activity(self, activityType):
         raise NotImplementedError
 
+    def treatments_in_range(self, eventType, time_start, time_end, page_size=None):
+        raise NotImplementedError
+
     def api_status(self):
         raise NotImplementedError
 
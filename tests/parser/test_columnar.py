@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import math
+import unittest
+
+from tconnectsync.parser.columnar import build_timeline_columns, Categories
+
+class TestTimelineColumns(unittest.TestCase):
+    ROWS = [
+        ("readingData", {"Description": "EGV", "EventDateTime": "2021-04-01T00:06:33", "Readings (CGM / BGM)": "230"}),
+        ("readingData", {"Description": "EGV", "EventDateTime": "2021-04-01T00:01:33", "Readings (CGM / BGM)": "235"}),
+        ("readingData", {"Description": "BG", "EventDateTime": "2021-04-01T00:11:33", "Readings (CGM / BGM)": ""}),
+        ("iobData", {"Type": "IOB", "EventID": "81", "EventDateTime": "2021-04-01T00:00:19", "IOB": "13.24"}),
+        ("iobData", {"Type": "IOB", "EventID": "9", "EventDateTime": "2021-04-01T00:03:12", "IOB": "12.80"}),
+        ("bolusData", {"Type": "Bolus", "Description": "Standard"}),
+    ]
+
+    def test_build_timeline_columns(self):
+        data = build_timeline_columns(self.ROWS)
+
+        readings = data["readingData"]
+        self.assertEqual(len(readings), 3)
+        # Rows are sorted by epoch
+        self.assertListEqual(list(readings.epoch), [1617249693, 1617249993, 1617250293])
+        self.assertListEqual(list(readings["reading"][:2]), [235.0, 230.0])
+        self.assertTrue(math.isnan(readings["reading"][2]))
+        self.assertListEqual(list(readings["description"]), [0, 0, 1])
+        self.assertEqual(readings.value("description", 2), "BG")
+
+        self.assertEqual(readings["reading"].typecode, 'd')
+
+        iob = data["iobData"]
+        self.assertListEqual(list(iob["event_id"]), [81, 9])
+        # IOB keeps the exported string, including its trailing zero
+        self.assertListEqual(iob["iob"], ["13.24", "12.80"])
+        self.assertEqual(iob.value("iob", 1), "12.80")
+
+        self.assertEqual(len(data["basalData"]), 0)
+        self.assertListEqual(data["bolusData"], [{"Type": "Bolus", "Description": "Standard"}])
+
+    def test_since_and_after(self):
+        readings = build_timeline_columns(self.ROWS)["readingData"]
+
+        self.assertListEqual(list(readings.since(1617249993).epoch), [1617249993, 1617250293])
+        self.assertListEqual(list(readings.after(1617249993).epoch), [1617250293])
+        self.assertEqual(len(readings.after(1617250293)), 0)
+        self.assertEqual(readings.since(1617249993).value("description", 1), "BG")
+
+    def test_categories(self):
+        categories = Categories(["EGV", "BG", "EGV"])
+        self.assertEqual(len(categories), 2)
+        self.assertEqual(categories.code("BG"), 1)
+        self.assertEqual(categories[0], "EGV")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import unittest
-from tconnectsync.parser.nightscout import NightscoutEntry
+from tconnectsync.parser.nightscout import NightscoutEntry, entry_id
 
 class TestNightscoutEntry(unittest.TestCase):
     def test_basal(self):
@@ -87,5 +87,21 @@ class TestNightscoutEntry(unittest.TestCase):
         )
 
 
+class TestEntryId(unittest.TestCase):
+    def test_entry_id(self):
+        _id = entry_id("Combo Bolus", 1617296306, "7001.000")
+
+        self.assertRegex(_id, r'^[0-9a-f]{24}$')
+        self.assertEqual(_id, entry_id("Combo Bolus", 1617296306, "7001.000"))
+        self.assertNotEqual(_id, entry_id("Combo Bolus", 1617296306, "7003.000"))
+        self.assertNotEqual(_id, entry_id("Combo Bolus", 1617296307, "7001.000"))
+        self.assertNotEqual(_id, entry_id("Temp Basal", 1617296306, "7001.000"))
+        self.assertEqual(entry_id("Temp Basal", 1617296306), entry_id("Temp Basal", 1617296306, None))
+
+    def test_entry_with_id(self):
+        entry = NightscoutEntry.bolus(bolus=1.5, carbs=0, created_at="2021-04-01 16:03:25-04:00", _id="0123456789abcdef01234567")
+        self.assertEqual(entry["_id"], "0123456789abcdef01234567")
+        self.assertNotIn("_id", NightscoutEntry.bolus(bolus=1.5, carbs=0, created_at="2021-04-01 16:03:25-04:00"))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
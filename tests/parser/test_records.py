@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from tconnectsync.parser.records import BasalEvent, IobEvent
+
+class TestRecords(unittest.TestCase):
+    def test_no_instance_dict(self):
+        event = BasalEvent(time="2021-03-16 00:00:00-04:00", epoch=1615867200, delivery_type="", duration_mins=5, basal_rate=0.8)
+        self.assertFalse(hasattr(event, '__dict__'))
+        with self.assertRaises(AttributeError):
+            event.suspendReason = "control-iq"
+
+    def test_equality(self):
+        a = IobEvent(time="2021-04-01 00:00:00-04:00", epoch=1617249600, iob="1.2", event_id="1")
+        b = IobEvent(time="2021-04-01 00:00:00-04:00", epoch=1617249600, iob="1.2", event_id="1")
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, b._replace(iob="1.3"))
+        self.assertNotEqual(a, a._asdict())
+
+    def test_replace_and_asdict(self):
+        event = BasalEvent(time="2021-03-16 00:00:00-04:00", epoch=1615867200, delivery_type="", duration_mins=5, basal_rate=0.8)
+        replaced = event._replace(suspend_reason="control-iq")
+
+        self.assertIsNone(event.suspend_reason)
+        self.assertEqual(replaced._asdict(), {
+            "time": "2021-03-16 00:00:00-04:00",
+            "epoch": 1615867200,
+            "delivery_type": "",
+            "duration_mins": 5,
+            "basal_rate": 0.8,
+            "suspend_reason": "control-iq",
+        })
+
+if __name__ == '__main__':
+    unittest.main()
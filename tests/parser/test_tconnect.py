@@ -2,6 +2,7 @@
 
 import unittest
 from tconnectsync.parser.tconnect import TConnectEntry
+from tconnectsync.parser.records import BasalEvent, BolusEvent
 
 class TestTConnectEntryBasal(unittest.TestCase):
     def test_parse_ciq_basal_entry(self):
@@ -11,12 +12,13 @@ class TestTConnectEntryBasal(unittest.TestCase):
                 "duration": 1221,
                 "x": 1615878000
             }),
-            {
-                "time": "2021-03-16 00:00:00-04:00",
-                "delivery_type": "",
-                "duration_mins": 1221/60,
-                "basal_rate": 0.8,
-            }
+            BasalEvent(
+                time="2021-03-16 00:00:00-04:00",
+                epoch=1615867200,
+                delivery_type="",
+                duration_mins=1221/60,
+                basal_rate=0.8,
+            )
         )
 
         self.assertEqual(
@@ -25,12 +27,13 @@ class TestTConnectEntryBasal(unittest.TestCase):
                 "duration": 300,
                 "x": 1615879521
             }, delivery_type="algorithmDelivery"),
-            {
-                "time": "2021-03-16 00:25:21-04:00",
-                "delivery_type": "algorithmDelivery",
-                "duration_mins": 5,
-                "basal_rate": 0.797,
-            }
+            BasalEvent(
+                time="2021-03-16 00:25:21-04:00",
+                epoch=1615868721,
+                delivery_type="algorithmDelivery",
+                duration_mins=5,
+                basal_rate=0.797,
+            )
         )
 
 class TestTConnectEntryBolus(unittest.TestCase):
@@ -80,19 +83,22 @@ class TestTConnectEntryBolus(unittest.TestCase):
     def test_parse_bolus_entry_std_correction(self):
         self.assertEqual(
             TConnectEntry.parse_bolus_entry(self.entryStdCorrection),
-            {
-                "description": "Standard/Correction",
-                "complete": "1",
-                "completion": "Completed",
-                "request_time": "2021-04-01 12:53:36-04:00",
-                "completion_time": "2021-04-01 12:58:26-04:00",
-                "insulin": "13.53",
-                "carbs": "75",
-                "user_override": "0",
-                "extended_bolus": "",
-                "bolex_completion_time": None,
-                "bolex_start_time": None
-        })
+            BolusEvent(
+                description="Standard/Correction",
+                complete="1",
+                completion="Completed",
+                request_time="2021-04-01 12:53:36-04:00",
+                completion_time="2021-04-01 12:58:26-04:00",
+                insulin="13.53",
+                carbs="75",
+                user_override="0",
+                extended_bolus="",
+                bolex_completion_time=None,
+                bolex_start_time=None,
+                request_id="7001.000",
+                time="2021-04-01 12:58:26-04:00",
+                epoch=1617296306,
+        ))
     
     entryStd = {
         "Type": "Bolus",
@@ -140,19 +146,22 @@ class TestTConnectEntryBolus(unittest.TestCase):
     def test_parse_bolus_entry_std(self):
         self.assertEqual(
             TConnectEntry.parse_bolus_entry(self.entryStd),
-            {
-                "description": "Standard",
-                "complete": "1",
-                "completion": "Completed",
-                "request_time": "2021-04-01 23:21:58-04:00",
-                "completion_time": "2021-04-01 23:23:17-04:00",
-                "insulin": "1.25",
-                "carbs": "0",
-                "user_override": "1",
-                "extended_bolus": "",
-                "bolex_completion_time": None,
-                "bolex_start_time": None
-        })
+            BolusEvent(
+                description="Standard",
+                complete="1",
+                completion="Completed",
+                request_time="2021-04-01 23:21:58-04:00",
+                completion_time="2021-04-01 23:23:17-04:00",
+                insulin="1.25",
+                carbs="0",
+                user_override="1",
+                extended_bolus="",
+                bolex_completion_time=None,
+                bolex_start_time=None,
+                request_id="7007.000",
+                time="2021-04-01 23:23:17-04:00",
+                epoch=1617333797,
+        ))
     
     entryStdAutomatic = {
         "Type": "Bolus",
@@ -200,19 +209,22 @@ class TestTConnectEntryBolus(unittest.TestCase):
     def test_parse_bolus_entry_std_automatic(self):
         self.assertEqual(
             TConnectEntry.parse_bolus_entry(self.entryStdAutomatic),
-            {
-                "description": "Automatic Bolus/Correction",
-                "complete": "1",
-                "completion": "Completed",
-                "request_time": "2021-04-02 00:59:13-04:00",
-                "completion_time": "2021-04-02 01:00:47-04:00",
-                "insulin": "1.70",
-                "carbs": "0",
-                "user_override": "0",
-                "extended_bolus": "",
-                "bolex_completion_time": None,
-                "bolex_start_time": None
-        })
+            BolusEvent(
+                description="Automatic Bolus/Correction",
+                complete="1",
+                completion="Completed",
+                request_time="2021-04-02 00:59:13-04:00",
+                completion_time="2021-04-02 01:00:47-04:00",
+                insulin="1.70",
+                carbs="0",
+                user_override="0",
+                extended_bolus="",
+                bolex_completion_time=None,
+                bolex_start_time=None,
+                request_id="7010.000",
+                time="2021-04-02 01:00:47-04:00",
+                epoch=1617339647,
+        ))
 
 
 
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import arrow
+
+from tconnectsync.parser.tz import TimezoneConverter
+
+class TestTimezoneConverter(unittest.TestCase):
+    TIMEZONES = ['America/New_York', 'America/Los_Angeles', 'America/Phoenix', 'Europe/London', 'Australia/Lord_Howe', 'Asia/Kolkata']
+
+    def test_convert_epoch(self):
+        c = TimezoneConverter('America/New_York')
+
+        self.assertEqual(c.convert_epoch(1615878000), ("2021-03-16 00:00:00-04:00", 1615867200))
+        self.assertEqual(c.convert_epoch(1615879521), ("2021-03-16 00:25:21-04:00", 1615868721))
+
+    def test_convert_datetime(self):
+        c = TimezoneConverter('America/New_York')
+
+        self.assertEqual(c.convert_datetime("2021-04-01T12:58:26"), ("2021-04-01 12:58:26-04:00", 1617296306))
+        self.assertEqual(c.convert_datetime("2021-01-01T00:00:00"), ("2021-01-01 00:00:00-05:00", 1609477200))
+
+    def test_convert_datetime_other_formats(self):
+        c = TimezoneConverter('America/New_York')
+
+        self.assertEqual(c.convert_datetime("2021-04-01 12:58:26"), ("2021-04-01 12:58:26-04:00", 1617296306))
+
+    def test_epoch_matches_arrow_around_transitions(self):
+        # Spring forward and fall back in 2020 and 2021, in both hemispheres
+        ranges = [(1583600000, 1583900000), (1585400000, 1585800000), (1601700000, 1602000000),
+                  (1604000000, 1604400000), (1615600000, 1615800000), (1635700000, 1636300000)]
+
+        for tz in self.TIMEZONES:
+            c = TimezoneConverter(tz)
+            for start, end in ranges:
+                for x in range(start, end, 599):
+                    t = arrow.get(x, tzinfo="America/Los_Angeles").replace(tzinfo=tz)
+                    self.assertEqual(c.convert_epoch(x), (t.format(), t.int_timestamp), "%s %d" % (tz, x))
+
+    def test_datetime_matches_arrow_around_transitions(self):
+        days = [datetime.datetime(2020, 3, 8), datetime.datetime(2020, 3, 29), datetime.datetime(2020, 4, 5),
+                datetime.datetime(2020, 10, 4), datetime.datetime(2020, 10, 25), datetime.datetime(2020, 11, 1)]
+
+        for tz in self.TIMEZONES:
+            c = TimezoneConverter(tz)
+            for day in days:
+                for secs in range(0, 86400, 299):
+                    s = (day + datetime.timedelta(seconds=secs)).strftime('%Y-%m-%dT%H:%M:%S')
+                    t = arrow.get(s, tzinfo=tz)
+                    self.assertEqual(c.convert_datetime(s), (t.format(), t.int_timestamp), "%s %s" % (tz, s))
+
+    def test_unknown_timezone(self):
+        self.assertRaises(Exception, TimezoneConverter, 'Not/A_Timezone')
+
+if __name__ == '__main__':
+    unittest.main()
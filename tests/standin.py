@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Local stand-in HTTP servers for the t:connect and Nightscout APIs, which
+serve synthetic data over real HTTP, so that the API clients can be
+exercised end to end without network access.
+
+Each server can add latency to every request, and fail a fraction of
+requests to each route with an HTTP error (by default the HTTP 500 which
+the WS2 API returns as a soft rate limit). The volume of data served is
+controlled by the SyntheticHistory passed to TConnectStandin.
+
+Run standalone to serve until interrupted:
+
+    python3 -m tests.standin [--latency 0.1] [--error-rate ws2_csv=0.2]
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import datetime
+import threading
+import contextlib
+import collections
+import socketserver
+import urllib.parse
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+
+import arrow
+
+from tconnectsync.api.android import AndroidApi
+from tconnectsync.api.controliq import ControlIQApi
+from tconnectsync.api.ws2 import WS2Api
+
+from .synthetic import SyntheticHistory
+
+class Response:
+    def __init__(self, status=200, body=b'', content_type='text/plain', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            content_type = 'application/json'
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or []
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so that pooled client connections are reused
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        r = self.server.standin.dispatch(method, self.path, self.headers, body)
+
+        self.send_response(r.status)
+        self.send_header('Content-Type', r.content_type)
+        self.send_header('Content-Length', str(len(r.body)))
+        for name, value in r.headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(r.body)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+"""
+A threaded HTTP server running in the background. Subclasses define
+ROUTES, a list of (method, path regex, route name) tuples, and a method
+named route_<name> for each, which is called with a Request and returns a
+Response.
+
+latency seconds, plus up to jitter seconds, are added to every request.
+A fraction error_rate of requests fail with error_status, which can be
+overridden for each route name in error_rates. Requests and injected
+errors are counted by route name.
+"""
+class StandinServer:
+    ROUTES = ()
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, error_rates=None, error_status=500, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_rates = dict(error_rates or {})
+        self.error_status = error_status
+
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+        self._fail_next = collections.Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._routes = [(method, re.compile(pattern), name) for method, pattern, name in self.ROUTES]
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self._server.server_address[1]
+
+    def start(self, port=0):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    """
+    Fails the next count requests to the given route with error_status.
+    """
+    def fail_next(self, route, count=1):
+        with self._lock:
+            self._fail_next[route] += count
+
+    def _inject_error(self, route):
+        with self._lock:
+            if self._fail_next[route] > 0:
+                self._fail_next[route] -= 1
+                return True
+            rate = self.error_rates.get(route, self.error_rate)
+            return rate > 0 and self._random.random() < rate
+
+    def dispatch(self, method, path, headers, body):
+        parsed = urllib.parse.urlsplit(path)
+        for route_method, pattern, name in self._routes:
+            match = pattern.fullmatch(parsed.path)
+            if route_method != method or not match:
+                continue
+
+            with self._lock:
+                self.requests[name] += 1
+                delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                time.sleep(delay)
+
+            if self._inject_error(name):
+                with self._lock:
+                    self.errors[name] += 1
+                return Response(self.error_status, 'Injected HTTP %d' % self.error_status)
+
+            request = Request(method, parsed, match, headers, body)
+            return getattr(self, 'route_' + name)(request)
+
+        return Response(404, 'Not found: %s %s' % (method, path))
+
+class Request:
+    def __init__(self, method, parsed, match, headers, body):
+        self.method = method
+        self.path = parsed.path
+        self.query = urllib.parse.parse_qs(parsed.query)
+        self.args = match.groups()
+        self.headers = headers
+        self.body = body
+
+    def param(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+    def form(self):
+        return {k: v[0] for k, v in urllib.parse.parse_qs(self.body.decode()).items()}
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+    def bearer(self):
+        auth = self.headers.get('Authorization') or ''
+        return auth[len('Bearer '):] if auth.startswith('Bearer ') else None
+
+LOGIN_HTML = """<html><body><form method="post" action="./login.aspx?ReturnUrl=%2f" id="form1">
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="viewstate" />
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="generator" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="validation" />
+</form></body></html>"""
+
+def _expiry(seconds):
+    return arrow.get().shift(seconds=seconds).to('utc').format('YYYY-MM-DDTHH:mm:ss.SSS') + 'Z'
+
+def _parse_date(date):
+    return datetime.datetime.strptime(date, '%m-%d-%Y').date()
+
+"""
+Serves the ControlIQ login and API, the WS2 therapy timeline CSV export,
+and the Android OAuth and upload status endpoints, for a single account.
+Use patch_apis() to point the API clients at this server.
+"""
+class TConnectStandin(StandinServer):
+    ROUTES = (
+        ('GET', r'/login\.aspx', 'login_page'),
+        ('POST', r'/login\.aspx', 'login'),
+        ('POST', r'/dashboard', 'dashboard'),
+        ('GET', r'/tconnect/controliq/api/therapytimeline/users/([^/]+)', 'ciq_therapy_timeline'),
+        ('GET', r'/tconnect/controliq/api/summary/users/([^/]+)', 'ciq_summary'),
+        ('GET', r'/therapytimeline2csv/([^/]+)/([^/]+)/([^/]+)', 'ws2_csv'),
+        ('POST', r'/cloud/oauth2/token', 'oauth_token'),
+        ('GET', r'/cloud/upload/getlasteventuploaded', 'last_event_uploaded'),
+        ('GET', r'/cloud/usersettings/api/UserProfile', 'user_profile'),
+    )
+
+    def __init__(self, history=None, email='email@email.com', password='password',
+                 token_lifetime_seconds=3600, **kwargs):
+        super().__init__(**kwargs)
+        self.history = history or SyntheticHistory()
+        self.email = email
+        self.password = password
+        self.token_lifetime_seconds = token_lifetime_seconds
+        self.user_guid = str(uuid.UUID(int=self._random.getrandbits(128)))
+
+        # Increment to report newly uploaded pump data
+        self.event_index = 1
+
+        self._ciq_tokens = set()
+        self._android_tokens = set()
+        self._refresh_tokens = set()
+
+    """
+    Returns a context manager which points the ControlIQ, WS2 and Android
+    API clients at this server.
+    """
+    def patch_apis(self):
+        stack = contextlib.ExitStack()
+        stack.enter_context(mock.patch.object(ControlIQApi, 'BASE_URL', self.url + 'tconnect/controliq/api/'))
+        stack.enter_context(mock.patch.object(ControlIQApi, 'LOGIN_URL', self.url + 'login.aspx?ReturnUrl=%2f'))
+        stack.enter_context(mock.patch.object(WS2Api, 'BASE_URL', self.url))
+        stack.enter_context(mock.patch.object(AndroidApi, 'BASE_URL', self.url))
+        return stack
+
+    def _new_token(self, tokens):
+        token = uuid.uuid4().hex
+        with self._lock:
+            tokens.add(token)
+        return token
+
+    def _unauthorized(self, request, tokens):
+        if request.bearer() not in tokens:
+            return Response(401, 'Unauthorized')
+        return None
+
+    def route_login_page(self, request):
+        return Response(200, LOGIN_HTML, 'text/html')
+
+    def route_login(self, request):
+        form = request.form()
+        if (form.get('ctl00$ContentBody$LoginControl$txtLoginEmailAddress') != self.email or
+                form.get('ctl00$ContentBody$LoginControl$txtLoginPassword') != self.password):
+            return Response(200, LOGIN_HTML, 'text/html')
+
+        token = self._new_token(self._ciq_tokens)
+        return Response(302, '', headers=[
+            ('Location', '/dashboard'),
+            ('Set-Cookie', 'UserGUID=%s; Path=/' % self.user_guid),
+            ('Set-Cookie', 'accessToken=%s; Path=/' % token),
+            ('Set-Cookie', 'accessTokenExpiresAt=%s; Path=/' % _expiry(self.token_lifetime_seconds)),
+        ])
+
+    def route_dashboard(self, request):
+        return Response(200, 'Dashboard', 'text/html')
+
+    def route_ciq_therapy_timeline(self, request):
+        unauthorized = self._unauthorized(request, self._ciq_tokens)
+        if unauthorized:
+            return unauthorized
+        if request.args[0] != self.user_guid:
+            return Response(404, 'Unknown user')
+
+        start = _parse_date(request.param('startDate'))
+        end = _parse_date(request.param('endDate'))
+        return Response(200, self.history.ciq_therapy_timeline(start, end))
+
+    def route_ciq_summary(self, request):
+        unauthorized = self._unauthorized(request, self._ciq_tokens)
+        if unauthorized:
+            return unauthorized
+        return Response(200, {'averageReading': 140, 'timeInUseMinutes': 1440, 'totalDays': 1})
+
+    def route_ws2_csv(self, request):
+        user_guid, start, end = request.args
+        if user_guid != self.user_guid:
+            return Response(404, 'Unknown user')
+        return Response(200, self.history.therapy_timeline_csv(_parse_date(start), _parse_date(end)), 'text/csv')
+
+    def route_oauth_token(self, request):
+        auth = request.headers.get('Authorization') or ''
+        expected = base64.b64encode(('%s:%s' % (AndroidApi.ANDROID_API_USERNAME, AndroidApi.ANDROID_API_PASSWORD)).encode()).decode()
+        if auth != 'Basic %s' % expected:
+            return Response(401, {'error': 'invalid_client'})
+
+        form = request.form()
+        if form.get('grant_type') == 'password':
+            if form.get('username') != self.email or form.get('password') != self.password:
+                return Response(400, {'error': 'invalid_grant'})
+        elif form.get('grant_type') == 'refresh_token':
+            with self._lock:
+                if form.get('refresh_token') not in self._refresh_tokens:
+                    return Response(400, {'error': 'invalid_grant'})
+                self._refresh_tokens.discard(form.get('refresh_token'))
+        else:
+            return Response(400, {'error': 'unsupported_grant_type'})
+
+        return Response(200, {
+            'accessToken': self._new_token(self._android_tokens),
+            'accessTokenExpiresAt': _expiry(self.token_lifetime_seconds),
+            'refreshToken': self._new_token(self._refresh_tokens),
+            'refreshTokenExpiresAt': _expiry(14 * 86400),
+            'user': {'id': 'user-%s' % self.user_guid, 'patientObjectId': 'patient-%s' % self.user_guid},
+        })
+
+    def route_last_event_uploaded(self, request):
+        unauthorized = self._unauthorized(request, self._android_tokens)
+        if unauthorized:
+            return unauthorized
+        return Response(200, {'maxPumpEventIndex': self.event_index, 'processingStatus': 1})
+
+    def route_user_profile(self, request):
+        unauthorized = self._unauthorized(request, self._android_tokens)
+        if unauthorized:
+            return unauthorized
+        return Response(200, {'userID': request.param('userId'), 'hasControlIQ': True})
+
+def _created_at(doc):
+    try:
+        return arrow.get(doc.get('created_at')).int_timestamp
+    except (TypeError, ValueError):
+        return 0
+
+"""
+An in-memory Nightscout, supporting the subset of the REST API used by
+NightscoutApi: creating (upserting treatments on created_at and
+eventType), replacing, deleting and querying entries.
+"""
+class NightscoutStandin(StandinServer):
+    ROUTES = (
+        ('GET', r'/api/v1/status\.json', 'status'),
+        ('GET', r'/api/v1/(\w+)', 'find'),
+        ('POST', r'/api/v1/(\w+)', 'create'),
+        ('PUT', r'/api/v1/(\w+)', 'replace'),
+        ('DELETE', r'/api/v1/(\w+)/(\w+)', 'delete'),
+    )
+
+    FIND_OPERATORS = {
+        '$gte': lambda a, b: a >= b,
+        '$gt': lambda a, b: a > b,
+        '$lte': lambda a, b: a <= b,
+        '$lt': lambda a, b: a < b,
+    }
+
+    def __init__(self, secret='apisecret', **kwargs):
+        super().__init__(**kwargs)
+        self.secret = secret
+        self.collections = collections.defaultdict(dict)
+
+    def _unauthorized(self, request):
+        hashed = hashlib.sha1(self.secret.encode()).hexdigest()
+        if request.headers.get('api-secret') != hashed and request.param('api_secret') != self.secret:
+            return Response(401, 'Unauthorized')
+        return None
+
+    def route_status(self, request):
+        return Response(200, {'status': 'ok', 'name': 'nightscout', 'version': 'standin'})
+
+    def route_find(self, request):
+        unauthorized = self._unauthorized(request)
+        if unauthorized:
+            return unauthorized
+
+        filters = []
+        for key, values in request.query.items():
+            m = re.fullmatch(r'find\[(\w+)\](?:\[(\$\w+)\])?', key)
+            if m:
+                filters.append((m.group(1), m.group(2), values[0]))
+
+        def matches(doc):
+            for field, op, value in filters:
+                if op is None:
+                    if str(doc.get(field)) != value:
+                        return False
+                elif not self.FIND_OPERATORS[op](_created_at(doc) if field == 'created_at' else doc.get(field),
+                                                 _created_at({'created_at': value}) if field == 'created_at' else value):
+                    return False
+            return True
+
+        with self._lock:
+            docs = [doc for doc in self.collections[request.args[0]].values() if matches(doc)]
+        docs.sort(key=_created_at, reverse=True)
+        return Response(200, docs[:int(request.param('count', 10))])
+
+    def _upsert(self, entity, doc):
+        docs = self.collections[entity]
+        if '_id' not in doc and entity == 'treatments':
+            for existing in docs.values():
+                if existing.get('created_at') == doc.get('created_at') and existing.get('eventType') == doc.get('eventType'):
+                    doc = {**doc, '_id': existing['_id']}
+                    break
+        if '_id' not in doc:
+            doc = {**doc, '_id': uuid.uuid4().hex[:24]}
+        docs[doc['_id']] = doc
+        return doc
+
+    def route_create(self, request):
+        unauthorized = self._unauthorized(request)
+        if unauthorized:
+            return unauthorized
+
+        body = request.json()
+        with self._lock:
+            created = [self._upsert(request.args[0], doc) for doc in (body if isinstance(body, list) else [body])]
+        return Response(200, created)
+
+    def route_replace(self, request):
+        unauthorized = self._unauthorized(request)
+        if unauthorized:
+            return unauthorized
+
+        doc = request.json()
+        if '_id' not in doc:
+            return Response(400, 'Missing _id')
+        with self._lock:
+            return Response(200, self._upsert(request.args[0], doc))
+
+    def route_delete(self, request):
+        unauthorized = self._unauthorized(request)
+        if unauthorized:
+            return unauthorized
+
+        with self._lock:
+            deleted = self.collections[request.args[0]].pop(request.args[1], None)
+        return Response(200, {'n': 1 if deleted else 0})
+
+def _error_rates(values):
+    rates = {}
+    for value in values or ():
+        route, _, rate = value.partition('=')
+        rates[route] = float(rate)
+    return rates
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run stand-in t:connect and Nightscout servers")
+    parser.add_argument('--tconnect-port', type=int, default=8081)
+    parser.add_argument('--nightscout-port', type=int, default=8082)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds of latency added to each request')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many further seconds of random latency')
+    parser.add_argument('--error-rate', action='append', help='ROUTE=RATE: fail this fraction of requests to a route, e.g. ws2_csv=0.2')
+    parser.add_argument('--boluses-per-day', type=int, default=6)
+    parser.add_argument('--cgm-interval-minutes', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    history = SyntheticHistory(boluses_per_day=args.boluses_per_day, cgm_interval_minutes=args.cgm_interval_minutes)
+    knobs = dict(latency=args.latency, jitter=args.jitter, error_rates=_error_rates(args.error_rate))
+    tconnect = TConnectStandin(history, **knobs).start(args.tconnect_port)
+    nightscout = NightscoutStandin(**knobs).start(args.nightscout_port)
+
+    print("t:connect stand-in: %s (email: %s, password: %s, user: %s)" % (tconnect.url, tconnect.email, tconnect.password, tconnect.user_guid))
+    print("Nightscout stand-in: %s (API secret: %s)" % (nightscout.url, nightscout.secret))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tconnect.stop()
+        nightscout.stop()
+        print(dict(tconnect.requests), dict(nightscout.requests))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
 import unittest
-from tconnectsync.sync.basal import process_ciq_basal_events
+from tconnectsync.sync.basal import process_ciq_basal_events, add_csv_basal_events, basal_entry_ids
 from tconnectsync.parser.tconnect import TConnectEntry
+from tconnectsync.parser.records import BasalEvent
 
 class TestBasalSync(unittest.TestCase):
     base = {
@@ -73,12 +74,47 @@ class TestBasalSync(unittest.TestCase):
         self.assertEqual(basalEvents[2], TConnectEntry.parse_ciq_basal_entry(
             data["basal"]["algorithmDeliveryEvents"][0], delivery_type="algorithmDelivery"))
 
-        self.assertEqual(basalEvents[3], {
-            "suspendReason": "control-iq",
-            **TConnectEntry.parse_ciq_basal_entry(
-                data["basal"]["algorithmDeliveryEvents"][1],
-                delivery_type="algorithmDelivery")
-        })
+        self.assertEqual(basalEvents[3], TConnectEntry.parse_ciq_basal_entry(
+            data["basal"]["algorithmDeliveryEvents"][1],
+            delivery_type="algorithmDelivery")._replace(suspend_reason="control-iq"))
+
+    csv_basal_rows = [
+        {"Type": "Basal", "EventDateTime": "2021-04-01T00:00:00", "BasalRate": "0.8"},
+        {"Type": "Basal", "EventDateTime": "2021-04-01T00:30:00", "BasalRate": "0.9"},
+        {"Type": "Basal", "EventDateTime": "2021-04-01T01:15:00", "BasalRate": "1.0"},
+    ]
+
+    def test_basal_entry_ids(self):
+        basalEvents = process_ciq_basal_events(TestBasalSync.get_example_ciq_basal_events())
+        first = basalEvents[0]
+        same_time = [
+            BasalEvent(first.time, first.epoch, delivery_type, first.duration_mins, first.basal_rate)
+            for delivery_type in ("tempDelivery", "algorithmDelivery", "tempDelivery")
+        ]
+
+        ids = basal_entry_ids(basalEvents + same_time)
+
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertListEqual(ids, basal_entry_ids(basalEvents + same_time))
+
+    def test_add_csv_basal_events(self):
+        basalEvents = add_csv_basal_events([], self.csv_basal_rows)
+
+        self.assertListEqual([e.duration_mins for e in basalEvents], [None, 30, 45])
+
+    def test_add_csv_basal_events_with_last_row(self):
+        basalEvents = add_csv_basal_events([], self.csv_basal_rows[1:], last_row=self.csv_basal_rows[0])
+
+        self.assertListEqual([e.duration_mins for e in basalEvents], [30, 45])
+
+    def test_add_csv_basal_events_ignores_whole_days(self):
+        rows = [
+            {"Type": "Basal", "EventDateTime": "2021-04-01T00:00:00", "BasalRate": "0.8"},
+            {"Type": "Basal", "EventDateTime": "2021-04-02T00:10:00", "BasalRate": "0.9"},
+        ]
+        basalEvents = add_csv_basal_events([], rows)
+
+        self.assertListEqual([e.duration_mins for e in basalEvents], [None, 10])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+from tconnectsync.sync import basal, basal_vectorized
+
+from .test_basal import TestBasalSync
+
+@unittest.skipUnless(basal_vectorized.available(), "numpy is not installed")
+class TestBasalVectorized(unittest.TestCase):
+    @staticmethod
+    def random_ciq_basal_events(seed):
+        rand = random.Random(seed)
+        # Spans the November 2020 DST transition in America/New_York
+        start = 1604200000
+        xs = [start + rand.randrange(0, 3 * 86400) for _ in range(300)]
+
+        def delivery_events(n):
+            return [{"x": rand.choice(xs), "y": round(rand.uniform(0, 2), 3), "duration": rand.randrange(1, 3600)} for _ in range(n)]
+
+        return {
+            "basal": {
+                "tempDeliveryEvents": delivery_events(20),
+                "algorithmDeliveryEvents": delivery_events(200),
+                "profileDeliveryEvents": delivery_events(30),
+            },
+            "suspensionDeliveryEvents": [
+                {"x": rand.choice(xs), "continuation": None, "suspendReason": rand.choice(["control-iq", "manual", "alarm"])}
+                for _ in range(40)
+            ],
+        }
+
+    def test_process_ciq_basal_events_parity(self):
+        self.assertListEqual(
+            basal_vectorized.process_ciq_basal_events(TestBasalSync.get_example_ciq_basal_events()),
+            basal.process_ciq_basal_events(TestBasalSync.get_example_ciq_basal_events()))
+
+        for seed in range(5):
+            data = self.random_ciq_basal_events(seed)
+            self.assertListEqual(
+                basal_vectorized.process_ciq_basal_events(data),
+                basal.process_ciq_basal_events(data))
+
+    def test_process_ciq_basal_events_empty(self):
+        self.assertListEqual(basal_vectorized.process_ciq_basal_events(None), [])
+        self.assertListEqual(basal_vectorized.process_ciq_basal_events({
+            "basal": {"tempDeliveryEvents": [], "algorithmDeliveryEvents": [], "profileDeliveryEvents": []},
+            "suspensionDeliveryEvents": [],
+        }), [])
+
+    def test_process_ciq_basal_events_nearest_suspension(self):
+        data = TestBasalSync.get_example_ciq_basal_events()
+        # 20 seconds after the final algorithm event, and 280 seconds after the one before
+        data["suspensionDeliveryEvents"][0]["x"] = 1615879841
+
+        self.assertListEqual(
+            [e.suspend_reason for e in basal_vectorized.process_ciq_basal_events(data)],
+            [None, None, None, None])
+        self.assertListEqual(
+            [e.suspend_reason for e in basal_vectorized.process_ciq_basal_events(data, suspension_tolerance=60)],
+            [None, None, None, "control-iq"])
+
+    def test_nearest_within(self):
+        import numpy
+        targets = numpy.array([10, 20, 40])
+        self.assertListEqual(
+            basal_vectorized.nearest_within(numpy.array([0, 9, 15, 29, 31, 45, 100]), targets, tolerance=5).tolist(),
+            [-1, 0, 0, -1, -1, 2, -1])
+
+    def test_add_csv_basal_events_parity(self):
+        rand = random.Random(1)
+        rows = []
+        minutes = 0
+        for _ in range(500):
+            minutes += rand.choice([5, 30, 90, 60 * 25])
+            rows.append({"EventDateTime": "2020-10-%02dT%02d:%02d:00" % (1 + (minutes // 1440) % 30, (minutes // 60) % 24, minutes % 60), "BasalRate": "0.8"})
+
+        self.assertListEqual(
+            basal_vectorized.add_csv_basal_events([], rows),
+            basal.add_csv_basal_events([], rows))
+        self.assertListEqual(
+            basal_vectorized.add_csv_basal_events([], rows[1:], last_row=rows[0]),
+            basal.add_csv_basal_events([], rows[1:], last_row=rows[0]))
+        self.assertListEqual(basal_vectorized.add_csv_basal_events([], []), [])
+
+    def test_add_csv_basal_events_other_date_format(self):
+        rows = [
+            {"EventDateTime": "2020-10-01T00:00:00", "BasalRate": "0.8"},
+            {"EventDateTime": "2020-10-01 00:30:00", "BasalRate": "0.9"},
+        ]
+
+        self.assertListEqual(
+            basal_vectorized.add_csv_basal_events([], rows),
+            basal.add_csv_basal_events([], rows))
+
+if __name__ == '__main__':
+    unittest.main()
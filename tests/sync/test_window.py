@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from tconnectsync.sync.window import ns_sync_treatments, entry_changed
+from tconnectsync.parser.nightscout import NightscoutEntry, BASAL_EVENTTYPE
+
+from ..nightscout_fake import NightscoutApi
+
+class TestWindowSync(unittest.TestCase):
+    def entries(self):
+        return [
+            (1615867200, NightscoutEntry.basal(value=0.8, duration_mins=5, created_at="2021-03-16 00:00:00-04:00", reason="algorithmDelivery")),
+            (1615867500, NightscoutEntry.basal(value=0.9, duration_mins=5, created_at="2021-03-16 00:05:00-04:00", reason="algorithmDelivery")),
+            (1615867800, NightscoutEntry.basal(value=1.0, duration_mins=5, created_at="2021-03-16 00:10:00-04:00", reason="algorithmDelivery")),
+        ]
+
+    def existing(self, entries):
+        # Nightscout returns created_at normalized to UTC
+        utc_times = ["2021-03-16T04:00:00.000Z", "2021-03-16T04:05:00.000Z", "2021-03-16T04:10:00.000Z"]
+        return [
+            {**entry, "_id": "id%d" % i, "created_at": utc_times[i]}
+            for i, (_, entry) in enumerate(entries)
+        ]
+
+    def fake_nightscout(self, existing):
+        nightscout = NightscoutApi()
+        nightscout.queries = []
+
+        def treatments_in_range(eventType, time_start, time_end, page_size=None):
+            nightscout.queries.append((eventType, time_start, time_end))
+            return existing
+
+        nightscout.treatments_in_range = treatments_in_range
+        return nightscout
+
+    def test_fills_gaps_and_replaces_changed(self):
+        entries = self.entries()
+        existing = self.existing(entries)
+        # The first entry is missing, and the last has a longer duration
+        del existing[0]
+        existing[-1]["duration"] = 3.0
+
+        nightscout = self.fake_nightscout(existing)
+        count = ns_sync_treatments(nightscout, BASAL_EVENTTYPE, entries)
+
+        self.assertEqual(count, 2)
+        self.assertListEqual(nightscout.queries, [(BASAL_EVENTTYPE, 1615867200, 1615867800)])
+        self.assertListEqual(nightscout.uploaded_entries["treatments"], [entries[0][1]])
+        self.assertListEqual(nightscout.put_entries["treatments"], [{**entries[2][1], "_id": "id2"}])
+
+    def test_fully_synced_range_writes_nothing(self):
+        entries = self.entries()
+        nightscout = self.fake_nightscout(self.existing(entries))
+
+        self.assertEqual(ns_sync_treatments(nightscout, BASAL_EVENTTYPE, entries), 0)
+        self.assertEqual(len(nightscout.queries), 1)
+        self.assertEqual(len(nightscout.uploaded_entries["treatments"]), 0)
+        self.assertEqual(len(nightscout.put_entries["treatments"]), 0)
+
+    def test_treatments_sharing_a_time(self):
+        entries = [
+            (1615867200, NightscoutEntry.basal(value=0.8, duration_mins=5, created_at="2021-03-16 00:00:00-04:00", reason="tempDelivery")),
+            (1615867200, NightscoutEntry.basal(value=0.8, duration_mins=5, created_at="2021-03-16 00:00:00-04:00", reason="algorithmDelivery")),
+        ]
+        # Nightscout returns them in the opposite order
+        existing = [
+            {**entries[1][1], "_id": "id1", "created_at": "2021-03-16T04:00:00.000Z"},
+            {**entries[0][1], "_id": "id0", "created_at": "2021-03-16T04:00:00.000Z"},
+        ]
+
+        nightscout = self.fake_nightscout(existing)
+        self.assertEqual(ns_sync_treatments(nightscout, BASAL_EVENTTYPE, entries), 0)
+        self.assertEqual(len(nightscout.uploaded_entries["treatments"]), 0)
+        self.assertEqual(len(nightscout.put_entries["treatments"]), 0)
+
+        # Only the changed entry replaces its own treatment, and an extra
+        # entry at the same time is added
+        changed = {**entries[1][1], "duration": 10.0}
+        extra = NightscoutEntry.basal(value=0.5, duration_mins=5, created_at="2021-03-16 00:00:00-04:00", reason="profileDelivery")
+        nightscout = self.fake_nightscout([dict(t) for t in existing])
+        self.assertEqual(ns_sync_treatments(nightscout, BASAL_EVENTTYPE, [entries[0], (1615867200, changed), (1615867200, extra)]), 2)
+        self.assertListEqual(nightscout.put_entries["treatments"], [{**changed, "_id": "id1"}])
+        self.assertListEqual(nightscout.uploaded_entries["treatments"], [extra])
+
+    def test_pretend_writes_nothing(self):
+        entries = self.entries()
+        nightscout = self.fake_nightscout([])
+
+        self.assertEqual(ns_sync_treatments(nightscout, BASAL_EVENTTYPE, entries, pretend=True), 3)
+        self.assertEqual(len(nightscout.uploaded_entries["treatments"]), 0)
+
+    def test_no_entries_skips_query(self):
+        nightscout = self.fake_nightscout([])
+
+        self.assertEqual(ns_sync_treatments(nightscout, BASAL_EVENTTYPE, []), 0)
+        self.assertListEqual(nightscout.queries, [])
+
+    def test_entry_changed(self):
+        entry = NightscoutEntry.bolus(bolus=1.25, carbs=30, created_at="2021-03-16 00:00:00-04:00", notes="Standard")
+
+        self.assertFalse(entry_changed(entry, {**entry, "_id": "a", "created_at": "2021-03-16T04:00:00.000Z"}))
+        self.assertTrue(entry_changed(entry, {**entry, "insulin": 1.5}))
+        self.assertTrue(entry_changed(entry, {**entry, "notes": "Standard (Override)"}))
+
+if __name__ == '__main__':
+    unittest.main()
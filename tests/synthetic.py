@@ -0,0 +1,297 @@
+"""
+Generates synthetic t:connect pump history in the formats returned by the
+ControlIQ therapy timeline API and the WS2 therapy timeline CSV export.
+
+Each day is generated independently from the seed, so any range of days
+can be produced without generating the days before it, and a day is the
+same whichever range it is requested in. The history is modelled loosely
+on a Control-IQ user: CGM readings rise after meals and occasionally drop
+out, the algorithm basal rate follows the readings, and some meal boluses
+are extended.
+"""
+import math
+import random
+import datetime
+import collections
+
+from tconnectsync.parser.tz import get_timezone
+
+CSV_HEADER = """Tandem Diabetes Care Inc.
+t:connect Therapy Timeline Data Export
+Patient Name, Synthetic Patient
+Patient DOB, 1/1/1990
+Report Generated On, 1/1/2021 12:00:00 PM
+"""
+
+CGM_HEADERS = "DeviceType,SerialNumber,Description,EventDateTime,Readings (CGM / BGM)"
+IOB_HEADERS = "Type,EventID,EventDateTime,IOB"
+BASAL_HEADERS = "Type,EventDateTime,BasalRate"
+BOLUS_HEADERS = ("Type,Description,BG,IOB,BolusRequestID,BolusCompletionID,CompletionDateTime,InsulinDelivered,"
+    "FoodDelivered,CorrectionDelivered,CompletionStatusID,CompletionStatusDesc,BolusIsComplete,BolexCompletionID,"
+    "BolexSize,BolexStartDateTime,BolexCompletionDateTime,BolexInsulinDelivered,BolexIOB,BolexCompletionStatusID,"
+    "BolexCompletionStatusDesc,ExtendedBolusIsComplete,EventDateTime,RequestDateTime,BolusType,BolusRequestOptions,"
+    "StandardPercent,Duration,CarbSize,UserOverride,TargetBG,CorrectionFactor,FoodBolusSize,CorrectionBolusSize,"
+    "ActualTotalBolusRequested,IsQuickBolus,EventHistoryReportEventDesc,EventHistoryReportDetails,NoteID,IndexID,Note")
+
+def _quote(values):
+    return ','.join('"%s"' % v if v != '' else '' for v in values) + ','
+
+def _time(t):
+    return t.strftime('%Y-%m-%dT%H:%M:%S')
+
+"""
+A bolus in the synthetic history. Extended boluses deliver
+extended_percent of the insulin over duration_minutes after the
+standard portion.
+"""
+SyntheticBolus = collections.namedtuple('SyntheticBolus', [
+    'time', 'carbs', 'bg', 'food_insulin', 'correction_insulin', 'extended_percent', 'duration_minutes'])
+
+# Profile basal rates as (hour, units/hr), with a higher rate for the dawn phenomenon
+BASAL_PROFILE = ((0, 0.7), (4, 0.9), (9, 0.8), (21, 0.75))
+
+# Typical start and end hours of the first three boluses of the day
+MEAL_HOURS = ((7, 9), (12, 14), (18, 20))
+
+CARB_RATIO = 10
+CORRECTION_FACTOR = 30
+TARGET_BG = 110
+
+# Hours over which bolus insulin is modelled as being absorbed
+INSULIN_DURATION_HOURS = 5
+
+class SyntheticHistory:
+    def __init__(self, seed=0, serial_number='11111111', cgm_interval_minutes=5,
+                 basal_interval_minutes=5, boluses_per_day=6, suspensions_per_day=2,
+                 extended_bolus_fraction=0.2, cgm_gap_rate=0.005):
+        self.seed = seed
+        self.serial_number = serial_number
+        self.cgm_interval_minutes = cgm_interval_minutes
+        self.basal_interval_minutes = basal_interval_minutes
+        self.boluses_per_day = boluses_per_day
+        self.suspensions_per_day = suspensions_per_day
+        self.extended_bolus_fraction = extended_bolus_fraction
+        self.cgm_gap_rate = cgm_gap_rate
+
+        self._pacific = get_timezone('America/Los_Angeles')
+
+    def _random(self, day, stream):
+        return random.Random('%s:%s:%s' % (self.seed, day.isoformat(), stream))
+
+    """
+    Returns each date between start and end, inclusive.
+    """
+    @staticmethod
+    def days(start, end):
+        day = start
+        while day <= end:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    """
+    Returns the ControlIQ epoch for a wall time in the user's timezone:
+    the epoch of the same wall time in Pacific time.
+    """
+    def ciq_epoch(self, t):
+        return int(t.replace(tzinfo=self._pacific).timestamp())
+
+    def _steps(self, day, minutes, offset_seconds=0):
+        start = datetime.datetime.combine(day, datetime.time())
+        for i in range(24 * 60 // minutes):
+            yield i, start + datetime.timedelta(minutes=i * minutes, seconds=offset_seconds)
+
+    """
+    Returns the profile basal rate in effect at the given hour.
+    """
+    @staticmethod
+    def profile_rate(hour):
+        rate = BASAL_PROFILE[0][1]
+        for start, segment_rate in BASAL_PROFILE:
+            if hour >= start:
+                rate = segment_rate
+        return rate
+
+    """
+    Returns the day's boluses. The first three are meals at typical times,
+    bolused for with the carb ratio plus a correction when above target,
+    and a fraction of them are extended. The rest are snacks or
+    corrections at any time of day.
+    """
+    def boluses(self, day):
+        rand = self._random(day, 'bolus')
+        boluses = []
+        for i in range(self.boluses_per_day):
+            if i < len(MEAL_HOURS):
+                start_hour, end_hour = MEAL_HOURS[i]
+                carbs = rand.choice((15, 30, 45, 60, 75))
+            else:
+                start_hour, end_hour = 6, 22
+                carbs = rand.choice((0, 0, 15, 30))
+            t = datetime.datetime.combine(day, datetime.time(start_hour)) + \
+                datetime.timedelta(seconds=rand.randrange((end_hour - start_hour) * 3600))
+
+            bg = rand.randint(80, 250)
+            correction = (bg - TARGET_BG) / CORRECTION_FACTOR if bg > 150 or not carbs else 0
+            extended_percent, duration = 0, 0
+            if carbs and rand.random() < self.extended_bolus_fraction:
+                extended_percent, duration = rand.choice((30, 50, 70)), rand.choice((60, 120, 180))
+            boluses.append(SyntheticBolus(t, carbs, bg, round(carbs / CARB_RATIO, 2), round(max(0, correction), 2),
+                                          extended_percent, duration))
+        return sorted(boluses)
+
+    def bolus_times(self, day):
+        return [b.time for b in self.boluses(day)]
+
+    """
+    Returns (start time, duration in minutes, suspendReason) for each of
+    the day's insulin suspensions.
+    """
+    def suspensions(self, day):
+        rand = self._random(day, 'suspension')
+        start = datetime.datetime.combine(day, datetime.time())
+        minutes = self.basal_interval_minutes
+        suspensions = []
+        for _ in range(self.suspensions_per_day):
+            t = start + datetime.timedelta(minutes=minutes * rand.randrange(24 * 60 // minutes))
+            reason = rand.choice(('control-iq', 'control-iq', 'control-iq', 'manual', 'site-cart'))
+            suspensions.append((t, minutes * rand.randint(1, 12), reason))
+        return sorted(suspensions)
+
+    def suspension_times(self, day):
+        return [t for t, _, _ in self.suspensions(day)]
+
+    """
+    Returns the modelled glucose, in mg/dL, at each CGM reading time of
+    the day. Glucose follows a daily cycle, rises after each meal, and
+    drifts randomly.
+    """
+    def glucose(self, day):
+        rand = self._random(day, 'cgm')
+        meals = [(b.time, b.carbs) for b in self.boluses(day) if b.carbs]
+        drift = rand.uniform(-20, 20)
+        readings = []
+        for _, t in self._steps(day, self.cgm_interval_minutes, 33):
+            hour = t.hour + t.minute / 60
+            value = 125 + 25 * math.sin(2 * math.pi * (hour - 2) / 24) + drift
+            for meal_time, carbs in meals:
+                minutes = (t - meal_time).total_seconds() / 60
+                if minutes > 0:
+                    # Peaks an hour after the meal
+                    value += 1.5 * carbs * (minutes / 60) * math.exp(1 - minutes / 60)
+            drift = 0.95 * drift + rand.gauss(0, 3)
+            readings.append((t, int(min(400, max(40, value)))))
+        return readings
+
+    def cgm_rows(self, day):
+        rand = self._random(day, 'cgm-gaps')
+        gap = 0
+        for t, reading in self.glucose(day):
+            if gap == 0 and rand.random() < self.cgm_gap_rate:
+                gap = rand.randint(1, 6)
+            if gap > 0:
+                gap -= 1
+                continue
+            yield ["t:slim X2 Insulin Pump", self.serial_number, "EGV", _time(t), str(reading)]
+
+    def iob_rows(self, day):
+        boluses = self.boluses(day)
+        event_id = day.toordinal() * 1000
+        for i, t in self._steps(day, 5, 19):
+            iob = 0
+            for b in boluses:
+                hours = (t - b.time).total_seconds() / 3600
+                if 0 <= hours < INSULIN_DURATION_HOURS:
+                    iob += (b.food_insulin + b.correction_insulin) * (1 - hours / INSULIN_DURATION_HOURS)
+            yield ["IOB", str(event_id + i), _time(t), "%.2f" % iob]
+
+    """
+    Yields (time, units/hr) for each algorithm basal delivery of the day.
+    The rate is scaled from the profile by the glucose reading, and is
+    zero while delivery is suspended.
+    """
+    def basal_rates(self, day):
+        readings = self.glucose(day)
+        suspensions = self.suspensions(day)
+        for _, t in self._steps(day, self.basal_interval_minutes):
+            if any(start <= t < start + datetime.timedelta(minutes=minutes) for start, minutes, _ in suspensions):
+                yield t, 0.0
+                continue
+
+            minute = t.hour * 60 + t.minute
+            reading = readings[min(len(readings) - 1, minute // self.cgm_interval_minutes)][1]
+            scale = min(3, max(0, 1 + (reading - TARGET_BG - 10) / 80))
+            yield t, round(self.profile_rate(t.hour) * scale, 3)
+
+    def bolus_rows(self, day):
+        request_id = day.toordinal() * 100
+        for i, b in enumerate(self.boluses(day)):
+            rid = request_id + i
+            insulin = b.food_insulin + b.correction_insulin
+            if b.extended_percent:
+                description = "Extended %.2f%%/%.2f" % (b.extended_percent, b.duration_minutes / 60)
+                bolex_size = insulin * b.extended_percent / 100
+                bolex = [str(rid), "%.2f" % bolex_size, _time(b.time), _time(b.time + datetime.timedelta(minutes=b.duration_minutes)),
+                         "%.2f" % bolex_size, "0.00", "3", "Completed", "1"]
+                options, details = "Extended", "Extended Bolus"
+            else:
+                description = "Standard/Correction" if b.correction_insulin else "Standard"
+                bolex = [""] * 9
+                options = description
+                if not b.carbs:
+                    details = "Correction Bolus"
+                else:
+                    details = "Correction & Food Bolus" if b.correction_insulin else "Food Bolus"
+            yield ["Bolus", description, str(b.bg), "", "%d.000" % rid, "%d.000" % rid,
+                _time(b.time + datetime.timedelta(minutes=2)), "%.2f" % insulin, "%.2f" % b.food_insulin,
+                "%.2f" % b.correction_insulin, "3", "Completed", "1"] + bolex + [
+                _time(b.time), _time(b.time), "Carb", options, "%.2f" % (100 - b.extended_percent),
+                str(b.duration_minutes), str(b.carbs), "0", str(TARGET_BG), "%.2f" % CORRECTION_FACTOR,
+                "%.2f" % b.food_insulin, "%.2f" % b.correction_insulin, "%.2f" % insulin, "0", "0", details,
+                "CF 1:%d - Carb Ratio 1:%d - Target BG %d" % (CORRECTION_FACTOR, CARB_RATIO, TARGET_BG), "0", str(rid)]
+
+    """
+    Returns the ControlIQ therapy timeline response for the given dates.
+    """
+    def ciq_therapy_timeline(self, start, end):
+        algorithm = []
+        profile = []
+        suspensions = []
+        for day in self.days(start, end):
+            for t, rate in self.basal_rates(day):
+                algorithm.append({"x": self.ciq_epoch(t), "y": rate, "duration": self.basal_interval_minutes * 60})
+            for i, (hour, rate) in enumerate(BASAL_PROFILE):
+                end_hour = BASAL_PROFILE[i + 1][0] if i + 1 < len(BASAL_PROFILE) else 24
+                t = datetime.datetime.combine(day, datetime.time(hour))
+                profile.append({"x": self.ciq_epoch(t), "y": rate, "duration": (end_hour - hour) * 3600})
+            for t, _, reason in self.suspensions(day):
+                suspensions.append({"x": self.ciq_epoch(t), "continuation": None, "suspendReason": reason})
+
+        return {
+            "basal": {
+                "tempDeliveryEvents": [],
+                "algorithmDeliveryEvents": algorithm,
+                "profileDeliveryEvents": profile,
+            },
+            "suspensionDeliveryEvents": suspensions,
+        }
+
+    """
+    Yields the lines of the therapy timeline CSV export for the given
+    dates, without line endings.
+    """
+    def iter_csv_lines(self, start, end):
+        yield from CSV_HEADER.splitlines()
+        for headers, rows in (
+            (CGM_HEADERS, self.cgm_rows),
+            (IOB_HEADERS, self.iob_rows),
+            (BASAL_HEADERS, lambda day: (["Basal", _time(t), "%.3f" % rate] for t, rate in self.basal_rates(day))),
+            (BOLUS_HEADERS, self.bolus_rows),
+        ):
+            yield ""
+            yield headers
+            for day in self.days(start, end):
+                for row in rows(day):
+                    yield _quote(row)
+
+    def therapy_timeline_csv(self, start, end):
+        return '\n'.join(self.iter_csv_lines(start, end)) + '\n'
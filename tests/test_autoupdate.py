@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+from unittest import mock
+
+import arrow
+
+from tconnectsync.autoupdate import process_auto_update, incremental_time_range, timezone_now
+from tconnectsync.secret import AUTOUPDATE_INCREMENTAL_OVERLAP_MINUTES, TIMEZONE_NAME
+
+from .api.fake import TConnectApi
+from .nightscout_fake import NightscoutApi
+from .test_process import pin_host_timezone
+
+class StopLoop(Exception):
+    pass
+
+class TestIncrementalTimeRange(unittest.TestCase):
+    def test_first_sync_uses_initial_start(self):
+        start = datetime.datetime(2021, 4, 1, 12, 0)
+        now = datetime.datetime(2021, 4, 2, 12, 0)
+
+        self.assertEqual(incremental_time_range(start, None, now, 30), (start, now))
+
+    def test_later_syncs_start_at_last_sync(self):
+        start = datetime.datetime(2021, 4, 1, 12, 0)
+        last = datetime.datetime(2021, 4, 5, 12, 0)
+        now = datetime.datetime(2021, 4, 5, 12, 5)
+
+        self.assertEqual(
+            incremental_time_range(start, last, now, 30),
+            (datetime.datetime(2021, 4, 5, 11, 30), now))
+
+    def test_timezone_now(self):
+        pin_host_timezone(self, 'UTC')
+        expected = arrow.now(TIMEZONE_NAME).naive
+
+        self.assertLess(abs(timezone_now() - expected), datetime.timedelta(minutes=1))
+        self.assertGreater(abs(timezone_now() - datetime.datetime.now()), datetime.timedelta(hours=1))
+
+class TestProcessAutoUpdate(unittest.TestCase):
+    def run_cycles(self, num_cycles, incremental, newest_events=None):
+        tconnect = TConnectApi()
+        nightscout = NightscoutApi()
+
+        event_index = 0
+        def fake_last_event_uploaded(serial_number):
+            nonlocal event_index
+            event_index += 1
+            return {"maxPumpEventIndex": event_index}
+
+        tconnect.android.last_event_uploaded = fake_last_event_uploaded
+
+        ranges = []
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None):
+            if newest_events:
+                newest = newest_events[len(ranges)]
+            else:
+                # The newest event synced was uploaded just now
+                newest = timezone_now()
+            ranges.append((time_start, time_end))
+            if newest:
+                synced_until(newest)
+            return 1
+
+        sleeps = 0
+        def fake_sleep(secs):
+            nonlocal sleeps
+            sleeps += 1
+            if sleeps >= num_cycles:
+                raise StopLoop()
+
+        start = datetime.datetime(2021, 4, 1, 12, 0)
+        end = datetime.datetime(2021, 4, 2, 12, 0)
+
+        with mock.patch('tconnectsync.autoupdate.process_time_range', fake_process_time_range), \
+             mock.patch('tconnectsync.autoupdate.time.sleep', fake_sleep):
+            with self.assertRaises(StopLoop):
+                process_auto_update(tconnect, nightscout, start, end, pretend=False, incremental=incremental)
+
+        return start, end, ranges
+
+    def test_renews_android_token_before_sleeping(self):
+        renewals = []
+        def fake_ensure_token(min_validity=None):
+            renewals.append(min_validity)
+
+        with mock.patch.object(TConnectApi._android, 'ensure_token', fake_ensure_token, create=True):
+            self.run_cycles(2, incremental=False)
+
+        # Tokens are renewed if they expire before the poll after sleeping
+        sleep_validity = [v for v in renewals if v is not None]
+        self.assertEqual(len(sleep_validity), 2)
+        for v in sleep_validity:
+            self.assertGreater(v, TConnectApi._android.REFRESH_BEFORE_SECONDS)
+
+    def test_fixed_range(self):
+        start, end, ranges = self.run_cycles(3, incremental=False)
+        self.assertListEqual(ranges, [(start, end)] * 3)
+
+    def test_incremental_range(self):
+        start, end, ranges = self.run_cycles(3, incremental=True)
+
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[0][0], start)
+        for i in range(1, 3):
+            # Each cycle starts shortly before the previous cycle, and
+            # ends at the current time.
+            self.assertGreater(ranges[i][0], start)
+            self.assertLess(ranges[i][0], ranges[i-1][1])
+            self.assertGreaterEqual(ranges[i][1], ranges[i-1][1])
+
+    def test_incremental_range_follows_synced_events(self):
+        overlap = datetime.timedelta(minutes=AUTOUPDATE_INCREMENTAL_OVERLAP_MINUTES)
+        # The mobile app uploads events long after the pump recorded
+        # them, and the second sync finds no events at all
+        newest = datetime.datetime(2021, 4, 2, 10, 0)
+        start, end, ranges = self.run_cycles(4, incremental=True, newest_events=[newest, None, newest + overlap * 3, None])
+
+        self.assertEqual(ranges[0][0], start)
+        # Late uploads after the newest synced event are still covered,
+        # however long ago that event was
+        self.assertEqual(ranges[1][0], newest - overlap)
+        self.assertEqual(ranges[2][0], newest - overlap)
+        self.assertEqual(ranges[3][0], newest + overlap * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+import datetime
+import tempfile
+import threading
+
+from tconnectsync.backfill import chunk_time_range, download_chunks, process_backfill
+from tconnectsync.journal import BackfillJournal
+from tconnectsync.parser.nightscout import NightscoutEntry
+
+from .api.fake import TConnectApi
+from .nightscout_fake import NightscoutApi
+from .sync.test_bolus import TestBolusSync
+
+class TestChunkTimeRange(unittest.TestCase):
+    def test_chunks(self):
+        self.assertListEqual(
+            chunk_time_range(datetime.datetime(2021, 4, 1, 12, 0), datetime.datetime(2021, 4, 10, 8, 0), 4),
+            [
+                (datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 4)),
+                (datetime.datetime(2021, 4, 5), datetime.datetime(2021, 4, 8)),
+                (datetime.datetime(2021, 4, 9), datetime.datetime(2021, 4, 10)),
+            ])
+
+    def test_single_day(self):
+        self.assertListEqual(
+            chunk_time_range(datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 1), 7),
+            [(datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 1))])
+
+    def test_invalid_chunk_days(self):
+        self.assertRaises(ValueError, chunk_time_range, datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 2), 0)
+
+class TestBackfill(unittest.TestCase):
+    @staticmethod
+    def empty_csv():
+        return {
+            "readingData": [],
+            "iobData": [],
+            "basalData": [],
+            "bolusData": []
+        }
+
+    def test_download_chunks_in_order(self):
+        tconnect = TConnectApi()
+
+        chunks = chunk_time_range(datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 10), 1)
+        first_chunk_done = threading.Event()
+
+        def fake_therapy_timeline(time_start, time_end):
+            # Make the first chunk finish last
+            if time_start == chunks[0][0]:
+                first_chunk_done.wait(0.2)
+            return {"start": time_start}
+
+        tconnect.controliq.therapy_timeline = fake_therapy_timeline
+        tconnect.ws2.therapy_timeline_csv = lambda time_start, time_end: self.empty_csv()
+
+        results = list(download_chunks(tconnect, chunks, max_workers=4))
+        self.assertListEqual([chunk for chunk, _ in results], chunks)
+        self.assertListEqual([data[0]["start"] for _, data in results], [chunk[0] for chunk in chunks])
+
+    def test_download_chunks_bounded_concurrency(self):
+        tconnect = TConnectApi()
+
+        chunks = chunk_time_range(datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 20), 1)
+        lock = threading.Lock()
+        active = 0
+        max_active = 0
+
+        def fake_therapy_timeline(time_start, time_end):
+            nonlocal active, max_active
+            with lock:
+                active += 1
+                max_active = max(active, max_active)
+            threading.Event().wait(0.01)
+            with lock:
+                active -= 1
+            return None
+
+        tconnect.controliq.therapy_timeline = fake_therapy_timeline
+        tconnect.ws2.therapy_timeline_csv = lambda time_start, time_end: self.empty_csv()
+
+        self.assertEqual(len(list(download_chunks(tconnect, chunks, max_workers=3))), 20)
+        self.assertLessEqual(max_active, 3)
+
+    def test_download_chunks_propagates_errors(self):
+        tconnect = TConnectApi()
+
+        chunks = chunk_time_range(datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 5), 1)
+
+        def fake_therapy_timeline(time_start, time_end):
+            if time_start == chunks[2][0]:
+                raise RuntimeError("fake error")
+            return None
+
+        tconnect.controliq.therapy_timeline = fake_therapy_timeline
+        tconnect.ws2.therapy_timeline_csv = lambda time_start, time_end: self.empty_csv()
+
+        results = []
+        with self.assertRaises(RuntimeError):
+            for chunk, _ in download_chunks(tconnect, chunks, max_workers=2):
+                results.append(chunk)
+        self.assertListEqual(results, chunks[:2])
+
+    def test_process_backfill_writes_bolus_data(self):
+        tconnect = TConnectApi()
+
+        start = datetime.datetime(2021, 4, 1)
+        end = datetime.datetime(2021, 4, 2)
+        bolusData = TestBolusSync.get_example_csv_bolus_events()
+
+        requested = []
+        def fake_therapy_timeline_csv(time_start, time_end):
+            requested.append((time_start, time_end))
+            if time_start.day == 1:
+                return {**self.empty_csv(), "bolusData": bolusData[:2]}
+            return {**self.empty_csv(), "bolusData": bolusData[2:]}
+
+        tconnect.controliq.therapy_timeline = lambda time_start, time_end: None
+        tconnect.ws2.therapy_timeline_csv = fake_therapy_timeline_csv
+
+        nightscout = NightscoutApi()
+        nightscout.last_uploaded_entry = lambda event_type: None
+        nightscout.last_uploaded_activity = lambda activity_type: None
+
+        added = process_backfill(tconnect, nightscout, start, end, pretend=False, chunk_days=1, requests_per_minute=None)
+
+        self.assertEqual(added, 3)
+        self.assertListEqual(sorted(requested), [
+            (datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 1)),
+            (datetime.datetime(2021, 4, 2), datetime.datetime(2021, 4, 2)),
+        ])
+        self.assertListEqual(nightscout.uploaded_entries["treatments"], [
+            NightscoutEntry.bolus(13.53, 75, "2021-04-01 12:58:26-04:00", notes="Standard/Correction"),
+            NightscoutEntry.bolus(1.25, 0, "2021-04-01 23:23:17-04:00", notes="Standard (Override)"),
+            NightscoutEntry.bolus(1.7, 0, "2021-04-02 01:00:47-04:00", notes="Automatic Bolus/Correction"),
+        ])
+
+    def test_process_backfill_resumes_from_journal(self):
+        tconnect = TConnectApi()
+
+        start = datetime.datetime(2021, 4, 1)
+        end = datetime.datetime(2021, 4, 3)
+        bolusData = TestBolusSync.get_example_csv_bolus_events()
+
+        requested = []
+        def fake_therapy_timeline_csv(time_start, time_end):
+            requested.append(time_start.day)
+            return {**self.empty_csv(), "bolusData": [bolusData[time_start.day - 1]]}
+
+        tconnect.controliq.therapy_timeline = lambda time_start, time_end: None
+        tconnect.ws2.therapy_timeline_csv = fake_therapy_timeline_csv
+
+        nightscout = NightscoutApi()
+        nightscout.last_uploaded_entry = lambda event_type: None
+        nightscout.last_uploaded_activity = lambda activity_type: None
+
+        # Fail while writing boluses for the second day
+        upload_entries = nightscout.upload_entries
+        def failing_upload_entries(ns_formats, entity='treatments'):
+            if ns_formats[0]["insulin"] == 1.25:
+                raise RuntimeError("fake Nightscout failure")
+            upload_entries(ns_formats, entity)
+
+        nightscout.upload_entries = failing_upload_entries
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal.db')
+
+            with self.assertRaises(RuntimeError):
+                process_backfill(tconnect, nightscout, start, end, pretend=False, chunk_days=1, max_workers=1,
+                    requests_per_minute=None, journal=BackfillJournal(path))
+
+            self.assertEqual(len(nightscout.uploaded_entries["treatments"]), 1)
+
+            nightscout.upload_entries = upload_entries
+            added = process_backfill(tconnect, nightscout, start, end, pretend=False, chunk_days=1, max_workers=1,
+                requests_per_minute=None, journal=BackfillJournal(path))
+
+        # The first day is skipped entirely, and later days which were already
+        # downloaded are read from the journal instead of being re-downloaded.
+        self.assertEqual(added, 2)
+        self.assertListEqual(sorted(requested), [1, 2, 3])
+        self.assertListEqual([e["insulin"] for e in nightscout.uploaded_entries["treatments"]], [13.53, 1.25, 1.7])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+import datetime
+import tempfile
+
+from tconnectsync.cache import ResponseCache, days_between
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = time.mktime(now.timetuple())
+
+    def clock(self):
+        return self.now
+
+class TestResponseCache(unittest.TestCase):
+    today = datetime.date(2021, 4, 10)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock(datetime.datetime.combine(self.today, datetime.time(12, 0)))
+        self.cache = ResponseCache(self.tmpdir.name, immutable_days=1, ttl_seconds=60,
+            clock=self.clock.clock)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('endpoint', 'user', self.today))
+
+    def test_set_and_get(self):
+        self.cache.set('endpoint', 'user', self.today, {"a": [1, 2]})
+        self.assertEqual(self.cache.get('endpoint', 'user', self.today), {"a": [1, 2]})
+
+        self.assertIsNone(self.cache.get('endpoint', 'other_user', self.today))
+        self.assertIsNone(self.cache.get('other_endpoint', 'user', self.today))
+
+    def test_recent_days_expire(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        self.cache.set('endpoint', 'user', self.today, "today")
+        self.cache.set('endpoint', 'user', yesterday, "yesterday")
+
+        self.clock.now += 61
+        self.assertIsNone(self.cache.get('endpoint', 'user', self.today))
+        self.assertIsNone(self.cache.get('endpoint', 'user', yesterday))
+
+    def test_old_days_are_immutable(self):
+        old = self.today - datetime.timedelta(days=2)
+        self.cache.set('endpoint', 'user', old, "old")
+
+        self.clock.now += 365 * 24 * 60 * 60
+        self.assertEqual(self.cache.get('endpoint', 'user', old), "old")
+
+    def test_open_day_expires_after_horizon(self):
+        # Fetched while the day was still open, so the response may be partial
+        self.cache.set('endpoint', 'user', self.today, "partial")
+
+        self.clock.now += 3 * 24 * 60 * 60
+        self.assertIsNone(self.cache.get('endpoint', 'user', self.today))
+
+        self.cache.set('endpoint', 'user', self.today, "complete")
+        self.clock.now += 365 * 24 * 60 * 60
+        self.assertEqual(self.cache.get('endpoint', 'user', self.today), "complete")
+
+    def test_get_or_fetch(self):
+        fetched = []
+        def fetch():
+            fetched.append(True)
+            return "data"
+
+        self.assertEqual(self.cache.get_or_fetch('endpoint', 'user', self.today, fetch), "data")
+        self.assertEqual(self.cache.get_or_fetch('endpoint', 'user', self.today, fetch), "data")
+        self.assertEqual(len(fetched), 1)
+
+    def test_days_between(self):
+        self.assertListEqual(
+            days_between(datetime.datetime(2021, 3, 30, 12, 0), datetime.datetime(2021, 4, 1, 8, 0)),
+            [datetime.date(2021, 3, 30), datetime.date(2021, 3, 31), datetime.date(2021, 4, 1)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import signal
+import asyncio
+import unittest
+import datetime
+import threading
+from unittest import mock
+
+from tconnectsync.daemon import AutoUpdateDaemon, run_auto_update_daemon
+from tconnectsync.autoupdate import timezone_now
+
+from .api.fake import TConnectApi
+from .nightscout_fake import NightscoutApi
+
+class TestAutoUpdateDaemon(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.tconnect = TConnectApi()
+        self.nightscout = NightscoutApi()
+
+        self.polls = 0
+        def fake_last_event_uploaded(serial_number):
+            self.polls += 1
+            return {"maxPumpEventIndex": self.polls}
+
+        # The fake TConnectApi shares its AndroidApi between instances
+        patcher = mock.patch.object(self.tconnect._android, 'last_event_uploaded', fake_last_event_uploaded, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('tconnectsync.daemon.rolling_sleep_seconds', lambda time_diffs: 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start = datetime.datetime(2021, 4, 1, 12, 0)
+        self.end = datetime.datetime(2021, 4, 2, 12, 0)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def daemon(self, **kwargs):
+        return AutoUpdateDaemon(self.tconnect, self.nightscout, self.start, self.end, False, **kwargs)
+
+    def run_until(self, daemon, condition, timeout=5):
+        async def stop_when():
+            while not condition():
+                await asyncio.sleep(0.005)
+            daemon.stop()
+
+        stopper = asyncio.ensure_future(stop_when())
+        exit_code = self.loop.run_until_complete(asyncio.wait_for(daemon.run(), timeout))
+        stopper.cancel()
+        return exit_code
+
+    def test_polls_while_syncing(self):
+        release = threading.Event()
+        ranges = []
+        polls_during_sync = []
+        sync_started = []
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None):
+            polls_before = self.polls
+            sync_started.append(polls_before)
+            release.wait(5)
+            polls_during_sync.append(self.polls - polls_before)
+            ranges.append((time_start, time_end))
+            return 1
+
+        daemon = self.daemon(incremental=False)
+        def condition():
+            if sync_started and self.polls >= sync_started[0] + 5:
+                release.set()
+            return len(ranges) >= 2
+
+        with mock.patch('tconnectsync.daemon.process_time_range', fake_process_time_range):
+            self.assertEqual(self.run_until(daemon, condition), 0)
+
+        # Polling continued during the first sync, and the new data it
+        # found was synced once the first sync completed
+        self.assertGreaterEqual(polls_during_sync[0], 4)
+        # Polls continue until the stop, so a third sync may have started
+        self.assertListEqual(ranges[:2], [(self.start, self.end)] * 2)
+
+    def test_stop_waits_for_sync_in_progress(self):
+        started = threading.Event()
+        completed = []
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None):
+            started.set()
+            # Longer than the poll interval, so the stop arrives mid-sync
+            threading.Event().wait(0.1)
+            completed.append(time_start)
+            return 1
+
+        daemon = self.daemon(incremental=False)
+        with mock.patch('tconnectsync.daemon.process_time_range', fake_process_time_range):
+            self.assertEqual(self.run_until(daemon, started.is_set), 0)
+
+        self.assertListEqual(completed, [self.start])
+
+    def test_incremental_range(self):
+        ranges = []
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None):
+            ranges.append((time_start, time_end))
+            synced_until(timezone_now())
+            return 1
+
+        daemon = self.daemon(incremental=True)
+        with mock.patch('tconnectsync.daemon.process_time_range', fake_process_time_range):
+            self.run_until(daemon, lambda: len(ranges) >= 2)
+
+        self.assertEqual(ranges[0][0], self.start)
+        self.assertGreater(ranges[1][0], self.start)
+        self.assertLess(ranges[1][0], ranges[0][1])
+
+    def test_sync_exception_stops_daemon(self):
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None):
+            raise ValueError("sync failed")
+
+        daemon = self.daemon(incremental=False)
+        with mock.patch('tconnectsync.daemon.process_time_range', fake_process_time_range):
+            with self.assertRaisesRegex(ValueError, "sync failed"):
+                self.loop.run_until_complete(asyncio.wait_for(daemon.run(), 5))
+
+        self.assertEqual(daemon.exit_code, 1)
+
+    def test_sigterm_shuts_down_gracefully(self):
+        syncs = []
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None):
+            syncs.append(time_start)
+            if len(syncs) == 2:
+                os.kill(os.getpid(), signal.SIGTERM)
+            return 1
+
+        with mock.patch('tconnectsync.daemon.process_time_range', fake_process_time_range):
+            exit_code = run_auto_update_daemon(self.tconnect, self.nightscout, self.start, self.end, False, incremental=False)
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(len(syncs), 2)
+
+    def test_second_signal_exits_immediately(self):
+        stopped = threading.Event()
+        exited = threading.Event()
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None):
+            os.kill(os.getpid(), signal.SIGTERM)
+            # Pending signals of the same kind are merged, so the second is
+            # only sent once the first has been handled
+            stopped.wait(5)
+            os.kill(os.getpid(), signal.SIGTERM)
+            exited.wait(5)
+            return 1
+
+        stop = AutoUpdateDaemon.stop
+        def fake_stop(daemon, *args):
+            stop(daemon, *args)
+            stopped.set()
+
+        with mock.patch('tconnectsync.daemon.process_time_range', fake_process_time_range), \
+                mock.patch.object(AutoUpdateDaemon, 'stop', fake_stop), \
+                mock.patch('os._exit', side_effect=lambda code: exited.set()) as exit:
+            run_auto_update_daemon(self.tconnect, self.nightscout, self.start, self.end, False, incremental=False)
+
+        exit.assert_called_once_with(1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Runs a Python command with -X importtime, and returns a dict of the name
+of each module imported to its cumulative import time in microseconds.
+"""
+def import_times(*args):
+    r = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + list(args),
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True)
+
+    times = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            times[parts[2].strip()] = int(parts[1])
+        except (IndexError, ValueError):
+            # The header line
+            continue
+    return times
+
+SLOW_MODULES = ('requests', 'arrow', 'bs4', 'lxml', 'numpy', 'cryptography', 'dotenv')
+
+class TestImportTime(unittest.TestCase):
+    # Generous, so that only an accidental eager import of a slow module
+    # fails on a slow machine
+    HELP_BUDGET_US = 250 * 1000
+
+    def test_help_imports_nothing_slow(self):
+        times = import_times('main.py', '--help')
+        self.assertTrue(times, 'no -X importtime output')
+
+        for module in SLOW_MODULES + ('tconnectsync.secret', 'tconnectsync.api'):
+            self.assertNotIn(module, times)
+
+        main_modules = sum(t for m, t in times.items() if m in ('argparse', 'logging'))
+        self.assertLess(main_modules, self.HELP_BUDGET_US)
+
+    def test_api_imports_lazily(self):
+        times = import_times('-c', 'import tconnectsync.api')
+
+        for module in SLOW_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_api_classes_importable_from_package(self):
+        from tconnectsync.api import AndroidApi, ControlIQApi, WS2Api
+        from tconnectsync.api.android import AndroidApi as android_api
+        from tconnectsync.api.controliq import ControlIQApi as controliq_api
+        from tconnectsync.api.ws2 import WS2Api as ws2_api
+
+        self.assertIs(AndroidApi, android_api)
+        self.assertIs(ControlIQApi, controliq_api)
+        self.assertIs(WS2Api, ws2_api)
+
+    def test_process_does_not_import_optional_dependencies(self):
+        times = import_times('-c', 'import tconnectsync.process')
+
+        for module in ('bs4', 'lxml', 'numpy', 'cryptography'):
+            self.assertNotIn(module, times)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+import datetime
+import tempfile
+
+from tconnectsync.journal import BackfillJournal
+
+class TestBackfillJournal(unittest.TestCase):
+    chunk = (datetime.datetime(2021, 4, 1), datetime.datetime(2021, 4, 7))
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'journal.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_save_and_load_download(self):
+        journal = BackfillJournal(self.path)
+        self.assertIsNone(journal.load_download(self.chunk))
+
+        csvdata = {"readingData": [], "iobData": [], "basalData": [{"BasalRate": "0.8"}], "bolusData": []}
+        journal.save_download(self.chunk, {"basal": {}}, csvdata)
+
+        # A new instance reads what the previous one wrote
+        journal = BackfillJournal(self.path)
+        self.assertEqual(journal.load_download(self.chunk), ({"basal": {}}, csvdata))
+        self.assertEqual(journal.last_csv_basal_row(self.chunk), {"BasalRate": "0.8"})
+
+    def test_stages(self):
+        journal = BackfillJournal(self.path)
+        journal.save_download(self.chunk, None, {"basalData": []})
+
+        journal.mark_stage(self.chunk, 'basal', 5)
+        journal.mark_stage(self.chunk, 'bolus', 1)
+        self.assertSetEqual(journal.completed_stages(self.chunk), {'basal', 'bolus'})
+        self.assertFalse(journal.is_complete(self.chunk))
+        self.assertIsNotNone(journal.load_download(self.chunk))
+
+        journal.mark_stage(self.chunk, 'iob', 1)
+        self.assertTrue(journal.is_complete(self.chunk))
+
+        # Downloaded data is discarded once the chunk is complete
+        self.assertIsNone(journal.load_download(self.chunk))
+
+if __name__ == '__main__':
+    unittest.main()
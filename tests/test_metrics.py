@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import urllib.error
+import urllib.request
+
+from tconnectsync import metrics
+from tconnectsync.metrics import Registry, endpoint_label, start_metrics_server
+from tconnectsync.api import TConnectApi
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.process import process_time_range
+
+from .standin import TConnectStandin, NightscoutStandin
+from .synthetic import SyntheticHistory
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests made', ('api', 'status'))
+        latency = registry.histogram('latency_seconds', 'Request latency', ('api',), buckets=(0.1, 1))
+        last = registry.gauge('last_seconds', 'Last success')
+
+        requests.inc(api='ws2', status=200)
+        requests.inc(2, api='ws2', status=200)
+        requests.inc(api='ws2', status=500)
+        latency.observe(0.05, api='ws2')
+        latency.observe(0.5, api='ws2')
+        latency.observe(5, api='ws2')
+        last.set(12.5)
+
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP requests_total Requests made',
+            '# TYPE requests_total counter',
+            'requests_total{api="ws2",status="200"} 3',
+            'requests_total{api="ws2",status="500"} 1',
+            '# HELP latency_seconds Request latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{api="ws2",le="0.1"} 1',
+            'latency_seconds_bucket{api="ws2",le="1"} 2',
+            'latency_seconds_bucket{api="ws2",le="+Inf"} 3',
+            'latency_seconds_sum{api="ws2"} 5.55',
+            'latency_seconds_count{api="ws2"} 3',
+            '# HELP last_seconds Last success',
+            '# TYPE last_seconds gauge',
+            'last_seconds 12.5',
+        ]) + '\n')
+
+    def test_labels_are_checked_and_escaped(self):
+        registry = Registry()
+        counter = registry.counter('c_total', 'Counter', ('name',))
+        with self.assertRaises(ValueError):
+            counter.inc(other='x')
+        with self.assertRaises(ValueError):
+            counter.inc(-1, name='x')
+
+        counter.inc(name='a "quoted"\nname')
+        self.assertIn('c_total{name="a \\"quoted\\"\\nname"} 1', registry.render())
+
+    def test_endpoint_label(self):
+        self.assertEqual(endpoint_label('https://tdcservices.tandemdiabetes.com/tconnect/therapytimeline2csv/6a0e6b3c-0f0e-4b8a-9d1e-2f5c3b8a7d10/04-01-2021/04-02-2021?format=csv'),
+                         '/tconnect/therapytimeline2csv/:id/:id/:id')
+        self.assertEqual(endpoint_label('https://ns.example/api/v1/treatments?api_secret=x'), '/api/v1/treatments')
+
+    def test_server(self):
+        registry = Registry()
+        registry.counter('c_total', 'Counter').inc()
+        server = start_metrics_server(0, registry=registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+        with urllib.request.urlopen(url + '/metrics') as r:
+            self.assertTrue(r.headers['Content-Type'].startswith('text/plain'))
+            self.assertIn('c_total 1', r.read().decode())
+
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
+
+class TestSyncMetrics(unittest.TestCase):
+    def test_process_time_range(self):
+        tconnect_server = TConnectStandin(SyntheticHistory(boluses_per_day=3, cgm_gap_rate=0)).start()
+        self.addCleanup(tconnect_server.stop)
+        nightscout_server = NightscoutStandin().start()
+        self.addCleanup(nightscout_server.stop)
+        patch = tconnect_server.patch_apis()
+        patch.__enter__()
+        self.addCleanup(patch.__exit__, None, None, None)
+
+        metrics.REGISTRY.clear()
+        self.addCleanup(metrics.REGISTRY.clear)
+
+        tconnect = TConnectApi(tconnect_server.email, tconnect_server.password)
+        nightscout = NightscoutApi(nightscout_server.url, nightscout_server.secret)
+        self.addCleanup(nightscout.close)
+        day = datetime.datetime(2021, 4, 1)
+        process_time_range(tconnect, nightscout, day, day, pretend=False)
+
+        self.assertEqual(metrics.LOGINS.value(api='controliq', kind='login'), 1)
+        self.assertEqual(metrics.ROWS_PARSED.value(section='readingData'), 288)
+        self.assertEqual(metrics.ROWS_PARSED.value(section='algorithmDeliveryEvents'), 288)
+        self.assertEqual(metrics.ENTRIES_WRITTEN.value(event_type='Combo Bolus'), 3)
+        self.assertEqual(metrics.CYCLE_SECONDS.count(account='', result='success'), 1)
+        self.assertIsNotNone(metrics.LAST_SUCCESSFUL_CYCLE.value(account=''))
+
+        rendered = metrics.REGISTRY.render()
+        self.assertIn('{api="ws2",method="GET",endpoint="/therapytimeline2csv/:id/:id/:id",status="200"} 1', rendered)
+        self.assertIn('tconnectsync_api_request_duration_seconds_count{api="nightscout",method="POST",endpoint="/api/v1/treatments"}', rendered)
+        self.assertIn('tconnectsync_sync_cycle_duration_seconds_count{account="",result="success"} 1', rendered)
+
+        process_time_range(tconnect, nightscout, day, day, pretend=False, account='account1')
+        self.assertEqual(metrics.CYCLE_SECONDS.count(account='account1', result='success'), 1)
+        self.assertIsNotNone(metrics.LAST_SUCCESSFUL_CYCLE.value(account='account1'))
+
+if __name__ == '__main__':
+    unittest.main()
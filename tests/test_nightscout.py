@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+import hashlib
+import urllib.parse
+import requests_mock
+
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.api.common import ApiException
+
+class TestNightscoutApi(unittest.TestCase):
+    URL = 'https://nightscout.example/'
+    SECRET = 'secret'
+
+    def test_session_is_reused(self):
+        ns = NightscoutApi(self.URL, self.SECRET)
+
+        with requests_mock.Mocker() as m:
+            m.post(self.URL + 'api/v1/treatments?api_secret=secret', json={})
+            m.put(self.URL + 'api/v1/treatments?api_secret=secret', json={})
+
+            session = ns.session
+            ns.upload_entry({"eventType": "Temp Basal"})
+            ns.put_entry({"eventType": "Temp Basal"}, entity='treatments')
+
+            self.assertIs(ns.session, session)
+            self.assertEqual(m.call_count, 2)
+
+    def test_pool_size_is_configurable(self):
+        ns = NightscoutApi(self.URL, self.SECRET, pool_size=3)
+
+        adapter = ns.session.get_adapter(self.URL)
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_auth_header(self):
+        ns = NightscoutApi(self.URL, self.SECRET)
+
+        with requests_mock.Mocker() as m:
+            m.post(self.URL + 'api/v1/treatments?api_secret=secret',
+                request_headers={
+                    'api-secret': hashlib.sha1(b'secret').hexdigest(),
+                    'Content-Type': 'application/json'
+                },
+                json={})
+
+            ns.upload_entry({"eventType": "Temp Basal"})
+            self.assertEqual(m.call_count, 1)
+
+    def test_upload_entry_error(self):
+        ns = NightscoutApi(self.URL, self.SECRET)
+
+        with requests_mock.Mocker() as m:
+            m.post(self.URL + 'api/v1/treatments?api_secret=secret', status_code=500, text='error')
+
+            self.assertRaises(ApiException, ns.upload_entry, {"eventType": "Temp Basal"})
+
+    def test_upload_entries_in_batches(self):
+        ns = NightscoutApi(self.URL, self.SECRET, batch_size=2)
+        entries = [
+            {"eventType": "Temp Basal", "created_at": "2021-03-16 00:%02d:00-04:00" % i}
+            for i in range(5)
+        ]
+
+        with requests_mock.Mocker() as m:
+            m.post(self.URL + 'api/v1/treatments?api_secret=secret',
+                json=lambda request, context: request.json())
+
+            ns.upload_entries(entries)
+
+            self.assertEqual(m.call_count, 3)
+            self.assertListEqual([r.json() for r in m.request_history], [
+                entries[0:2],
+                entries[2:4],
+                entries[4:5]
+            ])
+
+    def test_upload_entries_falls_back_to_single_on_error(self):
+        ns = NightscoutApi(self.URL, self.SECRET, batch_size=10)
+        entries = [
+            {"eventType": "Temp Basal", "created_at": "2021-03-16 00:%02d:00-04:00" % i}
+            for i in range(3)
+        ]
+
+        def callback(request, context):
+            if isinstance(request.json(), list):
+                context.status_code = 500
+                return {}
+            return request.json()
+
+        with requests_mock.Mocker() as m:
+            m.post(self.URL + 'api/v1/treatments?api_secret=secret', json=callback)
+
+            ns.upload_entries(entries)
+
+            self.assertEqual(m.call_count, 4)
+            self.assertListEqual([r.json() for r in m.request_history[1:]], entries)
+
+    def test_upload_entries_resends_missing_entries(self):
+        ns = NightscoutApi(self.URL, self.SECRET, batch_size=10)
+        entries = [
+            {"eventType": "Temp Basal", "created_at": "2021-03-16 00:%02d:00-04:00" % i}
+            for i in range(3)
+        ]
+
+        def callback(request, context):
+            j = request.json()
+            if isinstance(j, list):
+                # Nightscout returns created_at normalized to UTC
+                return [
+                    {"eventType": "Temp Basal", "created_at": "2021-03-16T04:00:00.000Z"},
+                    {"eventType": "Temp Basal", "created_at": "2021-03-16T04:02:00.000Z"}
+                ]
+            return j
+
+        with requests_mock.Mocker() as m:
+            m.post(self.URL + 'api/v1/treatments?api_secret=secret', json=callback)
+
+            ns.upload_entries(entries)
+
+            self.assertEqual(m.call_count, 2)
+            self.assertDictEqual(m.request_history[1].json(), entries[1])
+
+    def test_upload_entries_raises_when_single_upload_fails(self):
+        ns = NightscoutApi(self.URL, self.SECRET)
+
+        with requests_mock.Mocker() as m:
+            m.post(self.URL + 'api/v1/treatments?api_secret=secret', status_code=500, text='error')
+
+            self.assertRaises(ApiException, ns.upload_entries, [{"eventType": "Temp Basal"}])
+
+    def test_upsert_entries(self):
+        ns = NightscoutApi(self.URL, self.SECRET, pool_size=2)
+        entries = [
+            {"_id": "%024x" % i, "eventType": "Temp Basal", "created_at": "2021-03-16 00:%02d:00-04:00" % i}
+            for i in range(5)
+        ]
+
+        with requests_mock.Mocker() as m:
+            m.put(self.URL + 'api/v1/treatments?api_secret=secret', json={})
+
+            ns.upsert_entries(entries)
+
+            self.assertEqual(m.call_count, 5)
+            self.assertListEqual(sorted((r.json() for r in m.request_history), key=lambda e: e["_id"]), entries)
+
+    def test_upsert_entries_serializes_shared_ids(self):
+        ns = NightscoutApi(self.URL, self.SECRET, pool_size=4)
+        entries = [
+            {"_id": "%024x" % (i % 2), "eventType": "Temp Basal", "created_at": "2021-03-16 00:%02d:00-04:00" % i}
+            for i in range(6)
+        ]
+        in_flight = set()
+
+        def callback(request, context):
+            _id = request.json()["_id"]
+            self.assertNotIn(_id, in_flight)
+            in_flight.add(_id)
+            time.sleep(0.01)
+            in_flight.remove(_id)
+            return {}
+
+        with requests_mock.Mocker() as m:
+            m.put(self.URL + 'api/v1/treatments?api_secret=secret', json=callback)
+
+            ns.upsert_entries(entries)
+
+            self.assertEqual(m.call_count, 6)
+            for _id in ("%024x" % 0, "%024x" % 1):
+                sent = [r.json() for r in m.request_history if r.json()["_id"] == _id]
+                self.assertListEqual(sent, [e for e in entries if e["_id"] == _id])
+
+    def fake_treatments(self, treatments):
+        def callback(request, context):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(request.url).query)
+            self.assertEqual(query["find[created_at][$gte]"], ["2021-03-16T04:00:00.000Z"])
+            upper = query["find[created_at][$lte]"][0]
+            page = [t for t in treatments if t["created_at"] <= upper]
+            return page[:int(query["count"][0])]
+        return callback
+
+    def test_treatments_in_range_pages(self):
+        ns = NightscoutApi(self.URL, self.SECRET)
+        treatments = [
+            {"_id": str(i), "eventType": "Temp Basal", "created_at": "2021-03-16T04:%02d:00.000Z" % i}
+            for i in reversed(range(5))
+        ]
+
+        with requests_mock.Mocker() as m:
+            m.get(self.URL + 'api/v1/treatments', json=self.fake_treatments(treatments))
+
+            found = ns.treatments_in_range("Temp Basal", "2021-03-16 00:00:00-04:00", "2021-03-16 00:30:00-04:00", page_size=2)
+
+            self.assertListEqual(found, treatments)
+            self.assertEqual(urllib.parse.parse_qs(urllib.parse.urlparse(m.request_history[0].url).query)["find[created_at][$lte]"],
+                ["2021-03-16T04:30:00.000Z"])
+
+    def test_treatments_in_range_pages_with_shared_created_at(self):
+        ns = NightscoutApi(self.URL, self.SECRET)
+        # More treatments share a created_at than fit on a page
+        treatments = [{"_id": "a", "eventType": "Temp Basal", "created_at": "2021-03-16T04:20:00.000Z"}] + [
+            {"_id": str(i), "eventType": "Temp Basal", "created_at": "2021-03-16T04:10:00.000Z"}
+            for i in range(5)
+        ] + [{"_id": "b", "eventType": "Temp Basal", "created_at": "2021-03-16T04:00:00.000Z"}]
+
+        with requests_mock.Mocker() as m:
+            m.get(self.URL + 'api/v1/treatments', json=self.fake_treatments(treatments))
+
+            found = ns.treatments_in_range("Temp Basal", "2021-03-16 00:00:00-04:00", "2021-03-16 00:30:00-04:00", page_size=2)
+
+        self.assertListEqual(found, treatments)
+
+    def test_close_resets_session(self):
+        ns = NightscoutApi(self.URL, self.SECRET)
+
+        session = ns.session
+        ns.close()
+        self.assertIsNot(ns.session, session)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
+import os
+import time
 import unittest
 import datetime
 import pprint
+import threading
 
-from tconnectsync.process import process_time_range
+from tconnectsync.process import process_time_range, download_time_range, sync_time_range_data
+from tconnectsync.api.common import ApiException
 from tconnectsync.parser.nightscout import NightscoutEntry
 
 from .api.fake import TConnectApi
@@ -12,6 +16,22 @@ from .nightscout_fake import NightscoutApi
 from .sync.test_basal import TestBasalSync
 from .sync.test_bolus import TestBolusSync
 
+"""
+Sets the host's local timezone for the rest of a test.
+"""
+def pin_host_timezone(test, tz):
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = tz
+    time.tzset()
+
+    def restore():
+        if previous is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = previous
+        time.tzset()
+    test.addCleanup(restore)
+
 class TestProcessTimeRange(unittest.TestCase):
     maxDiff = None
 
@@ -95,9 +115,15 @@ class TestProcessTimeRange(unittest.TestCase):
         nightscout.last_uploaded_entry = fake_last_uploaded_entry
         nightscout.last_uploaded_activity = self.stub_last_uploaded_activity
 
-        process_time_range(tconnect, nightscout, start, end, pretend=False)
+        # A UTC host, as in Docker, with TIMEZONE_NAME in America/New_York
+        pin_host_timezone(self, 'UTC')
+        synced = []
+        process_time_range(tconnect, nightscout, start, end, pretend=False, synced_until=synced.append)
 
         self.assertEqual(len(nightscout.uploaded_entries["treatments"]), 2)
+        # Reported as a naive time in TIMEZONE_NAME, whatever the host's
+        # timezone, since t:connect reads queried dates in TIMEZONE_NAME
+        self.assertListEqual(synced, [datetime.datetime(2021, 3, 16, 0, 30, 21)])
         self.assertDictEqual(dict(nightscout.uploaded_entries), {
             "treatments": [
                 NightscoutEntry.basal(0.797, 5.0, "2021-03-16 00:25:21-04:00", reason="algorithmDelivery"),
@@ -192,6 +218,97 @@ class TestProcessTimeRange(unittest.TestCase):
         self.assertDictEqual(nightscout.put_entries, {})
         self.assertDictEqual(nightscout.deleted_entries, {})
 
+    """Deterministic ids make re-sending the same data idempotent."""
+    def test_deterministic_ids_ciq_basal_data(self):
+        nightscout = NightscoutApi()
+        def fail_last_uploaded_entry(event_type):
+            # Upserts need no duplicate detection
+            self.fail("queried last uploaded %s" % event_type)
+        nightscout.last_uploaded_entry = fail_last_uploaded_entry
+        nightscout.last_uploaded_activity = self.stub_last_uploaded_activity
+
+        for _ in range(2):
+            sync_time_range_data(nightscout, TestBasalSync.get_example_ciq_basal_events(),
+                self.stub_therapy_timeline_csv(None, None), pretend=False, deterministic_ids=True)
+
+        upserted = nightscout.put_entries["treatments"]
+        self.assertEqual(len(upserted), 8)
+        self.assertListEqual(upserted[:4], upserted[4:])
+        self.assertEqual(len(set(e["_id"] for e in upserted)), 4)
+        self.assertDictEqual(dict(nightscout.uploaded_entries), {})
+
+
+class TestDownloadTimeRange(unittest.TestCase):
+    def test_downloads_concurrently(self):
+        tconnect = TConnectApi()
+
+        start = datetime.datetime(2021, 4, 20, 12, 0)
+        end = datetime.datetime(2021, 4, 21, 12, 0)
+
+        # Each fake waits for the other to be called, so this only
+        # succeeds if both downloads are in progress at the same time.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fake_therapy_timeline(time_start, time_end):
+            barrier.wait()
+            return {"ciq": True}
+
+        def fake_therapy_timeline_csv(time_start, time_end):
+            barrier.wait()
+            return {"csv": True}
+
+        tconnect.controliq.therapy_timeline = fake_therapy_timeline
+        tconnect.ws2.therapy_timeline_csv = fake_therapy_timeline_csv
+
+        self.assertEqual(
+            download_time_range(tconnect, start, end),
+            ({"ciq": True}, {"csv": True}))
+
+    def test_ignores_ciq_404_before_feb_2020(self):
+        tconnect = TConnectApi()
+
+        start = datetime.datetime(2020, 1, 1, 12, 0)
+        end = datetime.datetime(2020, 1, 2, 12, 0)
+
+        def fake_therapy_timeline(time_start, time_end):
+            raise ApiException(404, "fake HTTP 404")
+
+        tconnect.controliq.therapy_timeline = fake_therapy_timeline
+        tconnect.ws2.therapy_timeline_csv = lambda time_start, time_end: {"csv": True}
+
+        self.assertEqual(
+            download_time_range(tconnect, start, end),
+            (None, {"csv": True}))
+
+    def test_raises_ciq_404_after_feb_2020(self):
+        tconnect = TConnectApi()
+
+        start = datetime.datetime(2021, 4, 20, 12, 0)
+        end = datetime.datetime(2021, 4, 21, 12, 0)
+
+        def fake_therapy_timeline(time_start, time_end):
+            raise ApiException(404, "fake HTTP 404")
+
+        tconnect.controliq.therapy_timeline = fake_therapy_timeline
+        tconnect.ws2.therapy_timeline_csv = lambda time_start, time_end: {"csv": True}
+
+        with self.assertRaises(ApiException) as cm:
+            download_time_range(tconnect, start, end)
+        self.assertEqual(cm.exception.status_code, 404)
+
+    def test_raises_ws2_error(self):
+        tconnect = TConnectApi()
+
+        start = datetime.datetime(2021, 4, 20, 12, 0)
+        end = datetime.datetime(2021, 4, 21, 12, 0)
+
+        def fake_therapy_timeline_csv(time_start, time_end):
+            raise ApiException(500, "fake HTTP 500")
+
+        tconnect.controliq.therapy_timeline = lambda time_start, time_end: {"ciq": True}
+        tconnect.ws2.therapy_timeline_csv = fake_therapy_timeline_csv
+
+        self.assertRaises(ApiException, download_time_range, tconnect, start, end)
 
 
 if __name__ == '__main__':
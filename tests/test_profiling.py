@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import pstats
+import tempfile
+import unittest
+import datetime
+import threading
+
+from tconnectsync import profiling
+from tconnectsync.api import TConnectApi
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.process import process_time_range
+
+from .standin import TConnectStandin, NightscoutStandin
+from .synthetic import SyntheticHistory
+
+def _busy():
+    return sum(i * i for i in range(1000))
+
+def _worker():
+    return _busy()
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'sync.pstats')
+        self.profiler = profiling.Profiler(self.path, top=10)
+        previous = profiling.configure(self.profiler)
+        self.addCleanup(profiling.configure, previous)
+
+    def functions(self):
+        return {name for _, _, name in pstats.Stats(self.path).stats}
+
+    def start_tconnect(self):
+        tconnect_server = TConnectStandin(SyntheticHistory(boluses_per_day=3)).start()
+        self.addCleanup(tconnect_server.stop)
+        patch = tconnect_server.patch_apis()
+        patch.__enter__()
+        self.addCleanup(patch.__exit__, None, None, None)
+        return tconnect_server
+
+class TestProfiler(ProfilingTestCase):
+    def test_cycle(self):
+        with profiling.cycle():
+            _busy()
+
+        self.assertIn('_busy', self.functions())
+        with open(self.path + '.txt') as f:
+            summary = f.read()
+        self.assertTrue(summary.startswith('Profile of 1 sync cycle(s), top 10 functions by cumulative time'))
+        self.assertIn('_busy', summary)
+
+    def test_cycles_accumulate(self):
+        for _ in range(3):
+            with profiling.cycle():
+                _busy()
+
+        self.assertEqual(self.profiler.cycles, 3)
+        calls = [stat[1] for func, stat in pstats.Stats(self.path).stats.items() if func[2] == '_busy']
+        self.assertEqual(calls, [3])
+
+    def test_failed_cycle_is_written(self):
+        with self.assertRaises(KeyError):
+            with profiling.cycle():
+                _busy()
+                raise KeyError()
+        self.assertIn('_busy', self.functions())
+
+    def test_propagate(self):
+        with profiling.cycle():
+            thread = threading.Thread(target=profiling.propagate(_worker))
+            thread.start()
+            thread.join()
+
+        self.assertIn('_worker', self.functions())
+
+    def test_disabled(self):
+        profiling.configure(None)
+        with profiling.cycle():
+            _busy()
+        self.assertIs(profiling.propagate(_worker), _worker)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(self.profiler.summary())
+
+class TestProfileSync(ProfilingTestCase):
+    def test_process_time_range(self):
+        self.start_tconnect()
+        nightscout_server = NightscoutStandin().start()
+        self.addCleanup(nightscout_server.stop)
+
+        tconnect = TConnectApi('email@email.com', 'password')
+        nightscout = NightscoutApi(nightscout_server.url, nightscout_server.secret)
+        self.addCleanup(nightscout.close)
+        day = datetime.datetime(2021, 4, 1)
+        process_time_range(tconnect, nightscout, day, day, pretend=False)
+
+        functions = self.functions()
+        # Parsing runs on a download thread
+        self.assertIn('_collect_therapy_timeline_csv', functions)
+        self.assertIn('process_bolus_events', functions)
+        self.assertIn('upload_entries', functions)
+
+    def test_cpu_stages(self):
+        tconnect_server = self.start_tconnect()
+        tconnect = TConnectApi(tconnect_server.email, tconnect_server.password)
+        day = datetime.datetime(2021, 4, 1)
+
+        added = profiling.profile_cpu_stages(tconnect, day, day, cycles=2)
+
+        self.assertGreater(added, 0)
+        self.assertEqual(self.profiler.cycles, 2)
+        # Only the unprofiled download makes requests
+        self.assertEqual(tconnect_server.requests['ciq_therapy_timeline'], 1)
+        self.assertEqual(tconnect_server.requests['ws2_csv'], 1)
+
+        functions = self.functions()
+        self.assertIn('_collect_therapy_timeline_csv', functions)
+        self.assertIn('process_bolus_events', functions)
+        self.assertNotIn('_login', functions)
+        self.assertNotIn('urlopen', functions)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import tempfile
+import unittest
+import datetime
+import threading
+from unittest import mock
+
+from tconnectsync.service import Account, AccountState, SyncService, load_accounts, create_service
+from tconnectsync.util.ratelimit import HostRateLimiter
+
+from .api.fake import TConnectApi, AndroidApi
+from .nightscout_fake import NightscoutApi
+from .standin import TConnectStandin, NightscoutStandin
+from .synthetic import SyntheticHistory
+
+def account_json(i, **kwargs):
+    return {
+        "NAME": "account%d" % i,
+        "TCONNECT_EMAIL": "email%d@email.com" % i,
+        "TCONNECT_PASSWORD": "password",
+        "PUMP_SERIAL_NUMBER": "1111111%d" % i,
+        "NS_URL": "https://ns%d.example.com/" % i,
+        "NS_SECRET": "secret",
+        **kwargs
+    }
+
+class TestLoadAccounts(unittest.TestCase):
+    def load(self, entries):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'accounts.json')
+            with open(path, 'w') as f:
+                json.dump(entries, f)
+            return load_accounts(path)
+
+    def test_load_accounts(self):
+        accounts = self.load([account_json(1), account_json(2, NAME=None)])
+
+        self.assertEqual(len(accounts), 2)
+        self.assertEqual(accounts[0].name, "account1")
+        self.assertEqual(accounts[0].email, "email1@email.com")
+        self.assertEqual(accounts[0].pump_serial_number, 11111111)
+        self.assertEqual(accounts[0].ns_url, "https://ns1.example.com/")
+        # The email is used if no name is given
+        self.assertEqual(accounts[1].name, "email2@email.com")
+
+    def test_invalid_accounts(self):
+        self.assertRaisesRegex(ValueError, "list of accounts", self.load, [])
+        self.assertRaisesRegex(ValueError, "missing NS_URL", self.load, [account_json(1, NS_URL="")])
+        self.assertRaisesRegex(ValueError, "must be a number", self.load, [account_json(1, PUMP_SERIAL_NUMBER="abc")])
+        self.assertRaisesRegex(ValueError, "unique", self.load, [account_json(1), account_json(1)])
+
+class TestCreateService(unittest.TestCase):
+    def test_shares_nightscout_sessions_per_host(self):
+        accounts = [
+            Account("a", "a@email.com", "password", 1, "https://ns.example.com/a/", "secret"),
+            Account("b", "b@email.com", "password", 2, "https://NS.example.com/b/", "secret"),
+            Account("c", "c@email.com", "password", 3, "https://other.example.com/", "secret"),
+        ]
+        service = create_service(accounts, None, None, False, max_workers=2)
+
+        sessions = [s.nightscout.session for s in service.states]
+        self.assertIs(sessions[0], sessions[1])
+        self.assertIsNot(sessions[0], sessions[2])
+        self.assertEqual(service.states[0].tconnect.email, "a@email.com")
+        self.assertIsInstance(service.states[0].tconnect.limiter, HostRateLimiter)
+
+        # Closing one account's API does not close the shared session
+        service.states[0].nightscout.close()
+        self.assertIs(service.states[1].nightscout.session, sessions[0])
+
+    def test_rate_limits_requests_per_host(self):
+        tconnect_server = TConnectStandin(SyntheticHistory(boluses_per_day=3)).start()
+        self.addCleanup(tconnect_server.stop)
+        nightscout_server = NightscoutStandin().start()
+        self.addCleanup(nightscout_server.stop)
+        patch = tconnect_server.patch_apis()
+        patch.__enter__()
+        self.addCleanup(patch.__exit__, None, None, None)
+
+        accounts = [Account("a", tconnect_server.email, tconnect_server.password, 1, nightscout_server.url, nightscout_server.secret)]
+        service = create_service(accounts, None, None, False, max_workers=1, requests_per_minute=60)
+        state = service.states[0]
+        self.addCleanup(state.nightscout.close)
+
+        # Records how many requests each server had received when each
+        # token was taken
+        acquired = []
+        def acquire(url, tokens=1):
+            server = nightscout_server if url.startswith(nightscout_server.url) else tconnect_server
+            acquired.append((server, sum(server.requests.values()), tokens))
+        state.tconnect.limiter.acquire = acquire
+
+        state.tconnect.ws2.therapy_timeline_csv(datetime.date(2021, 4, 1), datetime.date(2021, 4, 1))
+        state.nightscout.last_uploaded_entry('Temp Basal')
+
+        # Every request took one token before it was sent
+        for server in (tconnect_server, nightscout_server):
+            taken = [(received, tokens) for s, received, tokens in acquired if s is server]
+            self.assertListEqual(taken, [(i, 1) for i in range(sum(server.requests.values()))])
+        self.assertGreater(tconnect_server.requests['ws2_csv'], 0)
+
+class TestSyncService(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('tconnectsync.service.rolling_sleep_seconds', lambda time_diffs: 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start = datetime.datetime(2021, 4, 1, 12, 0)
+        self.end = datetime.datetime(2021, 4, 2, 12, 0)
+        self.polls = {}
+
+    def state(self, i, last_event_uploaded=None):
+        account = Account("account%d" % i, "email%d@email.com" % i, "password", i, "https://ns.example.com/", "secret")
+        tconnect = TConnectApi()
+        tconnect._android = AndroidApi()
+
+        self.polls[account.name] = 0
+        def fake_last_event_uploaded(serial_number):
+            self.assertEqual(serial_number, i)
+            self.polls[account.name] += 1
+            return {"maxPumpEventIndex": self.polls[account.name]}
+
+        tconnect._android.last_event_uploaded = last_event_uploaded or fake_last_event_uploaded
+        return AccountState(account, tconnect, NightscoutApi())
+
+    def run_until(self, service, condition, timeout=5):
+        thread = threading.Thread(target=service.run)
+        thread.start()
+
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.005)
+        service.stop()
+        thread.join(timeout)
+
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(condition())
+
+    def test_syncs_accounts_with_bounded_concurrency(self):
+        lock = threading.Lock()
+        running = 0
+        max_running = 0
+        synced = {}
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None, account=''):
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+                synced[account] = synced.get(account, 0) + 1
+            return 1
+
+        states = [self.state(i) for i in range(5)]
+        service = SyncService(states, self.start, self.end, False, max_workers=2, incremental=False)
+
+        with mock.patch('tconnectsync.service.process_time_range', fake_process_time_range):
+            self.run_until(service, lambda: len(synced) == 5 and min(synced.values()) >= 2)
+
+        self.assertEqual(max_running, 2)
+        # Cycle metrics are labelled with the account name
+        self.assertSetEqual(set(synced), {state.account.name for state in states})
+        for state in states:
+            self.assertGreaterEqual(state.syncs, 2)
+            self.assertEqual(state.failures, 0)
+
+    def test_failing_account_is_retried_without_affecting_others(self):
+        def failing_last_event_uploaded(serial_number):
+            raise ValueError("t:connect is down")
+
+        synced = []
+        def fake_process_time_range(tconnect, nightscout, time_start, time_end, pretend, synced_until=None, account=''):
+            synced.append(tconnect)
+            return 1
+
+        states = [self.state(0, failing_last_event_uploaded), self.state(1)]
+        service = SyncService(states, self.start, self.end, False, max_workers=1, incremental=False)
+
+        with mock.patch('tconnectsync.service.process_time_range', fake_process_time_range), \
+             mock.patch('tconnectsync.service.RETRY_SECONDS', 0.01):
+            self.run_until(service, lambda: states[0].failures >= 3 and len(synced) >= 3)
+
+        self.assertEqual(states[0].syncs, 0)
+        self.assertTrue(all(t is states[1].tconnect for t in synced))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+import datetime
+from unittest import mock
+
+from tconnectsync.api import TConnectApi
+from tconnectsync.api.ws2 import WS2Api
+from tconnectsync.api.common import ApiException, ApiLoginException
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.process import process_time_range
+
+from .standin import TConnectStandin, NightscoutStandin
+from .synthetic import SyntheticHistory
+
+class TestStandinServers(unittest.TestCase):
+    def start_servers(self, **kwargs):
+        self.tconnect_server = TConnectStandin(SyntheticHistory(boluses_per_day=3, cgm_gap_rate=0), **kwargs).start()
+        self.addCleanup(self.tconnect_server.stop)
+        self.nightscout_server = NightscoutStandin().start()
+        self.addCleanup(self.nightscout_server.stop)
+
+        patch = self.tconnect_server.patch_apis()
+        patch.__enter__()
+        self.addCleanup(patch.__exit__, None, None, None)
+
+        tconnect = TConnectApi(self.tconnect_server.email, self.tconnect_server.password)
+        nightscout = NightscoutApi(self.nightscout_server.url, self.nightscout_server.secret)
+        self.addCleanup(nightscout.close)
+        return tconnect, nightscout
+
+    def test_process_time_range(self):
+        tconnect, nightscout = self.start_servers()
+        day = datetime.datetime(2021, 4, 1)
+
+        added = process_time_range(tconnect, nightscout, day, day, pretend=False)
+
+        treatments = list(self.nightscout_server.collections['treatments'].values())
+        self.assertGreater(added, 288)
+        self.assertEqual(len([t for t in treatments if t['eventType'] == 'Combo Bolus']), 3)
+        self.assertGreaterEqual(len([t for t in treatments if t['eventType'] == 'Temp Basal']), 288)
+        self.assertEqual(len(self.nightscout_server.collections['activity']), 1)
+
+        # A second sync of the same range finds everything already uploaded
+        process_time_range(tconnect, nightscout, day, day, pretend=False)
+        self.assertEqual(len(self.nightscout_server.collections['treatments']), len(treatments))
+        self.assertEqual(self.tconnect_server.requests['login'], 1)
+
+    def test_ws2_soft_rate_limit_is_retried(self):
+        tconnect, _ = self.start_servers()
+        self.tconnect_server.fail_next('ws2_csv', 2)
+
+        with mock.patch.object(WS2Api, 'RETRY_BACKOFF_SECONDS', 0):
+            data = tconnect.ws2.therapy_timeline_csv('04-01-2021', '04-01-2021')
+
+        self.assertEqual(len(data['readingData']), 288)
+        self.assertEqual(self.tconnect_server.requests['ws2_csv'], 3)
+        self.assertEqual(self.tconnect_server.errors['ws2_csv'], 2)
+
+        self.tconnect_server.fail_next('ws2_csv', 3)
+        with mock.patch.object(WS2Api, 'RETRY_BACKOFF_SECONDS', 0):
+            self.assertRaises(ApiException, tconnect.ws2.therapy_timeline_csv, '04-01-2021', '04-01-2021')
+
+    def test_controliq_invalid_credentials(self):
+        self.start_servers()
+        tconnect = TConnectApi(self.tconnect_server.email, 'wrong password')
+
+        with self.assertRaises(ApiLoginException):
+            tconnect.controliq
+
+    def test_android_token_refresh(self):
+        # Tokens which expire within five minutes are renewed before each request
+        tconnect, _ = self.start_servers(token_lifetime_seconds=120)
+
+        android = tconnect.android
+        self.tconnect_server.event_index = 5
+        self.assertEqual(android.last_event_uploaded(11111111)['maxPumpEventIndex'], 5)
+        self.assertEqual(android.last_event_uploaded(11111111)['maxPumpEventIndex'], 5)
+
+        # One login, then a refresh before each request
+        self.assertEqual(self.tconnect_server.requests['oauth_token'], 3)
+        self.assertEqual(self.tconnect_server.requests['last_event_uploaded'], 2)
+
+    def test_latency(self):
+        tconnect, nightscout = self.start_servers(latency=0.05)
+
+        start = time.perf_counter()
+        tconnect.ws2.therapy_timeline_csv('04-01-2021', '04-01-2021')
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+        # The Nightscout server has no latency
+        self.assertEqual(nightscout.api_status()['status'], 'ok')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+
+from tconnectsync.api.ws2 import WS2Api
+from tconnectsync.sync.basal import process_ciq_basal_events
+from tconnectsync.sync.bolus import process_bolus_events
+
+from .synthetic import SyntheticHistory, BOLUS_HEADERS
+
+class TestSyntheticHistory(unittest.TestCase):
+    day = datetime.date(2021, 4, 1)
+
+    def parse_csv(self, history, start, end):
+        return WS2Api('userGuid')._parse_therapy_timeline_csv(history.therapy_timeline_csv(start, end))
+
+    def test_days_are_independent_of_range(self):
+        history = SyntheticHistory(seed=3)
+        week = self.parse_csv(history, self.day - datetime.timedelta(days=6), self.day)
+        day = self.parse_csv(history, self.day, self.day)
+
+        for section, rows in day.items():
+            self.assertTrue(rows, section)
+            self.assertEqual(week[section][-len(rows):], rows)
+
+    def test_csv_rows_match_headers(self):
+        history = SyntheticHistory(extended_bolus_fraction=1)
+        for row in history.bolus_rows(self.day):
+            self.assertEqual(len(row), len(BOLUS_HEADERS.split(',')))
+
+    def test_extended_boluses(self):
+        history = SyntheticHistory(boluses_per_day=3, extended_bolus_fraction=1)
+        events = process_bolus_events(self.parse_csv(history, self.day, self.day)["bolusData"])
+
+        self.assertEqual(len(events), 3)
+        for event in events:
+            self.assertEqual(event.extended_bolus, "1")
+            self.assertEqual(event.completion, "Completed")
+            self.assertIsNotNone(event.epoch)
+
+    def test_basal_is_zero_while_suspended(self):
+        history = SyntheticHistory(suspensions_per_day=3)
+        suspensions = history.suspensions(self.day)
+        rates = dict(history.basal_rates(self.day))
+        for start, _, _ in suspensions:
+            self.assertEqual(rates[start], 0)
+
+        events = process_ciq_basal_events(history.ciq_therapy_timeline(self.day, self.day))
+        self.assertEqual(len([e for e in events if e.suspend_reason]), len(set(t for t, _, _ in suspensions)))
+
+    def test_cgm_gaps(self):
+        self.assertEqual(len(list(SyntheticHistory(cgm_gap_rate=0).cgm_rows(self.day))), 288)
+        self.assertLess(len(list(SyntheticHistory(cgm_gap_rate=0.1).cgm_rows(self.day))), 288)
+
+if __name__ == '__main__':
+    unittest.main()
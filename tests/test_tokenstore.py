@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import stat
+import unittest
+import tempfile
+from unittest import mock
+
+import arrow
+
+from tconnectsync.tokenstore import TokenStore
+
+@unittest.skipUnless(TokenStore.available(), "cryptography is not installed")
+class TestTokenStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'tokens.json')
+        # Keep tests fast
+        patcher = mock.patch.object(TokenStore, 'PBKDF2_ITERATIONS', 1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def tokens(self, expires_in_minutes=60):
+        return {
+            "userGuid": "user_guid",
+            "accessToken": "access_tok",
+            "accessTokenExpiresAt": arrow.get().shift(minutes=expires_in_minutes).isoformat(),
+        }
+
+    def test_save_and_load(self):
+        store = TokenStore(self.path, 'passphrase')
+        self.assertIsNone(store.load('controliq', 'email@email.com'))
+
+        tokens = self.tokens()
+        store.save('controliq', 'email@email.com', tokens)
+        store.save('android', 'email@email.com', {**tokens, "accessToken": "android_tok"})
+
+        loaded = TokenStore(self.path, 'passphrase')
+        self.assertDictEqual(loaded.load('controliq', 'email@email.com'), tokens)
+        self.assertEqual(loaded.load('android', 'email@email.com')["accessToken"], "android_tok")
+        self.assertIsNone(loaded.load('controliq', 'other@email.com'))
+
+    def test_encrypted_at_rest(self):
+        TokenStore(self.path, 'passphrase').save('controliq', 'email@email.com', self.tokens())
+
+        with open(self.path, 'r') as f:
+            contents = f.read()
+        self.assertNotIn("access_tok", contents)
+        self.assertNotIn("email@email.com", contents)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_wrong_passphrase(self):
+        TokenStore(self.path, 'passphrase').save('controliq', 'email@email.com', self.tokens())
+
+        store = TokenStore(self.path, 'other')
+        self.assertIsNone(store.load('controliq', 'email@email.com'))
+
+        # Saving with a new passphrase replaces the unreadable store
+        store.save('controliq', 'email@email.com', self.tokens())
+        self.assertIsNotNone(TokenStore(self.path, 'other').load('controliq', 'email@email.com'))
+
+    def test_expired_tokens(self):
+        store = TokenStore(self.path, 'passphrase')
+
+        store.save('controliq', 'email@email.com', self.tokens(expires_in_minutes=2))
+        self.assertIsNone(store.load('controliq', 'email@email.com'))
+
+        store.save('controliq', 'email@email.com', self.tokens(expires_in_minutes=-60))
+        self.assertIsNone(store.load('controliq', 'email@email.com'))
+
+    def test_clear(self):
+        store = TokenStore(self.path, 'passphrase')
+        store.save('controliq', 'email@email.com', self.tokens())
+        store.clear('controliq', 'email@email.com')
+
+        self.assertIsNone(store.load('controliq', 'email@email.com'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import datetime
+import threading
+
+from tconnectsync import tracing
+from tconnectsync.api import TConnectApi
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.process import process_time_range
+
+from .standin import TConnectStandin, NightscoutStandin
+from .synthetic import SyntheticHistory
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.exporter = tracing.MemoryExporter()
+        previous = tracing.configure(self.exporter)
+        self.addCleanup(tracing.configure, previous)
+
+    def spans(self):
+        return {s.name: s for s in self.exporter.spans}
+
+class TestSpans(TracingTestCase):
+    def test_nesting(self):
+        with tracing.span('outer', key='value') as outer:
+            with tracing.span('inner'):
+                pass
+            self.assertIs(tracing.current_span(), outer)
+        self.assertIsNone(tracing.current_span())
+
+        spans = self.spans()
+        self.assertEqual([s.name for s in self.exporter.spans], ['inner', 'outer'])
+        self.assertEqual(spans['inner'].parent_id, spans['outer'].span_id)
+        self.assertIsNone(spans['outer'].parent_id)
+        self.assertEqual(spans['outer'].attrs, {'key': 'value'})
+        self.assertGreaterEqual(spans['outer'].duration, spans['inner'].duration)
+
+    def test_traced(self):
+        @tracing.traced()
+        def work(x):
+            with tracing.span('step'):
+                return x * 2
+
+        self.assertEqual(work(2), 4)
+        spans = self.spans()
+        self.assertEqual(spans['step'].parent_id, spans['work'].span_id)
+
+    def test_error(self):
+        with self.assertRaises(KeyError):
+            with tracing.span('failing'):
+                raise KeyError()
+        self.assertEqual(self.spans()['failing'].attrs['error'], 'KeyError')
+        self.assertIsNone(tracing.current_span())
+
+    def test_propagate(self):
+        with tracing.span('parent'):
+            thread = threading.Thread(target=tracing.propagate(self._child))
+            thread.start()
+            thread.join()
+
+        spans = self.spans()
+        self.assertEqual(spans['child'].parent_id, spans['parent'].span_id)
+        self.assertNotEqual(spans['child'].thread_id, spans['parent'].thread_id)
+
+    def _child(self):
+        with tracing.span('child'):
+            pass
+
+    def test_disabled(self):
+        tracing.configure(None)
+        with tracing.span('ignored') as s:
+            self.assertIsNone(s)
+            self.assertIsNone(tracing.current_span())
+        self.assertEqual(self.exporter.spans, [])
+
+class TestExporters(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write_spans(self, format):
+        path = os.path.join(self.dir, 'trace')
+        exporter = tracing.file_exporter(path, format)
+        previous = tracing.configure(exporter)
+        try:
+            with tracing.span('outer'):
+                with tracing.span('inner', status=200):
+                    pass
+        finally:
+            tracing.configure(previous)
+            exporter.close()
+
+        with open(path) as f:
+            return f.read()
+
+    def test_json_lines(self):
+        spans = [json.loads(line) for line in self.write_spans('jsonl').splitlines()]
+        self.assertEqual([s['name'] for s in spans], ['inner', 'outer'])
+        self.assertEqual(spans[0]['parent_id'], spans[1]['id'])
+        self.assertEqual(spans[0]['attrs'], {'status': 200})
+
+    def test_chrome_trace(self):
+        text = self.write_spans('chrome')
+        # The array is left unterminated, as the format allows
+        events = json.loads(text.rstrip().rstrip(',') + ']')
+        self.assertEqual([e['name'] for e in events], ['inner', 'outer'])
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertIsInstance(event['ts'], int)
+            self.assertIsInstance(event['dur'], int)
+        self.assertEqual(events[0]['args']['parent_id'], events[1]['args']['id'])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            tracing.file_exporter(os.path.join(self.dir, 'trace'), 'xml')
+
+class TestProcessTimeRangeSpans(TracingTestCase):
+    def test_process_time_range(self):
+        tconnect_server = TConnectStandin(SyntheticHistory(boluses_per_day=3)).start()
+        self.addCleanup(tconnect_server.stop)
+        nightscout_server = NightscoutStandin().start()
+        self.addCleanup(nightscout_server.stop)
+        patch = tconnect_server.patch_apis()
+        patch.__enter__()
+        self.addCleanup(patch.__exit__, None, None, None)
+
+        tconnect = TConnectApi(tconnect_server.email, tconnect_server.password)
+        nightscout = NightscoutApi(nightscout_server.url, nightscout_server.secret)
+        self.addCleanup(nightscout.close)
+        day = datetime.datetime(2021, 4, 1)
+        process_time_range(tconnect, nightscout, day, day, pretend=False)
+
+        by_id = {s.span_id: s for s in self.exporter.spans}
+        def parent(name):
+            return by_id[self.spans()[name].parent_id].name
+
+        self.assertGreater(self.spans()['process_time_range'].attrs['added'], 0)
+        self.assertEqual(parent('controliq_login'), 'download')
+        self.assertEqual(parent('download'), 'process_time_range')
+        self.assertEqual(parent('download_ciq'), 'download')
+        self.assertEqual(parent('download_csv'), 'download')
+        self.assertEqual(parent('parse_csv'), 'download_csv')
+        for name in ('process_basal', 'ns_write_basal_events', 'process_bolus', 'ns_write_bolus_events', 'process_iob', 'ns_write_iob_events'):
+            self.assertEqual(parent(name), 'process_time_range')
+
+        requests = [s for s in self.exporter.spans if s.attrs.get('api') == 'nightscout']
+        self.assertTrue(requests)
+        self.assertTrue(all(by_id[s.parent_id].name.startswith('ns_write_') for s in requests))
+        self.assertIn('ws2', [s.attrs.get('api') for s in self.exporter.spans])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import unittest
+import requests
+from unittest import mock
+from requests.adapters import HTTPAdapter
+
+from tconnectsync.util.http import RateLimitedAdapter, limited_session
+
+class TestLimitedSession(unittest.TestCase):
+    def test_acquires_before_sending(self):
+        events = []
+        class RecordingLimiter:
+            def acquire(self, url, tokens=1):
+                events.append(('acquire', url))
+
+        def fake_send(adapter, request, *args, **kwargs):
+            events.append(('send', request.url))
+            response = requests.Response()
+            response.status_code = 200
+            response.url = request.url
+            response.request = request
+            response._content = b''
+            return response
+
+        limiter = RecordingLimiter()
+        session = limited_session(limiter, pool_maxsize=2)
+        self.assertIsInstance(session.get_adapter('https://ns.example.com/'), RateLimitedAdapter)
+        self.assertIs(session.get_adapter('http://ns.example.com/').limiter, limiter)
+
+        with mock.patch.object(HTTPAdapter, 'send', fake_send):
+            session.get('https://ns.example.com/api/v1/status.json')
+            session.get('https://ns.example.com/api/v1/treatments')
+
+        self.assertListEqual(events, [
+            ('acquire', 'https://ns.example.com/api/v1/status.json'),
+            ('send', 'https://ns.example.com/api/v1/status.json'),
+            ('acquire', 'https://ns.example.com/api/v1/treatments'),
+            ('send', 'https://ns.example.com/api/v1/treatments'),
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from tconnectsync.util.ratelimit import TokenBucket, HostRateLimiter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+
+class TestTokenBucket(unittest.TestCase):
+    def test_initial_burst_up_to_capacity(self):
+        c = FakeClock()
+        bucket = TokenBucket(1, capacity=3, clock=c.clock, sleep=c.sleep)
+
+        for _ in range(3):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertListEqual(c.sleeps, [])
+
+    def test_waits_for_refill(self):
+        c = FakeClock()
+        bucket = TokenBucket(0.5, capacity=2, clock=c.clock, sleep=c.sleep)
+
+        bucket.acquire(2)
+        self.assertEqual(bucket.acquire(1), 2)
+        self.assertListEqual(c.sleeps, [2])
+
+    def test_refill_is_capped_at_capacity(self):
+        c = FakeClock()
+        bucket = TokenBucket(1, capacity=2, clock=c.clock, sleep=c.sleep)
+
+        bucket.acquire(2)
+        c.now += 100
+        self.assertTrue(bucket.try_acquire(2))
+        self.assertFalse(bucket.try_acquire(1))
+
+    def test_acquire_more_than_capacity(self):
+        bucket = TokenBucket(1, capacity=2)
+        self.assertRaises(ValueError, bucket.acquire, 3)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+class TestHostRateLimiter(unittest.TestCase):
+    def test_buckets_per_host(self):
+        c = FakeClock()
+        limiter = HostRateLimiter(1, capacity=2, clock=c.clock, sleep=c.sleep)
+
+        limiter.acquire('https://tdcservices.tandemdiabetes.com/cloud/upload', 2)
+        limiter.acquire('https://nightscout.example.com/api/v1/treatments', 2)
+        self.assertListEqual(c.sleeps, [])
+
+        # Same host, different path and case
+        limiter.acquire('https://TDCSERVICES.tandemdiabetes.com/tconnect/controliq/api/')
+        self.assertListEqual(c.sleeps, [1])
+
+        self.assertIs(
+            limiter.bucket('https://nightscout.example.com/'),
+            limiter.bucket('https://nightscout.example.com/api/v1/entries'))
+        self.assertIsNot(
+            limiter.bucket('https://nightscout.example.com/'),
+            limiter.bucket('https://other.example.com/'))
+
+if __name__ == '__main__':
+    unittest.main()